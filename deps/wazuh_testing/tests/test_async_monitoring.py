@@ -0,0 +1,46 @@
+# Copyright (C) 2015-2021, Wazuh Inc.
+# Created by Wazuh, Inc. <info@wazuh.com>.
+# This program is free software; you can redistribute it and/or modify it under the terms of GPLv2
+import asyncio
+
+import pytest
+
+from wazuh_testing.tools.async_monitoring import AsyncSocketController
+
+
+@pytest.mark.parametrize('size', [False, True])
+def test_monitor_stops_when_the_peer_closes(size):
+    """Check that monitoring a socket ends as soon as the peer closes the connection instead of waiting the timeout."""
+    async def serve(reader, writer):
+        writer.write(b'\x05\x00\x00\x00hello' if size else b'hello')
+        await writer.drain()
+        writer.close()
+
+    async def monitor():
+        server = await asyncio.start_server(serve, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server, AsyncSocketController(('127.0.0.1', port), family='AF_INET') as controller:
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            with pytest.raises(ConnectionResetError):
+                await controller.monitor(callback=lambda message: None, timeout=10, size=size)
+            return loop.time() - start
+
+    assert asyncio.run(monitor()) < 5
+
+
+def test_receive_rejects_truncated_messages():
+    """Check that a message cut by the peer closing the connection is not returned as a complete one."""
+    async def serve(reader, writer):
+        writer.write(b'\x0a\x00\x00\x00hello')
+        await writer.drain()
+        writer.close()
+
+    async def receive():
+        server = await asyncio.start_server(serve, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server, AsyncSocketController(('127.0.0.1', port), family='AF_INET') as controller:
+            await controller.receive(size=True, timeout=10)
+
+    with pytest.raises(ConnectionResetError):
+        asyncio.run(receive())
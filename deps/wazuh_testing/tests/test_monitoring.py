@@ -0,0 +1,93 @@
+# Copyright (C) 2015-2021, Wazuh Inc.
+# Created by Wazuh, Inc. <info@wazuh.com>.
+# This program is free software; you can redistribute it and/or modify it under the terms of GPLv2
+import threading
+import time
+
+import pytest
+
+from wazuh_testing.tools.monitoring import FileMonitor, Queue, QueueMonitor, RingQueue, SharedFileTailer, \
+    SocketController
+
+
+@pytest.mark.parametrize('queue_class, args', [(Queue, ()), (RingQueue, (100,))])
+def test_put_wakes_up_all_cursors(queue_class, args):
+    """Check that a single put wakes up every monitor reading the same queue through a cursor."""
+    queue_item = queue_class(*args)
+    elapsed = {}
+
+    def monitor(name):
+        start = time.monotonic()
+        QueueMonitor(queue_item).start(timeout=5, callback=lambda item: item if item == 'hit' else None,
+                                       update_position=False)
+        elapsed[name] = time.monotonic() - start
+
+    threads = [threading.Thread(target=monitor, args=(name,)) for name in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.3)
+    queue_item.put('hit')
+    for thread in threads:
+        thread.join()
+
+    assert len(elapsed) == 3
+    assert all(seconds < 2 for seconds in elapsed.values()), elapsed
+
+
+def test_shared_tailer_subscribers_read_new_lines(tmp_path):
+    """Check that new subscribers of a shared tailer do not read the lines written before they subscribed."""
+    log_file = tmp_path / 'test.log'
+    log_file.write_text('old line\n')
+    tailer = SharedFileTailer.get(str(log_file), time_step=0.1)
+    try:
+        assert tailer.subscribe(from_start=True).get(timeout=5) == 'old line\n'
+        cursor = tailer.subscribe()
+        with open(log_file, 'a') as file:
+            file.write('new line\n')
+        assert cursor.get(timeout=5) == 'new line\n'
+    finally:
+        SharedFileTailer.shutdown_all()
+
+
+def test_shared_file_monitors_read_since_truncation(tmp_path):
+    """Check that shared file monitors use a single tailer and read the file since its last truncation."""
+    log_file = tmp_path / 'test.log'
+    log_file.write_text('old line\n')
+
+    def callback(line):
+        return line if line.startswith('line') else None
+
+    try:
+        SharedFileTailer.get(str(log_file), time_step=0.1).subscribe(from_start=True).get(timeout=5)
+        log_file.write_text('')
+        time.sleep(0.5)
+        first_monitor = FileMonitor(str(log_file), time_step=0.1, shared=True)
+        with open(log_file, 'a') as file:
+            file.write('line 1\nline 2\n')
+        assert first_monitor.start(timeout=5, callback=callback, accum_results=2).result() == ['line 1\n', 'line 2\n']
+
+        second_monitor = FileMonitor(str(log_file), time_step=0.1, shared=True)
+        assert second_monitor.start(timeout=5, callback=callback).result() == 'line 1\n'
+        assert first_monitor._shared_tailer is second_monitor._shared_tailer
+    finally:
+        SharedFileTailer.shutdown_all()
+
+
+def test_ring_queue_overrun_is_logged(caplog):
+    """Check that a warning is logged when a cursor falls behind a ring queue."""
+    ring = RingQueue(2)
+    cursor = ring.cursor()
+    for item in range(5):
+        ring.put(item)
+
+    assert cursor.get(block=False) == 3
+    assert 'dropped' in caplog.text
+
+
+def test_request_many_requires_size_on_tcp():
+    """Check that pipelined requests over TCP are rejected when their replies cannot be split."""
+    controller = SocketController(('localhost', 1514), family='AF_INET', connection_protocol='TCP',
+                                  open_at_start=False)
+
+    with pytest.raises(ValueError):
+        controller.request_many(['first', 'second'], size=False)
@@ -25,7 +25,7 @@ import pytest
 from jsonschema import validate
 from wazuh_testing import global_parameters, logger
 from wazuh_testing.tools import LOG_FILE_PATH, WAZUH_PATH
-from wazuh_testing.tools.monitoring import FileMonitor
+from wazuh_testing.tools.monitoring import FileMonitor, match_pattern
 from wazuh_testing.tools.time import TimeMachine
 from wazuh_testing.tools.file import generate_string
 
@@ -985,7 +985,7 @@ def change_conf_param(param, value):
 
 def callback_detect_end_scan(line):
     msg = r'.*Sending FIM event: (.+)$'
-    match = re.match(msg, line)
+    match = match_pattern(msg, line)
     if not match:
         return None
 
@@ -1001,7 +1001,7 @@ def callback_detect_scan_start(line):
     Detect the start of a scheduled scan or initial scan.
     """
     msg = r'.*Sending FIM event: (.+)$'
-    match = re.match(msg, line)
+    match = match_pattern(msg, line)
     if not match:
         return None
 
@@ -1017,7 +1017,7 @@ def callback_get_scan_timestap(line):
     Get the timestamp for the end of the initial scan or a scheduled scan
     """
     msg = r'.*Sending FIM event: (.+)$'
-    match = re.match(msg, line)
+    match = match_pattern(msg, line)
     if not match:
         return None
     try:
@@ -1032,7 +1032,7 @@ def callback_detect_event(line):
     Detect an 'event' type FIM log.
     """
     msg = r'.*Sending FIM event: (.+)$'
-    match = re.match(msg, line)
+    match = match_pattern(msg, line)
     if not match:
         return None
 
@@ -1046,7 +1046,7 @@ def callback_detect_event(line):
 
 def callback_detect_modified_event(line):
     msg = r'.*Sending FIM event: (.+)$'
-    match = re.match(msg, line)
+    match = match_pattern(msg, line)
     if not match:
         return None
 
@@ -1060,7 +1060,7 @@ def callback_detect_modified_event(line):
 
 def callback_detect_delete_event(line):
     msg = r'.*Sending FIM event: (.+)$'
-    match = re.match(msg, line)
+    match = match_pattern(msg, line)
     if not match:
         return None
 
@@ -1074,7 +1074,7 @@ def callback_detect_delete_event(line):
 
 def callback_detect_modified_event_with_inode_mtime(line):
     msg = r'.*Sending FIM event: (.+)$'
-    match = re.match(msg, line)
+    match = match_pattern(msg, line)
     if not match:
         return None
 
@@ -1090,7 +1090,7 @@ def callback_detect_modified_event_with_inode_mtime(line):
 
 
 def callback_detect_integrity_event(line):
-    match = re.match(r'.*Sending integrity control message: (.+)$', line)
+    match = match_pattern(r'.*Sending integrity control message: (.+)$', line)
     if match:
         return json.loads(match.group(1))
     return None
@@ -1125,21 +1125,21 @@ def callback_detect_synchronization(line):
 
 
 def callback_detect_anything(line):
-    match = re.match(r'.*', line)
+    match = match_pattern(r'.*', line)
     if match:
         return line
     return None
 
 
 def callback_ignore(line):
-    match = re.match(r".*Ignoring '.*?' '(.*?)' due to( sregex)? '.*?'", line)
+    match = match_pattern(r".*Ignoring '.*?' '(.*?)' due to( sregex)? '.*?'", line)
     if match:
         return match.group(1)
     return None
 
 
 def callback_restricted(line):
-    match = re.match(r".*Ignoring entry '(.*?)' due to restriction '.*?'", line)
+    match = match_pattern(r".*Ignoring entry '(.*?)' due to restriction '.*?'", line)
     if match:
         return match.group(1)
     return None
@@ -1152,14 +1152,14 @@ def callback_audit_health_check(line):
 
 
 def callback_audit_cannot_start(line):
-    match = re.match(r'.*Who-data engine could not start. Switching who-data to real-time.', line)
+    match = match_pattern(r'.*Who-data engine could not start. Switching who-data to real-time.', line)
     if match:
         return True
     return None
 
 
 def callback_audit_added_rule(line):
-    match = re.match(r'.*Added audit rule for monitoring directory: \'(.+)\'', line)
+    match = match_pattern(r'.*Added audit rule for monitoring directory: \'(.+)\'', line)
     if match:
         return match.group(1)
     return None
@@ -1172,14 +1172,14 @@ def callback_audit_rules_manipulation(line):
 
 
 def callback_audit_removed_rule(line):
-    match = re.match(r'.* Audit rule removed.', line)
+    match = match_pattern(r'.* Audit rule removed.', line)
     if match:
         return True
     return None
 
 
 def callback_audit_deleting_rule(line):
-    match = re.match(r'.*Deleting Audit rules\.', line)
+    match = match_pattern(r'.*Deleting Audit rules\.', line)
     if match:
         return True
     return None
@@ -1192,21 +1192,21 @@ def callback_audit_connection(line):
 
 
 def callback_audit_connection_close(line):
-    match = re.match(r'.*Audit: connection closed.', line)
+    match = match_pattern(r'.*Audit: connection closed.', line)
     if match:
         return True
     return None
 
 
 def callback_audit_loaded_rule(line):
-    match = re.match(r'.*Audit rule loaded: -w (.+) -p', line)
+    match = match_pattern(r'.*Audit rule loaded: -w (.+) -p', line)
     if match:
         return match.group(1)
     return None
 
 
 def callback_end_audit_reload_rules(line):
-    match = re.match(r'.*Audit rules reloaded\. Rules loaded: (.+)', line)
+    match = match_pattern(r'.*Audit rules reloaded\. Rules loaded: (.+)', line)
     if match:
         return match.group(1)
     return None
@@ -1219,13 +1219,13 @@ def callback_audit_event_too_long(line):
 
 
 def callback_audit_reloading_rules(line):
-    match = re.match(r'.*Reloading Audit rules', line)
+    match = match_pattern(r'.*Reloading Audit rules', line)
     if match:
         return True
 
 
 def callback_audit_reloaded_rule(line):
-    match = re.match(r'.*Already added audit rule for monitoring directory: \'(.+)\'', line)
+    match = match_pattern(r'.*Already added audit rule for monitoring directory: \'(.+)\'', line)
     if match:
         return match.group(1)
     return None
@@ -1238,21 +1238,21 @@ def callback_audit_key(line):
 
 
 def callback_audit_unable_dir(line):
-    match = re.match(r'.*Unable to add audit rule for \'(.+)\'', line)
+    match = match_pattern(r'.*Unable to add audit rule for \'(.+)\'', line)
     if match:
         return match.group(1)
     return None
 
 
 def callback_realtime_added_directory(line):
-    match = re.match(r'.*Directory added for real time monitoring: \'(.+)\'', line)
+    match = match_pattern(r'.*Directory added for real time monitoring: \'(.+)\'', line)
     if match:
         return match.group(1)
     return None
 
 
 def callback_configuration_error(line):
-    match = re.match(r'.* \(\d+\): Configuration error at', line)
+    match = match_pattern(r'.* \(\d+\): Configuration error at', line)
     if match:
         return True
     return None
@@ -1267,21 +1267,21 @@ def callback_symlink_scan_ended(line):
 
 def callback_integrity_message(line):
     if callback_detect_integrity_event(line):
-        match = re.match(r"(\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}).*({.*?})$", line)
+        match = match_pattern(r"(\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}).*({.*?})$", line)
         if match:
             return datetime.strptime(match.group(1), '%Y/%m/%d %H:%M:%S'), json.dumps(match.group(2))
 
 
 def callback_event_message(line):
     if callback_detect_event(line):
-        match = re.match(r"(\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}).*({.*?})$", line)
+        match = match_pattern(r"(\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}).*({.*?})$", line)
         if match:
             return datetime.strptime(match.group(1), '%Y/%m/%d %H:%M:%S'), json.dumps(match.group(2))
         return None
 
 
 def callback_empty_directories(line):
-    match = re.match(r'.*DEBUG: \(6338\): Empty directories tag found in the configuration.', line)
+    match = match_pattern(r'.*DEBUG: \(6338\): Empty directories tag found in the configuration.', line)
 
     if match:
         return True
@@ -1300,35 +1300,35 @@ def callback_non_existing_monitored_dir(line):
 
 
 def callback_num_inotify_watches(line):
-    match = re.match(r'.*Folders monitored with real-time engine: (\d+)', line)
+    match = match_pattern(r'.*Folders monitored with real-time engine: (\d+)', line)
 
     if match:
         return match.group(1)
 
 
 def callback_file_size_limit_reached(line):
-    match = re.match(r'.*File \'(.*)\' is too big for configured maximum size to perform diff operation\.', line)
+    match = match_pattern(r'.*File \'(.*)\' is too big for configured maximum size to perform diff operation\.', line)
 
     if match:
         return match.group(1)
 
 
 def callback_disk_quota_limit_reached(line):
-    match = re.match(r'.*The (.*) of the file size \'(.*)\' exceeds the disk_quota.*', line)
+    match = match_pattern(r'.*The (.*) of the file size \'(.*)\' exceeds the disk_quota.*', line)
 
     if match:
         return match.group(2)
 
 
 def callback_disk_quota_default(line):
-    match = re.match(r'.*Maximum disk quota size limit configured to \'(\d+) KB\'.*', line)
+    match = match_pattern(r'.*Maximum disk quota size limit configured to \'(\d+) KB\'.*', line)
 
     if match:
         return match.group(1)
 
 
 def callback_deleted_diff_folder(line):
-    match = re.match(r'.*Folder \'(.*)\' has been deleted.*', line)
+    match = match_pattern(r'.*Folder \'(.*)\' has been deleted.*', line)
 
     if match:
         return match.group(1)
@@ -1340,7 +1340,7 @@ def callback_non_existing_monitored_registry(line):
 
 
 def callback_registry_count_entries(line):
-    match = re.match(r".*Fim registry entries: (\d+)", line)
+    match = match_pattern(r".*Fim registry entries: (\d+)", line)
 
     if match:
         return match.group(1)
@@ -1367,18 +1367,18 @@ def callback_value_event(line):
 
 def callback_detect_max_files_per_second(line):
     msg = r'.*Maximum number of files read per second reached, sleeping\.'
-    match = re.match(msg, line)
+    match = match_pattern(msg, line)
 
     return match is not None
 
 
 def callback_detect_end_runtime_wildcards(line):
-    match = re.match(r".*Configuration wildcards update finalize\.", line)
+    match = match_pattern(r".*Configuration wildcards update finalize\.", line)
     return match is not None
 
 
 def callback_ignore_realtime_flag(line):
-    match = re.match(r".*Ignoring flag for real time monitoring on directory: (.+)$", line)
+    match = match_pattern(r".*Ignoring flag for real time monitoring on directory: (.+)$", line)
     if match:
         return True
 
@@ -1420,23 +1420,23 @@ def check_time_travel(time_travel: bool, interval: timedelta = timedelta(hours=1
 
 
 def callback_configuration_warning(line):
-    match = re.match(r'.*WARNING: \(\d+\): Invalid value for element', line)
+    match = match_pattern(r'.*WARNING: \(\d+\): Invalid value for element', line)
     if match:
         return True
     return None
 
 
 def callback_warn_max_dir_monitored(line):
-    match = re.match(r'.*Maximum number of directories to be monitored in the same tag reached \(\d+\) '
-                     r'Excess are discarded: \'(.+)\'', line)
+    match = match_pattern(r'.*Maximum number of directories to be monitored in the same tag reached \(\d+\) '
+                          r'Excess are discarded: \'(.+)\'', line)
     if match:
         return match.group(1)
     return None
 
 
 def callback_max_registry_monitored(line):
-    match = re.match(r'.*Maximum number of registries to be monitored in the same tag reached \(\d+\) '
-                     r'Excess are discarded: \'(.+)\'', line)
+    match = match_pattern(r'.*Maximum number of registries to be monitored in the same tag reached \(\d+\) '
+                          r'Excess are discarded: \'(.+)\'', line)
 
     if match:
         return match.group(1)
@@ -1444,9 +1444,9 @@ def callback_max_registry_monitored(line):
 
 def callback_delete_watch(line):
     if sys.platform == 'win32':
-        match = re.match(r".*Realtime watch deleted for '(\S+)'", line)
+        match = match_pattern(r".*Realtime watch deleted for '(\S+)'", line)
     else:
-        match = re.match(r".*Inotify watch deleted for '(\S+)'", line)
+        match = match_pattern(r".*Inotify watch deleted for '(\S+)'", line)
 
     if match:
         return match.group(1)
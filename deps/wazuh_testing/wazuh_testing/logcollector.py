@@ -1,5 +1,4 @@
 import os
-import re
 import shutil
 import stat
 import sys
@@ -84,7 +83,7 @@ else:
 
 
 def callback_missing_element_error(line):
-    match = re.match(r'.* \(\d+\): Missing \'(.+)\' element.', line)
+    match = monitoring.match_pattern(r'.* \(\d+\): Missing \'(.+)\' element.', line)
     if match:
         return True
     return None
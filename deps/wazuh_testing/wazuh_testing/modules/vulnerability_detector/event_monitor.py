@@ -47,7 +47,7 @@ def check_vuln_detector_event(file_monitor=None, callback='', error_message=None
         prefix (str): log pattern regex
         accum_results (int): Accumulation of matches.
     """
-    file_monitor = FileMonitor(file_to_monitor) if file_monitor is None else file_monitor
+    file_monitor = FileMonitor(file_to_monitor, shared=True) if file_monitor is None else file_monitor
     error_message = f"Could not find this event in {file_to_monitor}: {callback}" if error_message is None else \
         error_message
 
@@ -1,11 +1,15 @@
 import argparse
+import asyncio
+import json
 import logging
 import os
+from fractions import Fraction
 from multiprocessing import Process
 from time import sleep
 
 import wazuh_testing.tools.agent_simulator as ag
 from wazuh_testing import TCP
+from wazuh_testing.tools.client_keys import add_client_keys_entries
 
 logging.basicConfig(level=logging.INFO)
 
@@ -34,6 +38,33 @@ def parse_custom_labels(labels):
     return custom_labels
 
 
+def parse_balance_ratio(balance_ratio):
+    """Parse the EPS/agent ratios of the balance mode.
+
+    Args:
+        balance_ratio (list): Default ratio and ratios of specific modules, in format ["1000", "module1:ratio1"].
+
+    Returns:
+        tuple: Default EPS/agent ratio and dict with the ratio of each specific module. {module1:ratio1}
+
+    Raises:
+        ValueError: If a ratio is not a positive integer.
+    """
+    default_ratio = 1000
+    modules_ratio = {}
+
+    for item in balance_ratio:
+        module, _, ratio = item.rpartition(':')
+        if not ratio.isdigit() or int(ratio) == 0:
+            raise ValueError(f"Invalid balance ratio '{item}'. It must be a positive integer")
+        if module:
+            modules_ratio[module] = int(ratio)
+        else:
+            default_ratio = int(ratio)
+
+    return default_ratio, modules_ratio
+
+
 def process_script_parameters(args):
     """Process script parameters and edit them if necessary.
 
@@ -89,6 +120,32 @@ def set_agent_modules_and_eps(agent, active_modules, modules_eps):
     logger.info(agent.modules)
 
 
+def get_agents_credentials(agents_number, args):
+    """Enroll the agents in bulk or add them to the manager client keys file, if the script parameters require it.
+
+    Args:
+        agents_number (int): Number of agents.
+        args (argparse.Namespace): Script args.
+
+    Returns:
+        list: Tuples with the ID, name and key of each agent. They are None if each agent has to enroll by itself.
+    """
+    if args.client_keys is None and args.registration_workers <= 1:
+        return [(None, None, None)] * agents_number
+
+    names = [ag.generate_agent_name(args.os) for _ in range(agents_number)]
+
+    if args.client_keys is not None:
+        logger.info(f"Adding {agents_number} agents to {args.client_keys}")
+        return add_client_keys_entries(names, client_keys_path=args.client_keys)
+
+    logger.info(f"Enrolling {agents_number} agents with {args.registration_workers} workers")
+    registration_address = args.manager_address if args.manager_registration_address is None \
+        else args.manager_registration_address
+
+    return ag.register_agents(names, registration_address, workers=args.registration_workers)
+
+
 def create_agents(args):
     """Create a list of agents according to script parameters like the mode, EPS...
 
@@ -99,9 +156,14 @@ def create_agents(args):
         list: List of agents to run.
     """
     agents = []
+    agents_modules = []
     custom_labels = parse_custom_labels(args.labels)
 
-    if args.balance_mode:
+    load_plan = None
+
+    if args.load_plan is not None:
+        load_plan = read_load_plan(args.load_plan)
+    elif args.balance_mode:
         modules_eps_data = []
 
         for module, eps in zip(args.modules, args.modules_eps):
@@ -110,35 +172,50 @@ def create_agents(args):
                 'module': module
             })
 
-        distribution_list = calculate_eps_distribution(modules_eps_data, args.balance_ratio)
+        max_eps_per_agent, modules_max_eps = parse_balance_ratio(args.balance_ratio)
+        load_plan = get_load_plan(modules_eps_data, max_eps_per_agent, modules_max_eps)
+        check_load_plan(load_plan, {item['module']: item['remaining'] for item in modules_eps_data})
 
-        logger.info(f"Agents-EPS distributon = {distribution_list}")
+    if load_plan is not None:
+        logger.info(f"Agents-EPS distributon = {load_plan}")
 
-        for item in distribution_list:  # item[0] = modules - item[1] = eps
-            agent = ag.Agent(manager_address=args.manager_address, os=args.os,
-                             registration_address=args.manager_registration_address,
-                             version=args.version, fixed_message_size=args.fixed_message_size, labels=custom_labels)
-            set_agent_modules_and_eps(agent, item[0].split(' ') + ['keepalive', 'receive_messages'],
-                                      item[1].split(' ') + ['0', '0'])
-            agents.append(agent)
+        if args.save_load_plan is not None:
+            save_load_plan(load_plan, args.save_load_plan)
+
+        for group in load_plan:
+            modules = list(group['modules'])
+            eps = [str(module_eps) for module_eps in group['modules'].values()]
+            for module in ('keepalive', 'receive_messages'):
+                if module not in modules:
+                    modules.append(module)
+                    eps.append('0')
+            agents_modules.extend([(modules, eps)] * group['agents'])
     else:
-        for _ in range(args.agents_number):
-            agent = ag.Agent(manager_address=args.manager_address, os=args.os,
-                             registration_address=args.manager_registration_address,
-                             version=args.version, fixed_message_size=args.fixed_message_size, labels=custom_labels)
-            set_agent_modules_and_eps(agent, args.modules, args.modules_eps)
-            agents.append(agent)
+        agents_modules = [(args.modules, args.modules_eps)] * args.agents_number
+
+    credentials = get_agents_credentials(len(agents_modules), args)
+
+    for (modules, modules_eps), (agent_id, agent_name, agent_key) in zip(agents_modules, credentials):
+        agent = ag.Agent(manager_address=args.manager_address, os=args.os,
+                         registration_address=args.manager_registration_address,
+                         version=args.version, fixed_message_size=args.fixed_message_size, labels=custom_labels,
+                         event_pool_size=args.event_pool_size, max_eps=args.agent_eps,
+                         background_decoder=args.background_decoder,
+                         id=agent_id, name=agent_name, key=agent_key)
+        set_agent_modules_and_eps(agent, modules, modules_eps)
+        agents.append(agent)
 
     return agents
 
 
-def create_injectors(agents, manager_address, protocol):
+def create_injectors(agents, manager_address, protocol, flush_interval=0):
     """Create injectos objects from list of agents and connection parameters.
 
     Args:
         agents (list): List of agents to create the injectors (1 injector/agent).
         manager_address (str): Manager IP address to connect the agents.
         protocol (str): TCP or UDP protocol to connect the agents to the manager.
+        flush_interval (float): Seconds between writes of the buffered TCP events. 0 to write each event at once.
 
     Returns:
         list: List of injector objects.
@@ -148,7 +225,7 @@ def create_injectors(agents, manager_address, protocol):
     logger.info(f"Starting {len(agents)} agents.")
 
     for agent in agents:
-        sender = ag.Sender(manager_address, protocol=protocol)
+        sender = ag.Sender(manager_address, protocol=protocol, flush_interval=flush_interval)
         injectors.append(ag.Injector(sender, agent))
 
     return injectors
@@ -174,9 +251,30 @@ def stop(injector):
     Args:
         injector (Injector): Injector object.
     """
+    log_rates([injector])
     injector.stop_receive()
 
 
+def log_rates(injectors):
+    """Log the target and achieved EPS of each module, added up for a set of injectors.
+
+    Args:
+        injectors (list): List of injector objects.
+    """
+    rates = {}
+
+    for injector in injectors:
+        for module, stats in injector.get_rates().items():
+            module_rates = rates.setdefault(module, {'target_eps': 0, 'achieved_eps': 0, 'events': 0})
+            for key in module_rates:
+                module_rates[key] += stats[key] or 0
+
+    for module, module_rates in rates.items():
+        target = f"{module_rates['target_eps']:.2f}" if module_rates['target_eps'] else 'unlimited'
+        logger.info(f"{module}: {module_rates['events']} events sent - {module_rates['achieved_eps']:.2f} EPS "
+                    f"achieved of {target} EPS target")
+
+
 def run(injectors, time_alive):
     """Run each injector in a separated process.
 
@@ -196,13 +294,102 @@ def run(injectors, time_alive):
         agent_process.join()
 
 
-def calculate_eps_distribution(data, max_eps_per_agent):
+def start_async_worker(agents, manager_address, protocol, time_alive):
+    """Run a group of agents as coroutines of the event loop of the current process.
+
+    Args:
+        agents (list): List of agents to run.
+        manager_address (str): Manager IP address to connect the agents.
+        protocol (str): TCP or UDP protocol to connect the agents to the manager.
+        time_alive (int): Period of time in seconds during the agents will be running.
+    """
+    logger.info(f"Starting {len(agents)} agents.")
+    injectors = asyncio.run(ag.run_async_agents(agents, manager_address, protocol=protocol, time_alive=time_alive))
+    log_rates(injectors)
+
+
+def run_async(agents, manager_address, protocol, time_alive, workers):
+    """Distribute the agents between a set of worker processes, each one running its agents with asyncio.
+
+    Args:
+        agents (list): List of agents to run.
+        manager_address (str): Manager IP address to connect the agents.
+        protocol (str): TCP or UDP protocol to connect the agents to the manager.
+        time_alive (int): Period of time in seconds during the agents will be running.
+        workers (int): Number of worker processes.
+    """
+    workers = max(1, min(workers, len(agents)))
+    processes = [Process(target=start_async_worker, args=(agents[worker::workers], manager_address, protocol,
+                                                          time_alive)) for worker in range(workers)]
+
+    for worker_process in processes:
+        worker_process.start()
+
+    for worker_process in processes:
+        worker_process.join()
+
+
+def iter_eps_distribution(data, max_eps_per_agent, modules_max_eps=None):
+    """Distribute the EPS of the modules among the agents, filling each agent before using the next one.
+
+    An agent can send up to `max_eps_per_agent` EPS, or the ratio of the module in `modules_max_eps`. When an agent
+    mixes modules, each one takes its share of the agent capacity, e.g. 25 EPS of a module with a ratio of 50 take half
+    of the agent. Runs of full agents of a single module are computed at once, so the time and memory used do not
+    depend on the number of agents.
+
+    Args:
+        data (list): List of dictionaries containing information about the module and the remaining EPS to be
+                     distributed.
+        max_eps_per_agent (int): Maximum EPS load to be distributed to an agent.
+        modules_max_eps (dict): Maximum EPS load of specific modules in an agent. {module:max_eps}
+
+    Yields:
+        tuple: Number of consecutive agents with the same load and dict with the EPS of each module in them.
+    """
+    modules_max_eps = {} if modules_max_eps is None else modules_max_eps
+    agent_modules = {}
+    agent_load = Fraction(0)
+
+    for item in data:
+        module = item['module']
+        remaining = int(item['remaining'])
+        ratio = modules_max_eps.get(module, max_eps_per_agent)
+
+        if remaining <= 0:
+            continue
+
+        # Fill the agent that is partially loaded by the previous modules
+        if agent_modules:
+            eps = min(remaining, int((1 - agent_load) * ratio))
+            if eps:
+                agent_modules[module] = agent_modules.get(module, 0) + eps
+                agent_load += Fraction(eps, ratio)
+                remaining -= eps
+            if remaining or agent_load == 1:
+                yield 1, agent_modules
+                agent_modules = {}
+                agent_load = Fraction(0)
+
+        if remaining >= ratio:
+            yield remaining // ratio, {module: ratio}
+            remaining %= ratio
+
+        if remaining:
+            agent_modules = {module: remaining}
+            agent_load = Fraction(remaining, ratio)
+
+    if agent_modules:
+        yield 1, agent_modules
+
+
+def calculate_eps_distribution(data, max_eps_per_agent, modules_max_eps=None):
     """Calculate the distribution of agents and EPS according to the input ratio.
 
     Args:
         data (list): List of dictionaries containing information about the module and the remaining EPS to be
                      distributed.
         max_eps_per_agent (int): Maximum EPS load to be distributed to an agent.
+        modules_max_eps (dict): Maximum EPS load of specific modules in an agent. {module:max_eps}
 
     Returns:
         list: List of tuples, containing in the first position the modules to be launched by that agent, and in the
@@ -222,59 +409,108 @@ def calculate_eps_distribution(data, max_eps_per_agent):
             [('fim', '50'), ('fim', '50'), ('logcollector syscollector', '30 20'), ('syscollector', '50'),
             ('syscollector', '10')]
     """
+    distribution = []
 
-    # If there are no more items in the queue list then stop
-    if len(data) == 0:
-        return []
+    for agents, modules in iter_eps_distribution(data, max_eps_per_agent, modules_max_eps):
+        agent_parameters = (' '.join(modules), ' '.join(str(eps) for eps in modules.values()))
+        distribution.extend([agent_parameters] * agents)
 
-    # If there are no more EPS to distribute from the current queue, then move on to the next item.
-    if data[0]['remaining'] == 0:
-        data.pop(0)
-        return calculate_eps_distribution(data, max_eps_per_agent)
+    return distribution
 
-    # If there are enough EPS in the current queue to fill the EPS of an agent, then it is filled.
-    if data[0]['remaining'] >= max_eps_per_agent:
-        data[0]['remaining'] -= max_eps_per_agent
 
-        agent_parameters = (data[0]['module'], str(max_eps_per_agent))
+def get_load_plan(data, max_eps_per_agent, modules_max_eps=None):
+    """Get the load plan of the balance mode: the EPS of each module in each agent.
 
-        return [agent_parameters] + calculate_eps_distribution(data, max_eps_per_agent)
-    # If the agent instance supports higher eps than the remaining eps to be distributed from the current queue
-    else:
-        # Add the remaining EPS from the current queue
-        modules = data[0]['module']
-        current_load = data[0]['remaining']
-        eps = f"{current_load}"
-
-        # Remove the queue as all its eps have been distributed.
-        data.pop(0)
-
-        # As long as the maximum EPS load of the agent has not been supported.
-        while current_load < max_eps_per_agent:
-
-            # Exit the loop if there are no more queue items in the list.
-            if len(data) == 0:
-                break
-
-            # Remove the queue if there are no more EPS to distribute and check the next eps.
-            if data[0]['remaining'] == 0:
-                data.pop(0)
-            # If with the elements of the new queue we can fill the instance-agent eps.
-            elif data[0]['remaining'] > (max_eps_per_agent - current_load):
-                modules += f" {data[0]['module']}"
-                eps += f" {(max_eps_per_agent - current_load)}"
-                data[0]['remaining'] -= (max_eps_per_agent - current_load)
-                current_load = max_eps_per_agent
-            # Otherwise, take all EPS from the current queue and keep checking for the same agent.
-            else:
-                modules += f" {data[0]['module']}"
-                eps += f" {data[0]['remaining']}"
-                current_load += data[0]['remaining']
-                data[0]['remaining'] = 0
-
-        agent_parameters = (modules, eps)
-
-        return [agent_parameters] + calculate_eps_distribution(data, max_eps_per_agent)
+    Consecutive agents with the same load are grouped, so the plan of a large run takes a few entries.
+
+    Args:
+        data (list): List of dictionaries containing information about the module and the remaining EPS to be
+                     distributed.
+        max_eps_per_agent (int): Maximum EPS load to be distributed to an agent.
+        modules_max_eps (dict): Maximum EPS load of specific modules in an agent. {module:max_eps}
+
+    Returns:
+        list: Groups of agents, as dicts with the number of agents (`agents`) and the EPS of each module (`modules`).
+
+    Example:
+        >>> get_load_plan([{'remaining': 100, 'module': 'fim'}, {'remaining': 30, 'module': 'logcollector'}], 40)
+        [{'agents': 2, 'modules': {'fim': 40}}, {'agents': 1, 'modules': {'fim': 20, 'logcollector': 20}},
+        {'agents': 1, 'modules': {'logcollector': 10}}]
+    """
+    load_plan = []
+
+    for agents, modules in iter_eps_distribution(data, max_eps_per_agent, modules_max_eps):
+        if load_plan and load_plan[-1]['modules'] == modules:
+            load_plan[-1]['agents'] += agents
+        else:
+            load_plan.append({'agents': agents, 'modules': modules})
+
+    return load_plan
+
+
+def check_load_plan(load_plan, modules_eps=None):
+    """Check that a load plan is well-formed and, optionally, that it distributes the expected EPS.
+
+    Args:
+        load_plan (list): Load plan, as returned by `get_load_plan`.
+        modules_eps (dict): Expected total EPS of each module. Modules with 0 EPS are ignored. {module:eps}
+
+    Returns:
+        dict: Total EPS of each module in the plan.
+
+    Raises:
+        ValueError: If the plan is malformed or its EPS are not the expected ones.
+    """
+    total_eps = {}
+
+    for group in load_plan:
+        if not isinstance(group, dict) or not isinstance(group.get('agents'), int) or group['agents'] < 1 \
+                or not isinstance(group.get('modules'), dict):
+            raise ValueError(f"Invalid load plan group: {group}")
+        for module, eps in group['modules'].items():
+            if not isinstance(eps, int) or eps < 0:
+                raise ValueError(f"Invalid EPS for module '{module}' in load plan group: {group}")
+            total_eps[module] = total_eps.get(module, 0) + eps * group['agents']
+
+    if modules_eps is not None:
+        expected_eps = {module: int(eps) for module, eps in modules_eps.items() if int(eps)}
+        if {module: eps for module, eps in total_eps.items() if eps} != expected_eps:
+            raise ValueError(f"The load plan distributes {total_eps} EPS instead of {expected_eps}")
+
+    return total_eps
+
+
+def save_load_plan(load_plan, file_path):
+    """Write a load plan to a JSON file, so the run can be reproduced.
+
+    Args:
+        load_plan (list): Load plan, as returned by `get_load_plan`.
+        file_path (str): Path of the JSON file.
+    """
+    with open(file_path, 'w') as plan_file:
+        json.dump(load_plan, plan_file, indent=2)
+
+
+def read_load_plan(file_path):
+    """Read and check a load plan saved with `save_load_plan`.
+
+    Args:
+        file_path (str): Path of the JSON file.
+
+    Returns:
+        list: Load plan.
+
+    Raises:
+        ValueError: If the plan is malformed.
+    """
+    with open(file_path) as plan_file:
+        load_plan = json.load(plan_file)
+
+    if not isinstance(load_plan, list):
+        raise ValueError(f"Invalid load plan in {file_path}: it must be a list of agent groups")
+    check_load_plan(load_plan)
+
+    return load_plan
 
 
 def main():
@@ -317,14 +553,60 @@ def main():
     arg_parser.add_argument('-b', '--balance-mode', action='store_true', required=False,
                             help='Activate the balance mode. EPS will be distributed throughout all agents.')
 
-    arg_parser.add_argument('-i', '--balance-ratio', metavar='<balance_ratio>', type=int, required=False,
-                            default=1000, help='EPS/agent ratio. Can only be used if the parameter -b was specified',
-                            dest='balance_ratio')
+    arg_parser.add_argument('-i', '--balance-ratio', metavar='<balance_ratio>', type=str, nargs='+', required=False,
+                            default=['1000'], dest='balance_ratio',
+                            help='EPS/agent ratio, optionally followed by the ratios of specific modules as '
+                                 'module:ratio (e.g. 1000 syscollector:100). Can only be used if the parameter -b '
+                                 'was specified')
+
+    arg_parser.add_argument('-L', '--load-plan', metavar='<load_plan>', type=str, required=False, default=None,
+                            dest='load_plan', help='JSON load plan to replay, instead of the modules EPS and balance '
+                                                   'mode parameters')
+
+    arg_parser.add_argument('-S', '--save-load-plan', metavar='<save_load_plan>', type=str, required=False,
+                            default=None, dest='save_load_plan',
+                            help='Save the load plan of the balance mode to this JSON file, so it can be replayed')
 
     arg_parser.add_argument('-w', '--waiting-connection-time', metavar='<waiting_connection_time>', type=int,
                             help='Waiting time in seconds between agent registration and the sending of events.',
                             required=False, default=0, dest='waiting_connection_time')
 
+    arg_parser.add_argument('-R', '--registration-workers', metavar='<registration_workers>', type=int,
+                            required=False, default=1, dest='registration_workers',
+                            help='Number of agents enrolled at the same time')
+
+    arg_parser.add_argument('-k', '--client-keys', metavar='<client_keys_path>', type=str, required=False,
+                            default=None, dest='client_keys',
+                            help='Manager client.keys file. If set, the agents are added to it instead of enrolled')
+
+    arg_parser.add_argument('-P', '--event-pool-size', metavar='<event_pool_size>', type=int, required=False,
+                            default=0, dest='event_pool_size',
+                            help='Number of pre-rendered random variants of the syscollector and SCA events. '
+                                 'FIM events are always randomized one by one, since they follow the state of the '
+                                 'simulated files. Events are randomized one by one by default')
+
+    arg_parser.add_argument('-E', '--agent-eps', metavar='<agent_eps>', type=float, required=False, default=None,
+                            dest='agent_eps', help='Maximum EPS of each agent, shared by all its modules')
+
+    arg_parser.add_argument('-D', '--background-decoder', action='store_true', required=False,
+                            default=False, dest='background_decoder',
+                            help='Decode the manager messages in a different thread than the one reading them '
+                                 '(process engine)')
+
+    arg_parser.add_argument('-F', '--flush-interval', metavar='<flush_interval>', type=float, required=False,
+                            default=0, dest='flush_interval',
+                            help='Seconds between writes of the buffered TCP events of each agent (process engine). '
+                                 'Events are written one by one by default')
+
+    arg_parser.add_argument('-e', '--engine', metavar='<engine>', type=str, required=False, default='asyncio',
+                            choices=['asyncio', 'process'], dest='engine',
+                            help='Simulation engine: asyncio (agents as coroutines inside a pool of worker processes) '
+                                 'or process (one process per agent)')
+
+    arg_parser.add_argument('-W', '--workers', metavar='<workers>', type=int, required=False,
+                            default=os.cpu_count(), dest='workers',
+                            help='Number of worker processes of the asyncio engine')
+
     args = arg_parser.parse_args()
 
     process_script_parameters(args)
@@ -336,9 +618,12 @@ def main():
     # Waiting time to prevent CPU overload when registering many agents (registration + event generation).
     sleep(args.waiting_connection_time)
 
-    injectors = create_injectors(agents, args.manager_address, args.agent_protocol)
+    if args.engine == 'asyncio':
+        run_async(agents, args.manager_address, args.agent_protocol, args.simulation_time, args.workers)
+    else:
+        injectors = create_injectors(agents, args.manager_address, args.agent_protocol, args.flush_interval)
 
-    run(injectors, args.simulation_time)
+        run(injectors, args.simulation_time)
 
 
 if __name__ == "__main__":
@@ -11,14 +11,18 @@
 # Python 3.7 or greater
 # Dependencies: pip3 install pycryptodome
 
+import asyncio
 import hashlib
 import json
 import logging
 import os
+import queue
+import re
 import socket
 import ssl
 import threading
 import zlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 from itertools import cycle
 from random import randint, sample, choice, getrandbits
@@ -26,22 +30,165 @@ from stat import S_IFLNK, S_IFREG, S_IRWXU, S_IRWXG, S_IRWXO
 from string import ascii_letters, digits
 from struct import pack
 from sys import getsizeof
-from time import mktime, localtime, sleep, time
+from time import mktime, localtime, monotonic, sleep, time
 
 import wazuh_testing.data.syscollector as syscollector
 import wazuh_testing.data.winevt as winevt
 import wazuh_testing.wazuh_db as wdb
 from wazuh_testing import TCP
 from wazuh_testing import is_udp, is_tcp
+from wazuh_testing.tools.client_keys import add_client_keys_entries
 from wazuh_testing.tools.monitoring import wazuh_unpack, Queue
-from wazuh_testing.tools.remoted_sim import Cipher
-from wazuh_testing.tools.utils import retry, get_random_ip, get_random_string
+from wazuh_testing.tools.remoted_sim import CipherContext
+from wazuh_testing.tools.sockets import recv_frame
+from wazuh_testing.tools.utils import get_random_ip, get_random_string
 
 _data_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'data')
 
 os_list = ["debian7", "debian8", "debian9", "debian10", "ubuntu12.04",
            "ubuntu14.04", "ubuntu16.04", "ubuntu18.04", "mojave", "solaris11"]
 agent_count = 1
+_registration_context = None
+_registration_sessions = {}
+_keepalive_templates = None
+
+
+def get_default_os(count=None):
+    """Get the OS of an agent for which no OS has been specified.
+
+    Args:
+        count (int): Agent number. Default the current `agent_count`.
+
+    Returns:
+        str: Agent operating system.
+    """
+    count = agent_count if count is None else count
+
+    return os_list[count % len(os_list) - 1]
+
+
+def generate_agent_name(agent_os, count=None):
+    """Generate a random agent name.
+
+    Args:
+        agent_os (str): Agent operating system.
+        count (int): Agent number. Default the current `agent_count`.
+
+    Returns:
+        str: Agent name.
+    """
+    count = agent_count if count is None else count
+    random_string = ''.join(sample(f"0123456789{ascii_letters}", 16))
+
+    return f"{count}-{random_string}-{agent_os}"
+
+
+def get_keepalive_templates():
+    """Get the keep alive templates of each OS, reading them from keepalives.txt only the first time.
+
+    Returns:
+        dict: Keep alive template of each OS, with the <VERSION> and <MERGED_CHECKSUM> placeholders.
+    """
+    global _keepalive_templates
+
+    if _keepalive_templates is None:
+        templates = {}
+        template_os = None
+        with open(os.path.join(_data_path, 'keepalives.txt'), 'r') as fp:
+            for line in fp:
+                if line.strip("\n") in os_list:
+                    # Only the first template of each OS is used
+                    template_os = line.strip("\n") if line.strip("\n") not in templates else None
+                    if template_os is not None:
+                        templates[template_os] = []
+                elif template_os is not None:
+                    templates[template_os].append(line)
+        _keepalive_templates = {agent_os: ''.join(lines) for agent_os, lines in templates.items()}
+
+    return _keepalive_templates
+
+
+def _get_registration_context():
+    """Get the TLS context shared by all the enrollments, so their sessions can be resumed.
+
+    Returns:
+        ssl.SSLContext: Client context without certificate verification.
+    """
+    global _registration_context
+
+    if _registration_context is None:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        _registration_context = context
+
+    return _registration_context
+
+
+def register_agent(name, registration_address, authd_password=None, retries=0, registration_port=1515):
+    """Enroll an agent in the manager.
+
+    All the enrollments share the same TLS context and resume the last session established with each manager, so
+    only the first handshake is a full one.
+
+    Args:
+        name (str): Agent name.
+        registration_address (str): Manager registration IP address.
+        authd_password (str, optional): Password for registration if needed.
+        retries (int, optional): Number of retries in case of error, waiting with an exponential backoff from 0.5 to 6
+                                 seconds between them.
+        registration_port (int, optional): Manager registration port.
+
+    Returns:
+        str: ID of the agent.
+        str: Key of the agent.
+    """
+    if authd_password is None:
+        event = f"OSSEC A:'{name}'\n".encode()
+    else:
+        event = f"OSSEC PASS: {authd_password} OSSEC A:'{name}'\n".encode()
+
+    for attempt in range(retries + 1):
+        try:
+            context = _get_registration_context()
+            ssl_socket = context.wrap_socket(socket.socket(socket.AF_INET, socket.SOCK_STREAM),
+                                             server_hostname=registration_address,
+                                             session=_registration_sessions.get(registration_address))
+            try:
+                ssl_socket.connect((registration_address, registration_port))
+                _registration_sessions[registration_address] = ssl_socket.session
+                ssl_socket.send(event)
+                recv = ssl_socket.recv(4096)
+                registration_info = recv.decode().split("'")[1].split(" ")
+            finally:
+                ssl_socket.close()
+
+            return registration_info[0], registration_info[3]
+        except Exception:
+            if attempt == retries:
+                raise
+            sleep(min(6, 0.5 * 2 ** attempt))
+
+
+def register_agents(names, registration_address, authd_password=None, workers=32, retries=20):
+    """Enroll many agents in the manager in parallel.
+
+    Args:
+        names (list): Names of the agents.
+        registration_address (str): Manager registration IP address.
+        authd_password (str, optional): Password for registration if needed.
+        workers (int, optional): Maximum number of enrollments at the same time.
+        retries (int, optional): Number of retries of each enrollment in case of error.
+
+    Returns:
+        list: Tuples with the ID, name and key of each agent, in the same order as `names`.
+    """
+    def register(name):
+        agent_id, agent_key = register_agent(name, registration_address, authd_password, retries=retries)
+        return agent_id, name, agent_key
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(register, names))
 
 
 class Agent:
@@ -68,6 +215,12 @@ class Agent:
         authd_password (str), optional: Password for registration if needed.
         registration_address (str, optional): Manager registration IP address.
         retry_enrollment (bool, optional): retry then enrollment in case of error.
+        event_pool_size (int, optional): Number of pre-rendered random variants of the syscollector and SCA events.
+                                         FIM events are always rendered one by one. Default 0 for randomizing each
+                                         event.
+        max_eps (float, optional): Maximum EPS of the agent, shared by all its modules. Default None for no limit.
+        background_decoder (bool, optional): Decode and process the messages from the manager in a different thread
+                                             than the one reading them. Default False.
 
     Attributes:
         id (str): ID of the agent.
@@ -87,8 +240,11 @@ class Agent:
         sca_eps (float): sca_label's maximum event reporting throughput. Default `100`.
         manager_address (str): Manager IP address.
         encryption_key (bytes): Encryption key used for encrypt and decrypt the message.
+        cipher (CipherContext): Pre-keyed cipher built from `encryption_key` and `cypher`.
         keep_alive_event (bytes): Keep alive event (read from template data according to OS and parsed to an event).
-        keep_alive_raw_msg (string): Keep alive event in plain text.
+                                  It is only rebuilt when its plain text or the agent cipher change.
+        keep_alive_raw_msg (string): Keep alive event in plain text. It is only rebuilt when the OS, version, labels or
+                                     merged checksum change.
         merged_checksum (string): Checksum of agent's merge.mg file.
         startup_msg (bytes): Startup event sent before the first keep alive event.
         authd_password (str): Password for manager registration.
@@ -113,13 +269,21 @@ class Agent:
         syscollector_batch_size (int): Size of the syscollector type batch events.
         fixed_message_size (int): Fixed size of the agent modules messages in KB.
         registration_address (str): Manager registration IP address.
+        event_pool_size (int): Number of pre-rendered random variants of the syscollector and SCA events.
+        rate_limiter (TokenBucket): Budget shared by all the modules of the agent. None if it has no EPS limit.
+        background_decoder (bool): Decode and process the messages from the manager in a different thread than the
+                                   one reading them.
+        received_frames_limit (int): Maximum number of read messages waiting for the background decoder.
     """
+    received_frames_limit = 10000
+
     def __init__(self, manager_address, cypher="aes", os=None, rootcheck_sample=None, id=None, name=None, key=None,
                  version="v4.3.0", fim_eps=100, fim_integrity_eps=100, sca_eps=100, syscollector_eps=100, labels=None,
                  rootcheck_eps=100, logcollector_eps=100, authd_password=None, disable_all_modules=False,
                  rootcheck_frequency=60.0, rcv_msg_limit=0, keepalive_frequency=10.0, sca_frequency=60,
                  syscollector_frequency=60.0, syscollector_batch_size=10, hostinfo_eps=100, winevt_eps=100,
-                 fixed_message_size=None, registration_address=None, retry_enrollment=False):
+                 fixed_message_size=None, registration_address=None, retry_enrollment=False, event_pool_size=0,
+                 max_eps=None, background_decoder=False):
         self.id = id
         self.name = name
         self.key = key
@@ -146,10 +310,13 @@ class Agent:
         self.manager_address = manager_address
         self.registration_address = manager_address if registration_address is None else registration_address
         self.encryption_key = ""
-        self.keep_alive_event = ""
-        self.keep_alive_raw_msg = ""
+        self._cipher = None
+        self._frame_header = b''
+        self._frame_header_id = None
+        self._keep_alive_raw_msg = None
+        self._keep_alive_fields = None
+        self._events_cache = {}
         self.merged_checksum = 'd6e3ac3e75ca0319af3e7c262776f331'
-        self.startup_msg = ""
         self.authd_password = authd_password
         self.sca = None
         self.logcollector = None
@@ -181,13 +348,14 @@ class Agent:
         self.stop_receive = 0
         self.stage_disconnect = None
         self.retry_enrollment = retry_enrollment
+        self.event_pool_size = event_pool_size
+        self.rate_limiter = TokenBucket(max_eps) if max_eps else None
+        self.background_decoder = background_decoder
         self.rcv_msg_queue = Queue(rcv_msg_limit)
         self.fixed_message_size = fixed_message_size * 1024 if fixed_message_size is not None else None
         self.setup(disable_all_modules=disable_all_modules)
 
     def update_checksum(self, new_checksum):
-        self.keep_alive_raw_msg = self.keep_alive_raw_msg.replace(self.merged_checksum, new_checksum)
-        self.keep_alive_event = self.create_event(self.keep_alive_raw_msg)
         self.merged_checksum = new_checksum
 
     def setup(self, disable_all_modules):
@@ -208,7 +376,7 @@ class Agent:
     def set_os(self):
         """Pick random OS from a custom os list."""
         if self.os is None:
-            self.os = os_list[agent_count % len(os_list) - 1]
+            self.os = get_default_os()
 
     def set_wpk_variables(self, sha=None, upgrade_exec_result=None, upgrade_notification=False, upgrade_script_result=0,
                           stage_disconnect=None):
@@ -230,33 +398,15 @@ class Agent:
 
     def set_name(self):
         """Set a random agent name."""
-        random_string = ''.join(sample(f"0123456789{ascii_letters}", 16))
-        self.name = f"{agent_count}-{random_string}-{self.os}"
-
-    def _register_helper(self):
-        """Helper function to enroll an agent."""
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
-        context.check_hostname = False
-        context.verify_mode = ssl.CERT_NONE
-        try:
-            ssl_socket = context.wrap_socket(sock, server_hostname=self.registration_address)
-            ssl_socket.connect((self.registration_address, 1515))
+        self.name = generate_agent_name(self.os)
 
-            if self.authd_password is None:
-                event = f"OSSEC A:'{self.name}'\n".encode()
-            else:
-                event = f"OSSEC PASS: {self.authd_password} OSSEC A:'{self.name}'\n".encode()
-
-            ssl_socket.send(event)
-            recv = ssl_socket.recv(4096)
-            registration_info = recv.decode().split("'")[1].split(" ")
+    def _register_helper(self, retries=0):
+        """Helper function to enroll an agent.
 
-            self.id = registration_info[0]
-            self.key = registration_info[3]
-        finally:
-            ssl_socket.close()
-            sock.close()
+        Args:
+            retries (int): Number of retries in case of error.
+        """
+        self.id, self.key = register_agent(self.name, self.registration_address, self.authd_password, retries=retries)
 
         logging.debug(f"Registration - {self.name}({self.id}) in {self.registration_address}")
 
@@ -266,17 +416,10 @@ class Agent:
         In addition, it sets the agent id and agent key with the response data.
         """
         if self.retry_enrollment:
-            retries = 20
-            while retries >= 0:
-                try:
-                    self._register_helper()
-                except Exception:
-                    retries -= 1
-                    sleep(6)
-                else:
-                    break
-            else:
-                raise ValueError(f"The agent {self.name} was not correctly enrolled.")
+            try:
+                self._register_helper(retries=20)
+            except Exception as error:
+                raise ValueError(f"The agent {self.name} was not correctly enrolled.") from error
         else:
             self._register_helper()
 
@@ -346,7 +489,7 @@ class Agent:
             padded_event (bytes): Padded event.
 
         Returns:
-            bytes: Encrypted event.
+            bytearray: Encrypted event.
 
         Examples:
             >>> agent.encrypt(b'!!!!!!!!x\\x9c\\x15\\xc7\\xc9\\r\\x00 \\x08\\x04\\xc0\\x96\\\\\\x94\\xcbn0H\\x03\\xda
@@ -356,12 +499,30 @@ class Agent:
                 \\xb52<\\x9d\\xc8\\x83=o1U\\x1a\\xb3\\xf1\\xf5\\xde\\xe0\\x8bV\\xe99\\x9ej}#\\xf1\\x99V\\x12NP^T
                 \\xa0\\rYs\\xa2n\\xe8\\xa5\\xb1\\r[<V\\x16%q\\xfc"
         """
-        encrypted_event = None
-        if self.cypher == "aes":
-            encrypted_event = Cipher(padded_event, self.encryption_key).encrypt_aes()
-        if self.cypher == "blowfish":
-            encrypted_event = Cipher(padded_event, self.encryption_key).encrypt_blowfish()
-        return encrypted_event
+        return self.cipher.encrypt(padded_event)
+
+    def encrypt_frame(self, padded_event):
+        """Encrypt an event and add its headers, writing both in the same buffer.
+
+        Args:
+            padded_event (bytes): Padded event.
+
+        Returns:
+            bytearray: Ready to send event, e.g. `!<agent_id>!#AES:<encrypted event>`.
+        """
+        return self.cipher.encrypt(padded_event, header=self._frame_header)
+
+    @property
+    def cipher(self):
+        """CipherContext: Pre-keyed cipher of the agent. It is rebuilt when the key or the encryption method changes."""
+        cipher = self._cipher
+        if cipher is None or cipher.key != self.encryption_key or cipher.method != self.cypher \
+                or self._frame_header_id != self.id:
+            cipher = CipherContext(self.encryption_key, self.cypher)
+            self._frame_header = self.headers(self.id, b'')
+            self._frame_header_id = self.id
+            self._cipher = cipher
+        return cipher
 
     def headers(self, agent_id, encrypted_event):
         """
@@ -388,7 +549,7 @@ class Agent:
             message (str): Raw message.
 
         Returns:
-            bytes: Built event (compressed, padded, enceypted and with headers).
+            bytearray: Built event (compressed, padded, encrypted and with headers).
 
         Examples:
             >>> create_event('test message')
@@ -402,60 +563,107 @@ class Agent:
         compressed_event = zlib.compress(event)
         # Padding
         padded_event = self.wazuh_padding(compressed_event)
-        # Encrypt
-        encrypted_event = self.encrypt(padded_event)
-        # Add headers
-        headers_event = self.headers(self.id, encrypted_event)
-
-        return headers_event
+        # Encrypt and add headers
+        return self.encrypt_frame(padded_event)
 
     def receive_message(self, sender):
         """Agent listener to receive messages and process the accepted commands.
 
+        TCP messages are read with exact-length reads, so a short read never splits or drops a message. If
+        `background_decoder` is enabled, this thread only reads the socket, and a separate thread decodes and processes
+        the messages, so the socket is drained at wire speed.
+
         Args:
             sender (Sender): Object to establish connection with the manager socket and receive/send information.
         """
-        while self.stop_receive == 0:
-            if is_tcp(sender.protocol):
-                try:
-                    rcv = sender.socket.recv(4)
-                    if len(rcv) == 4:
-                        data_len = wazuh_unpack(rcv)
-                        buffer_array = sender.socket.recv(data_len)
-                        if data_len != len(buffer_array):
+        frames = None
+        if self.background_decoder:
+            frames = queue.Queue(self.received_frames_limit)
+            threading.Thread(target=self._process_frames, args=(sender, frames), daemon=True).start()
+
+        try:
+            while self.stop_receive == 0:
+                sock = sender.socket
+                if is_tcp(sender.protocol):
+                    try:
+                        buffer_array = recv_frame(sock)
+                    except MemoryError:
+                        logging.critical("Memory error, trying to allocate a message from the manager.")
+                        return
+                    except Exception:
+                        # The socket is closed when the agent reconnects, go on with the new one
+                        if not sender.is_current_socket(sock):
                             continue
-                    else:
-                        continue
-                except MemoryError:
-                    logging.critical(f"Memory error, trying to allocate {data_len}.")
-                    return
-                except Exception:
-                    return
-            else:
-                buffer_array, client_address = sender.socket.recvfrom(65536)
-            index = buffer_array.find(b'!')
-            if index == 0:
-                index = buffer_array[1:].find(b'!')
-                buffer_array = buffer_array[index + 2:]
-            if self.cypher == "aes":
-                msg_remove_header = bytes(buffer_array[5:])
-                msg_decrypted = Cipher(msg_remove_header, self.encryption_key).decrypt_aes()
-            else:
-                msg_remove_header = bytes(buffer_array[1:])
-                msg_decrypted = Cipher(msg_remove_header, self.encryption_key).decrypt_blowfish()
+                        return
+                    if not buffer_array:
+                        if not sender.is_current_socket(sock):
+                            continue
+                        return
+                else:
+                    buffer_array, client_address = sock.recvfrom(65536)
+
+                if frames is None:
+                    self.process_frame(sender, buffer_array)
+                else:
+                    frames.put(buffer_array)
+        finally:
+            if frames is not None:
+                frames.put(None)
+
+    def _process_frames(self, sender, frames):
+        """Process the messages read by `receive_message` until it puts None in the queue.
+
+        Args:
+            sender (Sender): Object to establish connection with the manager socket and receive/send information.
+            frames (queue.Queue): Queue of received messages.
+        """
+        while True:
+            buffer_array = frames.get()
+            if buffer_array is None:
+                return
             try:
-                padding = 0
-                while msg_decrypted:
-                    if msg_decrypted[padding] == 33:
-                        padding += 1
-                    else:
-                        break
-                msg_remove_padding = msg_decrypted[padding:]
-                msg_decompress = zlib.decompress(msg_remove_padding)
-                msg_decoded = msg_decompress.decode('ISO-8859-1')
-                self.process_message(sender, msg_decoded)
-            except zlib.error:
-                logging.error("Corrupted message from the manager. Continuing.")
+                self.process_frame(sender, buffer_array)
+            except Exception as error:
+                logging.error(f"Error processing a message from the manager: {error!r}")
+
+    def process_frame(self, sender, buffer_array):
+        """Decode and process a message received from the manager.
+
+        Args:
+            sender (Sender): Object to establish connection with the manager socket and receive/send information.
+            buffer_array (bytes): Received message, without the size header.
+        """
+        try:
+            msg_decoded = self.decode_message(buffer_array)
+        except zlib.error:
+            logging.error("Corrupted message from the manager. Continuing.")
+            return
+        self.process_message(sender, msg_decoded)
+
+    def decode_message(self, buffer_array):
+        """Decode a message received from the manager.
+
+        The message is sliced through a memoryview and its padding is stripped in one call, so the only copies are the
+        decryption and decompression buffers.
+
+        Args:
+            buffer_array (bytes): Received message, without the size header.
+
+        Returns:
+            str: Decrypted and decompressed message in ISO-8859-1 format.
+
+        Raises:
+            zlib.error: If the message could not be decompressed.
+        """
+        data = memoryview(buffer_array)
+        if buffer_array[:1] == b'!':
+            index = buffer_array.find(b'!', 1)
+            data = data[index + 1 if index > 0 else 1:]
+        data = data[5:] if self.cypher == "aes" else data[1:]
+        msg_decrypted = self.cipher.decrypt(data)
+        msg_decompress = zlib.decompress(msg_decrypted.lstrip(b'!'))
+
+        return msg_decompress.decode('ISO-8859-1')
 
     def stop_receiver(self):
         """Stop Agent listener."""
@@ -514,7 +722,7 @@ class Agent:
                 '{"command":"clear_upgrade_result","parameters":{}}']
             """
             com_index = message_list.index('upgrade')
-            json_command = json.loads(message_list[com_index + 1])
+            json_command = json.loads(' '.join(message_list[com_index + 1:]))
             command = json_command['command']
         elif 'getconfig' in message_list:
             """Examples:
@@ -597,29 +805,67 @@ class Agent:
         else:
             raise ValueError(f'Unrecognized command {command}')
 
+    def get_cached_event(self, name, message):
+        """Get the event built from a message that is sent repeatedly, building it only if the message or the cipher
+        have changed since the last call.
+
+        Args:
+            name (str): Name of the cached event.
+            message (str): Raw message.
+
+        Returns:
+            bytes: Built event.
+        """
+        cipher = self.cipher
+        cached = self._events_cache.get(name)
+        if cached is None or cached[1] is not cipher or cached[0] != message:
+            cached = (message, cipher, bytes(self.create_event(message)))
+            self._events_cache[name] = cached
+
+        return cached[2]
+
+    @property
+    def startup_msg(self):
+        """bytes: Startup event, built once per cipher."""
+        return self.get_cached_event('startup', "#!-agent startup ")
+
     def create_hc_startup(self):
         """Set the agent startup event."""
-        msg = "#!-agent startup "
-        self.startup_msg = self.create_event(msg)
+        self._events_cache.pop('startup', None)
+        return self.startup_msg
 
-    def create_keep_alive(self):
-        """Set the keep alive event from keepalives operating systemd data."""
-        with open(os.path.join(_data_path, 'keepalives.txt'), 'r') as fp:
-            line = fp.readline()
-            while line:
-                if line.strip("\n") == self.os:
-                    msg = fp.readline()
-                    line = fp.readline()
-                    while line and line.strip("\n") not in os_list:
-                        msg = msg + line
-                        line = fp.readline()
-                    break
-                line = fp.readline()
+    @property
+    def keep_alive_raw_msg(self):
+        """str: Keep alive message, rebuilt only when the OS, version, labels or merged checksum change."""
+        fields = (self.os, self.long_version, self.merged_checksum, tuple(self.labels.items()) if self.labels else None)
+        if fields != self._keep_alive_fields:
+            self._keep_alive_raw_msg = self.build_keep_alive()
+            self._keep_alive_fields = fields
+
+        return self._keep_alive_raw_msg
+
+    @property
+    def keep_alive_event(self):
+        """bytes: Keep alive event, rebuilt only when its raw message or the cipher change."""
+        return self.get_cached_event('keepalive', self.keep_alive_raw_msg)
+
+    def build_keep_alive(self):
+        """Build the keep alive message from the keep alive template of the agent OS.
+
+        Returns:
+            str: Keep alive message.
+
+        Raises:
+            ValueError: If there is no template for the agent OS.
+        """
         try:
-            msg = msg.replace("<VERSION>", self.long_version)
-            msg = msg.replace("<MERGED_CHECKSUM>", self.merged_checksum)
-        except UnboundLocalError:
+            msg = get_keepalive_templates()[self.os]
+        except KeyError:
             logging.critical("Error creating keep alive for the agent. Check if the OS is in the keepalives.txt")
+            raise ValueError(f"There is no keep alive template for the OS {self.os}")
+
+        msg = msg.replace("<VERSION>", self.long_version)
+        msg = msg.replace("<MERGED_CHECKSUM>", self.merged_checksum)
 
         if self.labels:
             msg_as_list = msg.split('\n')
@@ -629,8 +875,13 @@ class Agent:
 
         logging.debug(f"Keep alive message = {msg}")
 
-        self.keep_alive_event = self.create_event(msg)
-        self.keep_alive_raw_msg = msg
+        return msg
+
+    def create_keep_alive(self):
+        """Set the keep alive event from keepalives operating systemd data."""
+        self._keep_alive_fields = None
+        self._events_cache.pop('keepalive', None)
+        return self.keep_alive_event
 
     def initialize_modules(self, disable_all_modules):
         """Initialize and enable agent modules.
@@ -667,12 +918,13 @@ class Agent:
     def init_sca(self):
         """Initialize init_sca module."""
         if self.sca is None:
-            self.sca = SCA(self.os)
+            self.sca = SCA(self.os, pool_size=self.event_pool_size)
 
     def init_syscollector(self):
         """Initialize syscollector module."""
         if self.syscollector is None:
-            self.syscollector = GeneratorSyscollector(self.name, self.syscollector_batch_size)
+            self.syscollector = GeneratorSyscollector(self.name, self.syscollector_batch_size,
+                                                      pool_size=self.event_pool_size)
 
     def init_rootcheck(self):
         """Initialize rootcheck module."""
@@ -700,6 +952,123 @@ class Agent:
         if self.winevt is None:
             self.winevt = GeneratorWinevt(self.name, self.id)
 
+    def get_module_event_generator(self, module):
+        """Initialize a module and get the function that generates its events.
+
+        Args:
+            module (str): Module name.
+
+        Returns:
+            callable: Function without arguments that returns a new module message each time it is called.
+
+        Raises:
+            ValueError: If the module does not generate events.
+        """
+        if module == 'hostinfo':
+            self.init_hostinfo()
+            return self.hostinfo.generate_event
+        elif module == 'rootcheck':
+            self.init_rootcheck()
+            return self.rootcheck.get_message
+        elif module == 'syscollector':
+            self.init_syscollector()
+            return self.syscollector.generate_event
+        elif module == 'fim_integrity':
+            self.init_fim_integrity()
+            return self.fim_integrity.get_message
+        elif module == 'fim':
+            self.init_fim()
+            return self.fim.get_message
+        elif module == 'sca':
+            self.init_sca()
+            return self.sca.get_message
+        elif module == 'winevt':
+            self.init_winevt()
+            return self.winevt.generate_event
+        elif module == 'logcollector':
+            self.init_logcollector()
+            return self.logcollector.generate_event
+
+        raise ValueError('Invalid module selected')
+
+    def get_module_schedule(self, module):
+        """Get how the events of a module are scheduled.
+
+        Args:
+            module (str): Module name.
+
+        Returns:
+            float: Scan frequency of the module in seconds. Modules with a frequency greater than 1 send a batch of
+                   events at the beginning of each period.
+            float: Number of events of each batch.
+        """
+        module_info = self.modules[module]
+        eps = module_info['eps'] if 'eps' in module_info else 1
+        frequency = module_info['frequency'] if 'frequency' in module_info else 1
+        batch_messages = eps * 0.5 * frequency if frequency > 1 else eps
+        if module == 'rootcheck':
+            self.init_rootcheck()
+            batch_messages = len(self.rootcheck.messages_list) * eps
+
+        return frequency, batch_messages
+
+    def get_module_rate_limiter(self, module):
+        """Create the bucket that paces the events of a module.
+
+        Args:
+            module (str): Module name.
+
+        Returns:
+            TokenBucket: Bucket with the module EPS, which also consumes the agent budget.
+        """
+        module_info = self.modules[module]
+
+        return TokenBucket(module_info['eps'] if 'eps' in module_info else 1, parent=self.rate_limiter)
+
+    def is_keepalive_overload(self):
+        """Check if the keep alive events are sent at a given EPS instead of periodically.
+
+        In that case the merged checksum changes with each event, to overload the manager.
+
+        Returns:
+            bool: True if the keepalive module has an EPS or no frequency.
+        """
+        keepalive_info = self.modules['keepalive']
+
+        return 'eps' in keepalive_info or not keepalive_info['frequency']
+
+    def get_keepalive_rate_limiter(self):
+        """Create the bucket that paces the keep alive events.
+
+        Keep alive events are sent each `frequency` seconds or, in overload mode, at the keepalive EPS.
+        They do not consume the agent budget.
+
+        Returns:
+            TokenBucket: Bucket for the keep alive events.
+        """
+        keepalive_info = self.modules['keepalive']
+        if self.is_keepalive_overload():
+            return TokenBucket(keepalive_info['eps'] if 'eps' in keepalive_info else 1)
+
+        return TokenBucket(1 / keepalive_info['frequency'], burst=0)
+
+    def fill_message(self, event_msg):
+        """Fill a module message with dummy characters up to `fixed_message_size`, if it is set.
+
+        Args:
+            event_msg (str): Module message.
+
+        Returns:
+            str: Filled message, or the same message if no fixed size has been set.
+        """
+        if self.fixed_message_size is not None:
+            event_msg_size = getsizeof(event_msg)
+            dummy_message_size = self.fixed_message_size - event_msg_size
+            char_size = getsizeof(event_msg[0]) - getsizeof('')
+            event_msg += 'A' * (dummy_message_size//char_size)
+
+        return event_msg
+
     def get_agent_info(self, field):
         agent_info = wdb.query_wdb(f"global get-agent-info {self.id}")
 
@@ -720,19 +1089,21 @@ class Agent:
         """
         return self.get_agent_info('connection_status')
 
-    @retry(AttributeError, attempts=10, delay=5, delay_multiplier=1)
-    def wait_status_active(self):
+    def wait_status_active(self, timeout=50):
         """Wait until agent status is active in global.db.
 
+        The status is checked by `agent_status_poller`, so the agents waiting at the same time share its queries.
+
+        Args:
+            timeout (float): Maximum time to wait in seconds.
+
         Raises:
-            AttributeError: If the agent is not active. Combined with the retry decorator makes a wait loop
-                until the agent is active.
+            AttributeError: If the agent is not active before the timeout.
         """
-        status = self.get_connection_status()
-
-        if status == 'active':
-            return
-        raise AttributeError(f"Agent is not active yet: {status}")
+        try:
+            agent_status_poller.wait([self.id], 'active', timeout=timeout)
+        except TimeoutError:
+            raise AttributeError(f"Agent is not active yet: {self.get_connection_status()}")
 
     def set_module_status(self, module_name, status):
         """Set module status.
@@ -753,6 +1124,129 @@ class Agent:
         self.modules[module_name][attribute] = value
 
 
+class EventTemplate:
+    """Event template compiled into constant segments and slots.
+
+    The template is split only once, so rendering an event is a single join instead of a chain of `str.replace`.
+
+    Args:
+        template (str): Template text, with the slots written as `<field>`.
+        fields (list): Names of the slots. Any other `<...>` text is kept as it is.
+
+    Attributes:
+        segments (list): Constant segments of the template, with a `None` gap for each slot.
+        slots (list): Tuples with the index of each gap in `segments` and the name of its field.
+    """
+    def __init__(self, template, fields):
+        self.fields = list(fields)
+        self.segments = []
+        self.slots = []
+        if self.fields:
+            pattern = re.compile('<({})>'.format('|'.join(re.escape(field) for field in self.fields)))
+            parts = pattern.split(template)
+        else:
+            parts = [template]
+        for index, part in enumerate(parts):
+            if index % 2:
+                self.slots.append((len(self.segments), part))
+                self.segments.append(None)
+            elif part:
+                self.segments.append(part)
+
+    @classmethod
+    def from_json(cls, data, fields, raw_fields=(), prefix=''):
+        """Compile a template from a JSON serializable object.
+
+        The object is serialized with `json.dumps`, so the constant values are escaped once and the result is the
+        same that serializing the final object would produce.
+
+        Args:
+            data (dict): Object whose variable values are strings written as `<field>`.
+            fields (list): Names of the slots.
+            raw_fields (list): Slots whose values are inserted unquoted (numbers, lists or nested objects).
+            prefix (str): Constant text to prepend to the serialized object.
+
+        Returns:
+            EventTemplate: Compiled template.
+        """
+        template = prefix + json.dumps(data)
+        for field in raw_fields:
+            template = template.replace(f'"<{field}>"', f'<{field}>')
+
+        return cls(template, fields)
+
+    def partial(self, **values):
+        """Fix the value of some slots.
+
+        Args:
+            values (dict): Values of the slots to fix.
+
+        Returns:
+            EventTemplate: New template in which those slots are constant segments.
+        """
+        template = EventTemplate('', [])
+        template.fields = [field for field in self.fields if field not in values]
+        template.segments = list(self.segments)
+        for index, name in self.slots:
+            if name in values:
+                template.segments[index] = str(values[name])
+            else:
+                template.slots.append((index, name))
+
+        return template
+
+    def render(self, **values):
+        """Render the template.
+
+        Args:
+            values (dict): Value of each slot. Values must not need escaping in the template format.
+
+        Returns:
+            str: Rendered event.
+        """
+        segments = list(self.segments)
+        for index, name in self.slots:
+            segments[index] = str(values[name])
+
+        return ''.join(segments)
+
+
+class EventTemplatePool:
+    """Random variants of an event template.
+
+    If a size is given, the variants are pre-rendered when the pool is created and then used in turn, so generating
+    the random values does not limit the event rate. Otherwise, the random values are generated for each event.
+
+    Args:
+        template (EventTemplate): Template of the events.
+        generate_values (callable): Function returning a dict with new random values for some slots of the template.
+        size (int): Number of pre-rendered variants. 0 to generate the random values for each event.
+
+    Attributes:
+        template (EventTemplate): Template of the events.
+        variants (list): Pre-rendered variants.
+    """
+    def __init__(self, template, generate_values, size=0):
+        self.template = template
+        self.generate_values = generate_values
+        self.variants = [template.partial(**generate_values()) for _ in range(size)]
+        self._next_variant = cycle(self.variants)
+
+    def render(self, **values):
+        """Render an event from the next variant of the pool.
+
+        Args:
+            values (dict): Values of the slots that are not random.
+
+        Returns:
+            str: Rendered event.
+        """
+        if self.variants:
+            return next(self._next_variant).render(**values)
+
+        return self.template.render(**self.generate_values(), **values)
+
+
 class GeneratorSyscollector:
     """This class allows the generation of syscollector events.
 
@@ -771,26 +1265,31 @@ class GeneratorSyscollector:
     Args:
         agent_name (str): Name of the agent.
         batch_size (int): Number of messages of the same type
+        pool_size (int): Number of pre-rendered variants of each event type. 0 to randomize each event.
     """
-    def __init__(self, agent_name, batch_size):
+    template_fields = ['agent_name', 'random_int', 'random_string', 'timestamp', 'syscollector_type']
+
+    def __init__(self, agent_name, batch_size, pool_size=0):
         self.current_batch_events = -1
         self.current_batch_events_size = 0
         self.list_events = ['network', 'port', 'hotfix',
                             'process', 'packages', 'OS', 'hardware']
         self.agent_name = agent_name
         self.batch_size = batch_size
+        self.pool_size = pool_size
         self.syscollector_tag = 'syscollector'
         self.syscollector_mq = 'd'
         self.current_id = 1
+        self.templates = {}
 
-    def format_event(self, message_type):
-        """Format syscollector message of the specified type.
+    def compile_template(self, message_type):
+        """Compile the template of the specified syscollector message type.
 
         Args:
             message_type (str): Syscollector event type.
 
         Returns:
-            str: the generated syscollector event message.
+            EventTemplatePool: Template with the agent name and the type already set.
         """
         message = syscollector.SYSCOLLECTOR_HEADER
         if message_type == 'network':
@@ -810,21 +1309,27 @@ class GeneratorSyscollector:
         elif 'end' in message_type:
             message += '}'
 
-        today = date.today()
-        timestamp = today.strftime("%Y/%m/%d %H:%M:%S")
+        template = EventTemplate(f"{self.syscollector_mq}:{self.syscollector_tag}:{message}", self.template_fields)
+        template = template.partial(agent_name=self.agent_name, syscollector_type=message_type)
 
-        fields_to_replace = [
-                        ('<agent_name>', self.agent_name), ('<random_int>', f"{self.current_id}"),
-                        ('<random_string>', get_random_string(10)),
-                        ('<timestamp>', timestamp), ('<syscollector_type>', message_type)
-                    ]
+        return EventTemplatePool(template, lambda: {'random_string': get_random_string(10)}, self.pool_size)
 
-        for variable, value in fields_to_replace:
-            message = message.replace(variable, value)
+    def format_event(self, message_type):
+        """Format syscollector message of the specified type.
 
-        self.current_id += 1
+        Args:
+            message_type (str): Syscollector event type.
+
+        Returns:
+            str: the generated syscollector event message.
+        """
+        if message_type not in self.templates:
+            self.templates[message_type] = self.compile_template(message_type)
 
-        message = f"{self.syscollector_mq}:{self.syscollector_tag}:{message}"
+        timestamp = date.today().strftime("%Y/%m/%d %H:%M:%S")
+        message = self.templates[message_type].render(random_int=self.current_id, timestamp=timestamp)
+
+        self.current_id += 1
 
         return message
 
@@ -858,14 +1363,18 @@ class SCA:
 
     Args:
         os (str): Agent operative system.
+        pool_size (int): Number of pre-rendered variants of each event type. 0 to randomize each event.
     """
-    def __init__(self, os):
+    def __init__(self, os, pool_size=0):
         self.last_scan_id = 0
         self.os = os
         self.count = 0
         self.sca_mq = 'p'
         self.sca_label = 'sca'
         self.started_time = int(time())
+        self.pool_size = pool_size
+        self.templates = {}
+        self.compile_templates()
 
     def get_message(self):
         """Alternatively creates summary and check SCA messages.
@@ -881,9 +1390,93 @@ class SCA:
 
         msg = msg.strip('\n')
 
-        sca_msg = f"{self.sca_mq}:{self.sca_label}:{msg}"
+        sca_msg = f"{self.sca_mq}:{self.sca_label}:{msg}"
+
+        return sca_msg
+
+    def compile_templates(self):
+        """Compile the templates of the summary and check events."""
+        summary_fields = ['scan_id', 'passed', 'failed', 'invalid', 'total_checks', 'start_time', 'end_time', 'hash',
+                          'hash_file']
+        summary_event = {
+            'type': 'summary',
+            'scan_id': '<scan_id>',
+            'name': f"CIS Benchmark for {self.os}",
+            'policy_id': f"cis_{self.os}_linux",
+            'file': f"cis_{self.os}_linux.yml",
+            'description': 'This provides prescriptive guidance for establishing a secure configuration.',
+            'references': 'https://www.cisecurity.org/cis-benchmarks',
+            'passed': '<passed>',
+            'failed': '<failed>',
+            'invalid': '<invalid>',
+            'total_checks': '<total_checks>',
+            'score': 20,
+            'start_time': '<start_time>',
+            'end_time': '<end_time>',
+            'hash': '<hash>',
+            'hash_file': '<hash_file>',
+            'force_alert': '1'
+        }
+        check_event = {
+            'type': 'check',
+            'scan_id': '<scan_id>',
+            'id': '<id>',
+            'policy': f"CIS Benchmark for {self.os}",
+            'policy_id': f"cis_{self.os}_policy",
+            'check': {
+                'id': '<check_id>',
+                'title': 'Ensure root is the only UID 0 account',
+                'description': 'Any account with UID 0 has superuser privileges on the system',
+                'rationale': 'This access must be limited to only the default root account',
+                'remediation': 'Remove any users other than root with UID 0',
+                'compliance': {
+                    'cis': '6.2.6',
+                    'cis_csc': '5.1',
+                    'pci_dss': '10.2.5',
+                    'hipaa': '164.312.b',
+                    'nist_800_53': 'AU.14,AC.7',
+                    'gpg_13': '7.8',
+                    'gdpr_IV': '35.7,32.2',
+                    'tsc': 'CC6.1,CC6.8,CC7.2,CC7.3,CC7.4'
+                },
+                'rules': 'f:/etc/passwd -> !r:^# && !r:^\\\\s*\\\\t*root: && r:^\\\\w+:\\\\w+:0:\"]',
+                'condition': 'none',
+                'file': '/etc/passwd',
+                'result': '<result>'
+            }
+        }
+
+        self.templates['summary'] = EventTemplatePool(
+            EventTemplate.from_json(summary_event, summary_fields, raw_fields=summary_fields),
+            self.random_summary_values, self.pool_size)
+        self.templates['check'] = EventTemplatePool(
+            EventTemplate.from_json(check_event, ['scan_id', 'id', 'check_id', 'result'],
+                                    raw_fields=['scan_id', 'id', 'check_id']),
+            self.random_check_values, self.pool_size)
+
+    @staticmethod
+    def random_summary_values():
+        """Generate the random values of a summary event.
+
+        Returns:
+            dict: Random values of the summary template.
+        """
+        total_checks = randint(0, 900)
+        passed_checks = randint(0, total_checks)
+        failed_checks = randint(0, total_checks - passed_checks)
+
+        return {'passed': passed_checks, 'failed': failed_checks,
+                'invalid': total_checks - failed_checks - passed_checks, 'total_checks': total_checks,
+                'hash': getrandbits(256), 'hash_file': getrandbits(256)}
+
+    @staticmethod
+    def random_check_values():
+        """Generate the random values of a check event.
 
-        return sca_msg
+        Returns:
+            dict: Random values of the check template.
+        """
+        return {'id': randint(0, 9999999999), 'check_id': randint(0, 99999), 'result': choice(['passed', 'failed'])}
 
     def create_sca_event(self, event_type):
         """Create sca_label event of the desired type.
@@ -892,70 +1485,20 @@ class SCA:
             event_type (str): Event type summary or check.
 
         Returns:
-            dict: SCA event.
+            str: SCA event in JSON format.
         """
-        event_data = dict()
-        event_data['type'] = event_type
-        event_data['scan_id'] = self.last_scan_id
+        scan_id = self.last_scan_id
         self.last_scan_id += 1
 
-        def create_summary_sca_event(event_data):
-            event_data['name'] = f"CIS Benchmark for {self.os}"
-            event_data['policy_id'] = f"cis_{self.os}_linux"
-            event_data['file'] = f"cis_{self.os}_linux.yml"
-            event_data['description'] = 'This provides prescriptive guidance for establishing a secure configuration.'
-            event_data['references'] = 'https://www.cisecurity.org/cis-benchmarks'
-            total_checks = randint(0, 900)
-            passed_checks = randint(0, total_checks)
-            failed_checks = randint(0, total_checks - passed_checks)
-            invalid_checks = total_checks - failed_checks - passed_checks
-            event_data['passed'] = passed_checks
-            event_data['failed'] = failed_checks
-            event_data['invalid'] = invalid_checks
-            event_data['total_checks'] = total_checks
-            event_data['score'] = 20
-            event_data['start_time'] = self.started_time
-            self.started_time = int(time() + 1)
-            event_data['end_time'] = self.started_time
-            event_data['hash'] = getrandbits(256)
-            event_data['hash_file'] = getrandbits(256)
-            event_data['force_alert'] = '1'
-
-            return event_data
-
-        def create_check_sca_event(event_data):
-            event_data['type'] = 'check'
-            event_data['id'] = randint(0, 9999999999)
-            event_data['policy'] = f"CIS Benchmark for {self.os}"
-            event_data['policy_id'] = f"cis_{self.os}_policy"
-            event_data['check'] = {}
-            event_data['check']['id'] = randint(0, 99999)
-            event_data['check']['title'] = 'Ensure root is the only UID 0 account'
-            event_data['check']['description'] = 'Any account with UID 0 has superuser privileges on the system'
-            event_data['check']['rationale'] = 'This access must be limited to only the default root account'
-            event_data['check']['remediation'] = 'Remove any users other than root with UID 0'
-            event_data['check']['compliance'] = {}
-            event_data['check']['compliance']['cis'] = '6.2.6'
-            event_data['check']['compliance']['cis_csc'] = '5.1'
-            event_data['check']['compliance']['pci_dss'] = '10.2.5'
-            event_data['check']['compliance']['hipaa'] = '164.312.b'
-            event_data['check']['compliance']['nist_800_53'] = 'AU.14,AC.7'
-            event_data['check']['compliance']['gpg_13'] = '7.8'
-            event_data['check']['compliance']['gdpr_IV'] = '35.7,32.2'
-            event_data['check']['compliance']['tsc'] = 'CC6.1,CC6.8,CC7.2,CC7.3,CC7.4'
-            event_data['check']['rules'] = 'f:/etc/passwd -> !r:^# && !r:^\\\\s*\\\\t*root: && r:^\\\\w+:\\\\w+:0:\"]'
-            event_data['check']['condition'] = 'none'
-            event_data['check']['file'] = '/etc/passwd'
-            event_data['check']['result'] = choice(['passed', 'failed'])
-
-            return event_data
-
         if event_type == 'summary':
-            event_data = create_summary_sca_event(event_data)
+            start_time = self.started_time
+            self.started_time = int(time() + 1)
+            return self.templates['summary'].render(scan_id=scan_id, start_time=start_time,
+                                                    end_time=self.started_time)
         elif event_type == 'check':
-            event_data = create_check_sca_event(event_data)
+            return self.templates['check'].render(scan_id=scan_id)
 
-        return json.dumps(event_data)
+        return json.dumps({'type': event_type, 'scan_id': scan_id})
 
 
 class Rootcheck:
@@ -1192,10 +1735,14 @@ class GeneratorFIM:
         agent_name (str): The name of the agent.
         agent_version (str): The version of the agent.
     """
+    attributes_fields = ['size', 'perm', 'uid', 'gid', 'user_name', 'group_name', 'inode', 'mtime', 'hash_md5',
+                         'hash_sha1', 'hash_sha256', 'checksum']
+
     def __init__(self, agent_id, agent_name, agent_version):
         self.agent_id = agent_id
         self.agent_name = agent_name
         self.agent_version = agent_version
+        self.templates = {}
         self.file_root = '/root/'
         self._file = self.file_root + 'a'
         self._size = 0
@@ -1221,6 +1768,7 @@ class GeneratorFIM:
         self.baseline_completed = 0
         self.event_mode = None
         self.event_type = None
+        self.compile_templates()
 
     def random_file(self):
         """Initialize file attribute.
@@ -1384,6 +1932,64 @@ class GeneratorFIM:
         }
         return attributes
 
+    def compile_templates(self):
+        """Compile the templates of the FIM events.
+
+        The events are not pooled: each one renders the current path and file state, so the sequence of events
+        describes a consistent file history.
+        """
+        attributes = {'type': 'file', **{field: f'<{field}>' for field in self.attributes_fields}}
+        self.templates['attributes'] = EventTemplate.from_json(attributes, self.attributes_fields,
+                                                               raw_fields=['size', 'inode', 'mtime'])
+
+        event_fields = ['path', 'mode', 'type', 'timestamp', 'attributes']
+        event = {'type': 'event', 'data': {field: f'<{field}>' for field in event_fields}}
+        self.templates['event'] = EventTemplatePool(
+            EventTemplate.from_json(event, event_fields, raw_fields=['timestamp', 'attributes']),
+            self.random_event_values)
+
+        modified_fields = event_fields + ['old_attributes', 'changed_attributes']
+        modified_event = {'type': 'event', 'data': {field: f'<{field}>' for field in modified_fields}}
+        self.templates['modified'] = EventTemplatePool(
+            EventTemplate.from_json(modified_event, modified_fields,
+                                    raw_fields=['timestamp', 'attributes', 'old_attributes', 'changed_attributes']),
+            self.random_modified_values)
+
+    def random_attributes(self):
+        """Initialize GeneratorFIM attributes and render them.
+
+        Returns:
+            dict: instance attributes.
+            str: instance attributes in JSON format.
+        """
+        self.generate_attributes()
+        attributes = self.get_attributes()
+
+        return attributes, self.templates['attributes'].render(**attributes)
+
+    def random_event_values(self):
+        """Generate the random values of an added or deleted event.
+
+        Returns:
+            dict: Random values of the event template.
+        """
+        _, attributes = self.random_attributes()
+
+        return {'path': self._file, 'attributes': attributes}
+
+    def random_modified_values(self):
+        """Generate the random values of a modified event.
+
+        Returns:
+            dict: Random values of the modified event template.
+        """
+        attributes, attributes_json = self.random_attributes()
+        old_attributes, old_attributes_json = self.random_attributes()
+        changed_attributes = self.check_changed_attributes(attributes, old_attributes)
+
+        return {'path': self._file, 'attributes': attributes_json, 'old_attributes': old_attributes_json,
+                'changed_attributes': json.dumps(changed_attributes)}
+
     def format_message(self, message):
         """Format FIM message.
         Args:
@@ -1412,34 +2018,8 @@ class GeneratorFIM:
             str: generated message with the required FIM header.
         """
         if self.agent_version >= "3.12":
-            if self.event_type == "added":
-                timestamp = int(time())
-                self.generate_attributes()
-                attributes = self.get_attributes()
-                data = {"path": self._file, "mode": self.event_mode,
-                        "type": self.event_type, "timestamp": timestamp,
-                        "attributes": attributes}
-            elif self.event_type == "modified":
-                timestamp = int(time())
-                self.generate_attributes()
-                attributes = self.get_attributes()
-                self.generate_attributes()
-                old_attributes = self.get_attributes()
-                changed_attributes = self.check_changed_attributes(attributes, old_attributes)
-                data = {"path": self._file, "mode": self.event_mode,
-                        "type": self.event_type, "timestamp": timestamp,
-                        "attributes": attributes,
-                        "old_attributes": old_attributes,
-                        "changed_attributes": changed_attributes}
-            else:
-                timestamp = int(time())
-                self.generate_attributes()
-                attributes = self.get_attributes()
-                data = {"path": self._file, "mode": self.event_mode,
-                        "type": self.event_type, "timestamp": timestamp,
-                        "attributes": attributes}
-
-            message = json.dumps({"type": "event", "data": data})
+            template = self.templates['modified' if self.event_type == "modified" else 'event']
+            message = template.render(mode=self.event_mode, type=self.event_type, timestamp=int(time()))
 
         else:
             self.generate_attributes()
@@ -1473,14 +2053,116 @@ class GeneratorFIM:
         return generated_message
 
 
+class TokenBucket:
+    """Token bucket used to pace the events sent by the simulated agents.
+
+    It is implemented as a generic cell rate algorithm over `time.monotonic`: each acquired token moves forward the
+    theoretical arrival time of the next one. That way the time spent generating and sending the events is absorbed by
+    the next waits instead of adding up, and the achieved rate does not drift below the target. Up to `burst` seconds
+    worth of tokens can be acquired without waiting, which smooths the traffic within each second.
+
+    Args:
+        rate (float): Target rate in tokens (events) per second. 0 or None for no limit.
+        burst (float): Seconds worth of tokens that can be acquired at once. Default 0.1.
+        parent (TokenBucket): Bucket also consumed by each acquisition, e.g. the budget shared by all the modules of an
+                              agent.
+
+    Attributes:
+        rate (float): Target rate in tokens per second.
+        burst (float): Seconds worth of tokens that can be acquired at once.
+        parent (TokenBucket): Bucket also consumed by each acquisition.
+        acquired (int): Tokens acquired since the first acquisition.
+    """
+    min_sleep = 0.002
+
+    def __init__(self, rate, burst=0.1, parent=None):
+        self.rate = rate
+        self.burst = burst
+        self.parent = parent
+        self.acquired = 0
+        self._start = None
+        self._arrival_time = None
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1, arrival=None):
+        """Reserve tokens, without waiting for them.
+
+        Args:
+            tokens (int): Number of tokens to reserve.
+            arrival (float): Monotonic time from which the tokens are requested. Default now.
+
+        Returns:
+            float: Seconds to wait before using the tokens.
+        """
+        now = monotonic()
+        with self._lock:
+            if self._start is None:
+                self._start = now
+                self._arrival_time = now
+            self.acquired += tokens
+            delay = 0
+            if self.rate:
+                start_time = max(self._arrival_time, now if arrival is None else arrival)
+                self._arrival_time = start_time + tokens / self.rate
+                delay = max(0, start_time - self.burst - now)
+
+        if self.parent is not None:
+            delay = max(delay, self.parent.reserve(tokens, now + delay))
+
+        return delay
+
+    def acquire(self, tokens=1):
+        """Wait until the tokens can be used.
+
+        Waits shorter than `min_sleep` are skipped. They are accumulated and waited later, so the rate is kept.
+
+        Args:
+            tokens (int): Number of tokens to acquire.
+        """
+        delay = self.reserve(tokens)
+        if delay > self.min_sleep:
+            sleep(delay)
+
+    async def acquire_async(self, tokens=1):
+        """Coroutine version of `acquire`. It always yields control to the event loop.
+
+        Args:
+            tokens (int): Number of tokens to acquire.
+        """
+        delay = self.reserve(tokens)
+        await asyncio.sleep(delay if delay > self.min_sleep else 0)
+
+    def get_stats(self):
+        """Get the target and achieved rates.
+
+        Returns:
+            dict: Target rate (`target_eps`), average rate since the first acquisition (`achieved_eps`), acquired tokens
+                  (`events`) and seconds since the first acquisition (`elapsed`).
+        """
+        elapsed = monotonic() - self._start if self._start is not None else 0
+
+        return {'target_eps': self.rate, 'achieved_eps': self.acquired / elapsed if elapsed else 0,
+                'events': self.acquired, 'elapsed': elapsed}
+
+
 class Sender:
     """This class sends events to the manager through a socket.
 
+    TCP events are written with `sendall`, so partial writes are completed, and a broken connection is reopened with
+    exponential backoff before resending the events. If `flush_interval` is set, the framed events are buffered and
+    written to the socket with a single `sendall` per interval, or as soon as `max_buffer_size` bytes are pending.
+
     Attributes:
         manager_address (str): IP of the manager.
         manager_port (str, optional): port used by remoted in the manager.
         protocol (str, optional): protocol used by remoted. TCP or UDP.
         socket (socket): sock_stream used to connect with remoted.
+        flush_interval (float, optional): Seconds between writes of the buffered TCP events. Default 0 to write each
+                                          event as soon as it is sent.
+        max_buffer_size (int, optional): Buffered bytes that trigger a write before the next flush.
+        max_reconnect_attempts (int, optional): Connection attempts after a broken connection before raising the error.
+        events_sent (int): Number of events written to the socket.
+        writes (int): Number of socket writes used to send them.
 
     Examples:
         To create a Sender, you need to create an agent first, and then, create the sender. Finally, to send messages
@@ -1490,13 +2172,29 @@ class Sender:
         >>> agent = ag.Agent(manager_address, "aes", os="debian8", version="4.2.0")
         >>> sender = ag.Sender(manager_address, protocol=TCP)
     """
-    def __init__(self, manager_address, manager_port='1514', protocol=TCP):
+    min_reconnect_delay = 0.1
+    max_reconnect_delay = 5
+
+    def __init__(self, manager_address, manager_port='1514', protocol=TCP, flush_interval=0,
+                 max_buffer_size=256 * 1024, max_reconnect_attempts=10):
         self.manager_address = manager_address
         self.manager_port = manager_port
         self.protocol = protocol.upper()
         self.socket = None
+        self.flush_interval = flush_interval
+        self.max_buffer_size = max_buffer_size
+        self.max_reconnect_attempts = max_reconnect_attempts
+        self.events_sent = 0
+        self.writes = 0
+        self._lock = threading.RLock()
+        self._buffer = []
+        self._buffer_size = 0
+        self._closed = threading.Event()
         self.connect()
 
+        if self.flush_interval and is_tcp(self.protocol):
+            threading.Thread(target=self._flush_periodically, daemon=True).start()
+
     def connect(self):
         if is_tcp(self.protocol):
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -1506,27 +2204,106 @@ class Sender:
 
     def reconnect(self, event):
         if is_tcp(self.protocol):
-            self.socket.shutdown(socket.SHUT_RDWR)
-            self.socket.close()
-            self.connect()
-            if event:
-                self.send_event(event)
+            with self._lock:
+                self.socket.shutdown(socket.SHUT_RDWR)
+                self.socket.close()
+                self.connect()
+                if event:
+                    self.send_event(event)
+
+    def is_current_socket(self, sock):
+        """Check if a socket is still the connection of the sender.
+
+        If a reconnection is in progress, it waits until it finishes, so a reader that finds the old socket closed can
+        tell whether it has been replaced.
+
+        Args:
+            sock (socket): Socket to check.
+
+        Returns:
+            bool: True if `sock` is the current socket of the sender.
+        """
+        with self._lock:
+            return self.socket is sock
+
+    def _reconnect_with_backoff(self):
+        """Open a new connection, waiting exponentially longer between failed attempts.
+
+        Raises:
+            OSError: If the connection could not be established after `max_reconnect_attempts` attempts.
+        """
+        self.socket.close()
+        delay = self.min_reconnect_delay
+        for attempt in range(self.max_reconnect_attempts):
+            sleep(delay)
+            try:
+                self.connect()
+                return
+            except OSError as error:
+                if attempt == self.max_reconnect_attempts - 1:
+                    raise
+                logging.warning(f"Could not reconnect to the manager: {error}. Retrying in {delay * 2} seconds...")
+                delay = min(delay * 2, self.max_reconnect_delay)
+
+    def _write(self, data, events):
+        """Write framed events to the socket, reconnecting and resending them if the connection is broken.
+
+        Args:
+            data (bytes): Framed events.
+            events (int): Number of events in `data`.
+        """
+        try:
+            self.socket.sendall(data)
+        except (BrokenPipeError, ConnectionResetError) as error:
+            logging.warning(f"{error.strerror} while sending {events} events. Creating new socket...")
+            self._reconnect_with_backoff()
+            self.socket.sendall(data)
+        self.events_sent += events
+        self.writes += 1
 
     def send_event(self, event):
         if is_tcp(self.protocol):
-            length = pack('<I', len(event))
-            try:
-                self.socket.send(length + event)
-            except BrokenPipeError:
-                logging.warning(f"Broken Pipe error while sending event. Creating new socket...")
-                sleep(5)
-                self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self.socket.connect((self.manager_address, int(self.manager_port)))
-                self.socket.send(length + event)
-            except ConnectionResetError:
-                logging.warning(f"Connection reset by peer. Continuing...")
+            with self._lock:
+                if not self.flush_interval:
+                    self._write(pack('<I', len(event)) + event, 1)
+                    return
+                self._buffer.append(pack('<I', len(event)))
+                self._buffer.append(event)
+                self._buffer_size += len(event) + 4
+                if self._buffer_size >= self.max_buffer_size:
+                    self.flush()
         if is_udp(self.protocol):
             self.socket.sendto(event, (self.manager_address, int(self.manager_port)))
+            self.events_sent += 1
+
+    def flush(self):
+        """Write the buffered events to the socket."""
+        with self._lock:
+            if self._buffer:
+                events = len(self._buffer) // 2
+                data = b''.join(self._buffer)
+                self._buffer.clear()
+                self._buffer_size = 0
+                self._write(data, events)
+
+    def _flush_periodically(self):
+        """Flush the buffered events every `flush_interval` seconds until the sender is closed."""
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except OSError as error:
+                logging.error(f"Could not send the buffered events: {error}")
+
+    def close(self):
+        """Flush the buffered events and close the socket."""
+        self._closed.set()
+        with self._lock:
+            if is_tcp(self.protocol):
+                try:
+                    self.flush()
+                finally:
+                    self.socket.shutdown(socket.SHUT_RDWR)
+            self.socket.close()
 
 
 class Injector:
@@ -1571,14 +2348,21 @@ class Injector:
             self.threads[thread].setDaemon(True)
             self.threads[thread].start()
 
+    def get_rates(self):
+        """Get the target and achieved rates of each module.
+
+        Returns:
+            dict: `TokenBucket.get_stats` result of each module that has started sending events.
+        """
+        return {thread.module: thread.rate_limiter.get_stats() for thread in self.threads
+                if thread.rate_limiter is not None}
+
     def stop_receive(self):
         """Stop the daemon for all the threads."""
         for thread in range(self.thread_number):
             self.threads[thread].stop_rec()
         sleep(2)
-        if is_tcp(self.sender.protocol):
-            self.sender.socket.shutdown(socket.SHUT_RDWR)
-        self.sender.socket.close()
+        self.sender.close()
 
 
 class InjectorThread(threading.Thread):
@@ -1591,6 +2375,7 @@ class InjectorThread(threading.Thread):
         agent (Agent): agent owner of the injector and the sender.
         module (str): module used to send events (fim, syscollector, etc).
         stop_thread (int): 0 if the thread is running, 1 if it is stopped.
+        rate_limiter (TokenBucket): bucket pacing the module events. None until the module starts sending.
     """
     def __init__(self, thread_id, name, sender, agent, module):
         super(InjectorThread, self).__init__()
@@ -1601,6 +2386,7 @@ class InjectorThread(threading.Thread):
         self.totalMessages = 0
         self.module = module
         self.stop_thread = 0
+        self.rate_limiter = None
 
     def keep_alive(self):
         """Send a keep alive message from the agent to the manager."""
@@ -1608,89 +2394,46 @@ class InjectorThread(threading.Thread):
         logging.debug("Startup - {}({})".format(self.agent.name, self.agent.id))
         self.sender.send_event(self.agent.startup_msg)
         self.sender.send_event(self.agent.keep_alive_event)
-        start_time = time()
-        frequency = self.agent.modules["keepalive"]["frequency"]
-        eps = 1
-        if 'eps' in self.agent.modules["keepalive"]:
-            frequency = 0
-            eps = self.agent.modules["keepalive"]["eps"]
+        self.rate_limiter = self.agent.get_keepalive_rate_limiter()
         while self.stop_thread == 0:
+            self.rate_limiter.acquire()
             # Send agent keep alive
             logging.debug(f"KeepAlive - {self.agent.name}({self.agent.id})")
             self.sender.send_event(self.agent.keep_alive_event)
             self.totalMessages += 1
-            if frequency > 0:
-                sleep(frequency - ((time() - start_time) % frequency))
-            else:
+            if self.agent.is_keepalive_overload():
                 logging.debug('Merged checksum modified to force manager overload')
                 new_checksum = str(getrandbits(128))
                 self.agent.update_checksum(new_checksum)
-                if self.totalMessages % eps == 0:
-                    sleep(1.0 - ((time() - start_time) % 1.0))
 
     def run_module(self, module):
         """Send a module message from the agent to the manager.
 
+        Messages are paced by a `TokenBucket` with the module EPS, which also consumes the agent budget, if any.
+        Modules with a frequency send a batch of messages at the beginning of each period.
+
          Args:
                 module (str): Module name
         """
-        module_info = self.agent.modules[module]
-        eps = module_info['eps'] if 'eps' in module_info else 1
-        frequency = module_info["frequency"] if 'frequency' in module_info else 1
+        frequency, batch_messages = self.agent.get_module_schedule(module)
 
         sleep(10)
-        start_time = time()
-        if frequency > 1:
-            batch_messages = eps * 0.5 * frequency
-        else:
-            batch_messages = eps
-
-        if module == 'hostinfo':
-            self.agent.init_hostinfo()
-            module_event_generator = self.agent.hostinfo.generate_event
-        elif module == 'rootcheck':
-            self.agent.init_rootcheck()
-            module_event_generator = self.agent.rootcheck.get_message
-            batch_messages = len(self.agent.rootcheck.messages_list) * eps
-        elif module == 'syscollector':
-            self.agent.init_syscollector()
-            module_event_generator = self.agent.syscollector.generate_event
-        elif module == 'fim_integrity':
-            self.agent.init_fim_integrity()
-            module_event_generator = self.agent.fim_integrity.get_message
-        elif module == 'fim':
-            module_event_generator = self.agent.fim.get_message
-        elif module == 'sca':
-            self.agent.init_sca()
-            module_event_generator = self.agent.sca.get_message
-        elif module == 'winevt':
-            self.agent.init_winevt()
-            module_event_generator = self.agent.winevt.generate_event
-        elif module == 'logcollector':
-            self.agent.init_logcollector()
-            module_event_generator = self.agent.logcollector.generate_event
-        else:
-            raise ValueError('Invalid module selected')
+        start_time = monotonic()
+        module_event_generator = self.agent.get_module_event_generator(module)
+        self.rate_limiter = self.agent.get_module_rate_limiter(module)
 
         # Loop events
         while self.stop_thread == 0:
             sent_messages = 0
-            while sent_messages < batch_messages:
-                event_msg = module_event_generator()
-                if self.agent.fixed_message_size is not None:
-                    event_msg_size = getsizeof(event_msg)
-                    dummy_message_size = self.agent.fixed_message_size - event_msg_size
-                    char_size = getsizeof(event_msg[0]) - getsizeof('')
-                    event_msg += 'A' * (dummy_message_size//char_size)
-
+            while sent_messages < batch_messages and self.stop_thread == 0:
+                self.rate_limiter.acquire()
+                event_msg = self.agent.fill_message(module_event_generator())
                 event = self.agent.create_event(event_msg)
                 self.sender.send_event(event)
                 self.totalMessages += 1
                 sent_messages += 1
-                if self.totalMessages % eps == 0:
-                    sleep(1.0 - ((time() - start_time) % 1.0))
             if frequency > 1:
-                sleep(frequency - ((time() - start_time) % frequency))
+                sleep(frequency - ((monotonic() - start_time) % frequency))
 
     def run(self):
         """Start the thread that will send messages to the manager."""
@@ -1713,8 +2456,470 @@ class InjectorThread(threading.Thread):
             self.stop_thread = 1
 
 
+class _DatagramReceiver(asyncio.DatagramProtocol):
+    """Datagram protocol that stores the messages received by an `AsyncSender` using UDP.
+
+    Args:
+        queue (asyncio.Queue): Queue where the received datagrams are stored.
+    """
+    def __init__(self, queue):
+        self.queue = queue
+
+    def datagram_received(self, data, addr):
+        self.queue.put_nowait(data)
+
+
+class AsyncSender:
+    """Asyncio counterpart of `Sender`, used to run many agents in the same thread.
+
+    Sending is not a coroutine: events are written to the transport buffer, so it can also be used from the synchronous
+    `Agent` methods that answer manager requests. The buffer is flushed with `drain`, which also waits while the
+    connection is being reopened, so the producers are paused until then. A TCP connection is reopened with the same
+    exponential backoff as `Sender`. If it cannot be reopened, `drain` raises the error and `receive` returns None.
+
+    Args:
+        manager_address (str): IP of the manager.
+        manager_port (str, optional): port used by remoted in the manager.
+        protocol (str, optional): protocol used by remoted. TCP or UDP.
+        max_reconnect_attempts (int, optional): Connection attempts after a reconnection request before giving up.
+
+    Attributes:
+        manager_address (str): IP of the manager.
+        manager_port (str): port used by remoted in the manager.
+        protocol (str): protocol used by remoted. TCP or UDP.
+        max_reconnect_attempts (int): Connection attempts after a reconnection request before giving up.
+        reader (asyncio.StreamReader): Stream used to receive messages (TCP).
+        transport (asyncio.BaseTransport): Transport used to send messages.
+        error (OSError): Error of the last connection attempt if the connection could not be reopened, else None.
+    """
+    min_reconnect_delay = 0.1
+    max_reconnect_delay = 5
+
+    def __init__(self, manager_address, manager_port='1514', protocol=TCP, max_reconnect_attempts=10):
+        self.manager_address = manager_address
+        self.manager_port = manager_port
+        self.protocol = protocol.upper()
+        self.max_reconnect_attempts = max_reconnect_attempts
+        self.reader = None
+        self.transport = None
+        self.error = None
+        self._writer = None
+        self._datagrams = None
+        self._connected = asyncio.Event()
+        self._pending_events = []
+        self._reconnect_task = None
+
+    async def connect(self):
+        """Open the connection with the manager."""
+        if is_tcp(self.protocol):
+            self.reader, self._writer = await asyncio.open_connection(self.manager_address, int(self.manager_port))
+            self.transport = self._writer.transport
+        else:
+            self._datagrams = asyncio.Queue()
+            self.transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: _DatagramReceiver(self._datagrams), remote_addr=(self.manager_address, int(self.manager_port)))
+        self._connected.set()
+
+        pending_events, self._pending_events = self._pending_events, []
+        for event in pending_events:
+            self.send_event(event)
+
+    def reconnect(self, event):
+        """Close the current connection and open a new one in the background.
+
+        Args:
+            event (bytes): Event to send after reconnecting. It can be None.
+        """
+        if is_tcp(self.protocol) and self._connected.is_set():
+            self._connected.clear()
+            self.transport.close()
+            if event:
+                self._pending_events.append(event)
+            self._reconnect_task = asyncio.ensure_future(self._reconnect_with_backoff())
+
+    async def _reconnect_with_backoff(self):
+        """Open a new connection, waiting exponentially longer between failed attempts.
+
+        If the connection could not be established after `max_reconnect_attempts` attempts, the error is kept in
+        `error` and the pending events are discarded.
+        """
+        delay = self.min_reconnect_delay
+        for attempt in range(self.max_reconnect_attempts):
+            await asyncio.sleep(delay)
+            try:
+                await self.connect()
+                return
+            except OSError as error:
+                if attempt == self.max_reconnect_attempts - 1:
+                    logging.error(f"Could not reconnect to the manager after {self.max_reconnect_attempts} attempts: "
+                                  f"{error}")
+                    self.error = error
+                    self._pending_events.clear()
+                    return
+                logging.warning(f"Could not reconnect to the manager: {error}. Retrying in {delay * 2} seconds...")
+                delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def _wait_reconnection(self):
+        """Wait until the reconnection in progress, if any, finishes.
+
+        Raises:
+            ConnectionError: If the connection could not be reopened.
+        """
+        if self._reconnect_task is not None:
+            await asyncio.shield(self._reconnect_task)
+        if self.error is not None:
+            raise ConnectionError(f"Could not reconnect to the manager: {self.error}") from self.error
+
+    def send_event(self, event):
+        """Write an event to the transport buffer.
+
+        Events sent while reconnecting are kept and sent once the connection is restored. They are discarded if the
+        connection could not be reopened.
+
+        Args:
+            event (bytes): Event to send.
+        """
+        if self.error is not None:
+            return
+        if not self._connected.is_set() or self.transport.is_closing():
+            self._pending_events.append(event)
+        elif is_tcp(self.protocol):
+            self._writer.write(pack('<I', len(event)) + event)
+        else:
+            self.transport.sendto(event)
+
+    async def drain(self):
+        """Wait until the transport buffer has been flushed, so the agents can not outrun the manager.
+
+        Raises:
+            ConnectionError: If the connection could not be reopened.
+        """
+        await self._wait_reconnection()
+        if self._connected.is_set() and is_tcp(self.protocol):
+            try:
+                await self._writer.drain()
+            except ConnectionError:
+                logging.warning("Connection lost while sending events. Continuing...")
+
+    async def receive(self):
+        """Receive a message from the manager.
+
+        Returns:
+            bytes: Received message, without the size header. None if the connection has been closed or could not be
+                reopened.
+        """
+        while True:
+            try:
+                await self._wait_reconnection()
+            except ConnectionError:
+                return None
+            await self._connected.wait()
+            if is_udp(self.protocol):
+                return await self._datagrams.get()
+
+            reader = self.reader
+            try:
+                return await reader.readexactly(wazuh_unpack(await reader.readexactly(4)))
+            except (asyncio.IncompleteReadError, ConnectionError):
+                # The old stream is closed while reconnecting, keep reading from the new one
+                if reader is self.reader and self._connected.is_set():
+                    return None
+
+    def close(self):
+        """Close the connection with the manager."""
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+        self._connected.clear()
+        if self.transport is not None:
+            self.transport.close()
+
+
+class AsyncInjector:
+    """Asyncio counterpart of `Injector`.
+
+    Every enabled module of the agent runs as a task of the event loop instead of as an `InjectorThread`, so thousands
+    of agents can be simulated by a single process.
+
+    Args:
+        sender (AsyncSender): sender used to send and receive the agent messages.
+        agent (Agent): agent owner of the injector and the sender.
+
+    Attributes:
+        sender (AsyncSender): sender used to send and receive the agent messages.
+        agent (Agent): agent owner of the injector and the sender.
+        total_messages (dict): number of messages sent by each module.
+        rate_limiters (dict): bucket pacing the events of each module that has started sending.
+        stopped (bool): True if the injector has been stopped.
+    """
+    def __init__(self, sender, agent):
+        self.sender = sender
+        self.agent = agent
+        self.total_messages = {}
+        self.rate_limiters = {}
+        self.stopped = False
+        self._tasks = []
+
+    def run(self):
+        """Start one task for each enabled module of the agent. The sender must be already connected."""
+        for module, config in self.agent.modules.items():
+            if config['status'] != 'enabled':
+                continue
+            logging.debug(f"Starting - {self.agent.name}({self.agent.id})({self.agent.os}) - {module}")
+            self.total_messages[module] = 0
+            if module == 'keepalive':
+                coroutine = self.keep_alive()
+            elif module == 'receive_messages':
+                coroutine = self.receive_messages()
+            else:
+                coroutine = self.run_module(module)
+            self._tasks.append(asyncio.ensure_future(self._run_task(coroutine)))
+
+    async def _run_task(self, coroutine):
+        """Run a task of the injector, stopping all of them if the connection with the manager can not be reopened.
+
+        Args:
+            coroutine (coroutine): Task of a module.
+        """
+        try:
+            await coroutine
+        except ConnectionError as error:
+            if not self.stopped:
+                logging.error(f"Agent {self.agent.name}({self.agent.id}) stopped: {error}")
+                self.stopped = True
+                self.sender.close()
+
+    async def keep_alive(self):
+        """Send keep alive messages from the agent to the manager."""
+        await asyncio.sleep(10)
+        logging.debug(f"Startup - {self.agent.name}({self.agent.id})")
+        self.sender.send_event(self.agent.startup_msg)
+        self.sender.send_event(self.agent.keep_alive_event)
+        self.rate_limiters['keepalive'] = rate_limiter = self.agent.get_keepalive_rate_limiter()
+        while not self.stopped:
+            await rate_limiter.acquire_async()
+            logging.debug(f"KeepAlive - {self.agent.name}({self.agent.id})")
+            self.sender.send_event(self.agent.keep_alive_event)
+            self.total_messages['keepalive'] += 1
+            if self.agent.is_keepalive_overload():
+                self.agent.update_checksum(str(getrandbits(128)))
+            await self.sender.drain()
+
+    async def run_module(self, module):
+        """Send the messages of a module from the agent to the manager.
+
+        Args:
+            module (str): Module name.
+        """
+        frequency, batch_messages = self.agent.get_module_schedule(module)
+
+        await asyncio.sleep(10)
+        start_time = monotonic()
+        module_event_generator = self.agent.get_module_event_generator(module)
+        self.rate_limiters[module] = rate_limiter = self.agent.get_module_rate_limiter(module)
+
+        while not self.stopped:
+            sent_messages = 0
+            while sent_messages < batch_messages and not self.stopped:
+                await rate_limiter.acquire_async()
+                event_msg = self.agent.fill_message(module_event_generator())
+                self.sender.send_event(self.agent.create_event(event_msg))
+                self.total_messages[module] += 1
+                sent_messages += 1
+                await self.sender.drain()
+            if frequency > 1:
+                await asyncio.sleep(frequency - ((monotonic() - start_time) % frequency))
+
+    async def receive_messages(self):
+        """Receive and process the messages sent by the manager to the agent."""
+        while self.agent.stop_receive == 0 and not self.stopped:
+            buffer_array = await self.sender.receive()
+            if buffer_array is None:
+                return
+            self.total_messages['receive_messages'] += 1
+            self.agent.process_frame(self.sender, buffer_array)
+
+    def get_rates(self):
+        """Get the target and achieved rates of each module.
+
+        Returns:
+            dict: `TokenBucket.get_stats` result of each module that has started sending events.
+        """
+        return {module: rate_limiter.get_stats() for module, rate_limiter in self.rate_limiters.items()}
+
+    async def stop(self):
+        """Stop all the tasks of the injector and close the connection."""
+        self.stopped = True
+        for task in self._tasks:
+            task.cancel()
+        results = await asyncio.gather(*self._tasks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logging.error(f"Agent {self.agent.name}({self.agent.id}) task failed: {result!r}")
+        self.sender.close()
+
+
+async def run_async_agents(agents, manager_address, protocol=TCP, manager_port='1514', time_alive=None,
+                           max_connecting=100):
+    """Run a set of agents in the current event loop.
+
+    Args:
+        agents (list): List of agents to run.
+        manager_address (str): address of the manager. It can be an IP or a DNS.
+        protocol (str): protocol used to connect with the manager. Defaults to 'TCP'.
+        manager_port (str): port used to connect with the manager. Defaults to '1514'.
+        time_alive (float): Period of time in seconds during the agents will be running. None to run until cancelled.
+        max_connecting (int): Maximum number of agents connecting to the manager at the same time.
+
+    Returns:
+        list: Injectors of the agents that could be connected.
+    """
+    connection_semaphore = asyncio.Semaphore(max_connecting)
+    injectors = []
+
+    async def start_agent(agent):
+        sender = AsyncSender(manager_address, manager_port=manager_port, protocol=protocol)
+        async with connection_semaphore:
+            try:
+                await sender.connect()
+            except OSError as error:
+                logging.error(f"Agent {agent.name}({agent.id}) could not connect to the manager: {error}")
+                return
+        injector = AsyncInjector(sender, agent)
+        injector.run()
+        injectors.append(injector)
+
+    try:
+        await asyncio.gather(*[start_agent(agent) for agent in agents])
+        logging.info(f"{len(injectors)}/{len(agents)} agents connected")
+        if time_alive is None:
+            await asyncio.Future()
+        else:
+            await asyncio.sleep(time_alive)
+    finally:
+        await asyncio.gather(*[injector.stop() for injector in injectors])
+
+    return injectors
+
+
+class AgentStatusPoller:
+    """Shared poller of the agents connection status in global.db.
+
+    The threads waiting for agents statuses register in the poller. A background thread makes one query per interval
+    for all the pending agents (see `wazuh_db.get_agents_connection_status`) and wakes up every waiter whose agents have
+    reached the expected status. The thread stops when there are no waiters left.
+
+    Args:
+        interval (float): Seconds between queries.
+        chunk_size (int): Maximum number of agents of each wazuh-db query.
+
+    Attributes:
+        interval (float): Seconds between queries.
+        chunk_size (int): Maximum number of agents of each wazuh-db query.
+        queries (int): Number of polls made.
+    """
+    def __init__(self, interval=1, chunk_size=500):
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.queries = 0
+        self._waiters = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def wait(self, agent_ids, status='active', timeout=50, min_agents=None):
+        """Wait until a number of agents reach a connection status.
+
+        Args:
+            agent_ids (list): IDs of the agents.
+            status (str): Expected connection status (active, disconnected, pending, never_connected).
+            timeout (float): Maximum time to wait in seconds.
+            min_agents (int): Number of agents that have to reach the status. Default all of them.
+
+        Returns:
+            set: IDs of the agents that have reached the status.
+
+        Raises:
+            TimeoutError: If not enough agents reach the status before the timeout.
+        """
+        waiter = {
+            'ids': set(agent_ids),
+            'status': status,
+            'min_agents': len(set(agent_ids)) if min_agents is None else min_agents,
+            'reached': set(),
+            'event': threading.Event()
+        }
+        if waiter['min_agents'] <= 0:
+            return waiter['reached']
+
+        with self._lock:
+            self._waiters.append(waiter)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._poll, daemon=True)
+                self._thread.start()
+
+        if not waiter['event'].wait(timeout):
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+            if not waiter['event'].is_set():
+                raise TimeoutError(f"{len(waiter['reached'])}/{waiter['min_agents']} agents reached the status "
+                                   f"'{status}' in {timeout} seconds")
+
+        return waiter['reached']
+
+    def _poll(self):
+        """Query the status of the pending agents until there are no waiters left."""
+        while True:
+            with self._lock:
+                if not self._waiters:
+                    self._thread = None
+                    return
+                pending_ids = set()
+                for waiter in self._waiters:
+                    pending_ids.update(waiter['ids'] - waiter['reached'])
+
+            try:
+                statuses = wdb.get_agents_connection_status(pending_ids, chunk_size=self.chunk_size)
+                self.queries += 1
+            except Exception as error:
+                logging.warning(f"Could not get the agents connection status: {error}")
+                statuses = {}
+
+            with self._lock:
+                for waiter in list(self._waiters):
+                    waiter['reached'].update(agent_id for agent_id in waiter['ids'] - waiter['reached']
+                                             if statuses.get(agent_id) == waiter['status'])
+                    if len(waiter['reached']) >= waiter['min_agents']:
+                        self._waiters.remove(waiter)
+                        waiter['event'].set()
+
+            sleep(self.interval)
+
+
+agent_status_poller = AgentStatusPoller()
+
+
+def wait_agents_status(agents, status='active', timeout=50, min_agents=None):
+    """Wait until a number of agents reach a connection status in global.db.
+
+    Args:
+        agents (list): Agents to wait for.
+        status (str): Expected connection status (active, disconnected, pending, never_connected).
+        timeout (float): Maximum time to wait in seconds.
+        min_agents (int): Number of agents that have to reach the status. Default all of them.
+
+    Returns:
+        list: Agents that have reached the status.
+
+    Raises:
+        TimeoutError: If not enough agents reach the status before the timeout.
+    """
+    reached = agent_status_poller.wait([agent.id for agent in agents], status, timeout=timeout, min_agents=min_agents)
+
+    return [agent for agent in agents if agent.id in reached]
+
+
 def create_agents(agents_number, manager_address, cypher='aes', fim_eps=100, authd_password=None, agents_os=None,
-                  agents_version=None, disable_all_modules=False):
+                  agents_version=None, disable_all_modules=False, registration_workers=1, client_keys_path=None):
     """Create a list of generic agents
 
     This will create a list with `agents_number` amount of agents. All of them will be registered in the same manager.
@@ -1728,19 +2933,35 @@ def create_agents(agents_number, manager_address, cypher='aes', fim_eps=100, aut
         agents_os (list, optional): list containing different operative systems for the agents.
         agents_version (list, optional): list containing different version of the agent.
         disable_all_modules (boolean): Disable all simulated modules for this agent.
+        registration_workers (int, optional): number of agents enrolled at the same time. Default 1 for enrolling
+                                              them one by one.
+        client_keys_path (str, optional): client keys file of the manager. If it is set, the agents are added directly
+                                          to this file instead of being enrolled.
 
     Returns:
         list: list of the new virtual agents.
     """
     global agent_count
+    agents_os = [agents_os[agent] if agents_os is not None else get_default_os(agent_count + agent)
+                 for agent in range(agents_number)]
+    credentials = [(None, None, None)] * agents_number
+
+    if client_keys_path is not None or registration_workers > 1:
+        names = [generate_agent_name(agents_os[agent], agent_count + agent) for agent in range(agents_number)]
+        if client_keys_path is not None:
+            credentials = add_client_keys_entries(names, client_keys_path=client_keys_path)
+        else:
+            credentials = register_agents(names, manager_address, authd_password, workers=registration_workers)
+
     # Read client.keys and create virtual agents
     agents = []
     for agent in range(agents_number):
-        agent_os = agents_os[agent] if agents_os is not None else None
         agent_version = agents_version[agent] if agents_version is not None else None
+        agent_id, agent_name, agent_key = credentials[agent]
 
         agents.append(Agent(manager_address, cypher, fim_eps=fim_eps, authd_password=authd_password,
-                            os=agent_os, version=agent_version, disable_all_modules=disable_all_modules))
+                            os=agents_os[agent], version=agent_version, disable_all_modules=disable_all_modules,
+                            id=agent_id, name=agent_name, key=agent_key))
 
         agent_count = agent_count + 1
 
@@ -0,0 +1,390 @@
+# Copyright (C) 2015-2021, Wazuh Inc.
+# Created by Wazuh, Inc. <info@wazuh.com>.
+# This program is free software; you can redistribute it and/or modify it under the terms of GPLv2
+import asyncio
+import socket
+import sys
+
+from wazuh_testing import logger
+from wazuh_testing.tools import inotify
+from wazuh_testing.tools.monitoring import FileTailer, _callback_default, wazuh_pack, wazuh_unpack
+
+
+async def wait_for_callback(get_item, callback=_callback_default, accum_results=1, timeout=-1, timeout_extra=0,
+                            error_message=''):
+    """Wait until `callback` returns a result for `accum_results` items.
+
+    Args:
+        get_item (callable): Coroutine function that receives a timeout and returns the next item, or raises
+            `asyncio.TimeoutError` if there is no item before the timeout expires.
+        callback (callable, optional): Callback function to filter results.
+        accum_results (int, optional): Number of results to get. Default `1`
+        timeout (int, optional): Maximum timeout. Default `-1`
+        timeout_extra (int, optional): Grace period to fetch more events than specified in `accum_results`.
+            Default: 0.
+        error_message (str, optional): Message to log if the timeout expires. Default `''`
+
+    Raises:
+        TimeoutError: If less than `accum_results` results are found before the timeout expires.
+
+    Returns:
+        (list of any): It can return either a list of any type or simply any type.
+            If `accum_results > 1`, it will be a list.
+    """
+    loop = asyncio.get_running_loop()
+    result_list = []
+
+    async def collect(deadline, limit=None):
+        while limit is None or len(result_list) < limit:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            try:
+                item = await get_item(remaining)
+            except asyncio.TimeoutError:
+                continue
+            result = callback(item)
+            if result is not None and result:
+                result_list.append(result)
+        return True
+
+    if not await collect(loop.time() + timeout, accum_results):
+        if error_message:
+            logger.error(error_message)
+            logger.error(f"Results accumulated: {len(result_list)}")
+            logger.error(f"Results expected: {accum_results}")
+        raise TimeoutError(error_message)
+
+    if timeout_extra > 0:
+        await collect(loop.time() + timeout_extra)
+
+    return result_list[0] if len(result_list) == 1 else result_list
+
+
+class AsyncFileTailer(FileTailer):
+    """Read the lines appended to a file from an asyncio event loop.
+
+    Lines are read on demand with `get`, so no line is consumed unless it is returned. When inotify is available the
+    inotify descriptor is registered in the event loop, otherwise the file is polled every `time_step` seconds.
+    Rotations and truncations are handled as in `FileTailer`. The tailer is also an asynchronous iterator.
+
+    Args:
+        file_path (str): Path of the file to tail.
+        encoding (str): Optional - Encoding of the file.
+        time_step (float): Optional - Polling interval, only used when inotify is not available.
+        use_inotify (bool): Optional - Wait for inotify events instead of polling whenever it is possible.
+    """
+
+    def __init__(self, file_path, encoding=None, time_step=0.5, use_inotify=True):
+        super().__init__(file_path, encoding=encoding, time_step=time_step, use_inotify=use_inotify)
+        if encoding is not None:
+            self.encoding = encoding
+        self._file = None
+        self._watcher = None
+        self._changed = None
+        self._loop = None
+
+    def __copy__(self):
+        new_tailer = AsyncFileTailer(self.file_path, encoding=self.encoding, time_step=self.time_step,
+                                     use_inotify=self.use_inotify)
+        new_tailer._position = self._position
+        return new_tailer
+
+    def start(self):
+        raise TypeError('AsyncFileTailer does not run in a thread, await its get method instead')
+
+    def shutdown(self):
+        self.close()
+
+    def _open_async(self):
+        """Open the file and register the inotify watcher in the running loop."""
+        self._loop = asyncio.get_running_loop()
+        self._file = self._open()
+        self._file.seek(self._position)
+        self._changed = asyncio.Event()
+
+        if self.use_inotify:
+            try:
+                self._watcher = inotify.InotifyWatcher(self.file_path)
+            except OSError as e:
+                logger.debug(f'Could not watch {self.file_path} using inotify, falling back to polling: {e}')
+            else:
+                self._loop.add_reader(self._watcher.fileno(), self._on_inotify_event)
+
+    def _on_inotify_event(self):
+        if self._watcher.wait(0):
+            self._changed.set()
+
+    async def _wait_change(self, timeout):
+        if self._watcher is None:
+            await asyncio.sleep(min(timeout, self.time_step))
+            return
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def get(self, timeout=None):
+        """Return the next line of the file.
+
+        Args:
+            timeout (float, optional): Maximum time to wait for a new line. `None` waits forever. Default `None`
+
+        Raises:
+            asyncio.TimeoutError: If there is no new line before the timeout expires.
+
+        Returns:
+            str: Next line of the file.
+        """
+        if self._file is None:
+            self._open_async()
+        deadline = None if timeout is None else self._loop.time() + timeout
+
+        while True:
+            # Clear before reading, so a change notified while waiting is not lost
+            self._changed.clear()
+            line = self._file.readline()
+            if line:
+                self._position = self._file.tell()
+                return line
+
+            self._file.seek(self._position)
+            current_file = self._check_file(self._file)
+            if current_file is not self._file:
+                self._file = current_file
+                if self._watcher:
+                    self._watcher.watch_file()
+                continue
+
+            remaining = None if deadline is None else deadline - self._loop.time()
+            if remaining is not None and remaining <= 0:
+                raise asyncio.TimeoutError()
+            await self._wait_change(self.time_step if remaining is None else remaining)
+
+    def close(self):
+        """Close the file and unregister the inotify watcher."""
+        if self._watcher is not None:
+            self._loop.remove_reader(self._watcher.fileno())
+            self._watcher.close()
+            self._watcher = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.get()
+
+
+async def tail_file(file_path, encoding=None, time_step=0.5, use_inotify=True):
+    """Asynchronous generator yielding every line appended to a file, from its beginning.
+
+    Args:
+        file_path (str): Path of the file to tail.
+        encoding (str): Optional - Encoding of the file.
+        time_step (float): Optional - Polling interval, only used when inotify is not available.
+        use_inotify (bool): Optional - Wait for inotify events instead of polling whenever it is possible.
+
+    Yields:
+        str: Lines of the file.
+    """
+    tailer = AsyncFileTailer(file_path, encoding=encoding, time_step=time_step, use_inotify=use_inotify)
+    try:
+        while True:
+            yield await tailer.get()
+    finally:
+        tailer.close()
+
+
+class AsyncFileMonitor:
+    def __init__(self, file_path, time_step=0.5, use_inotify=True):
+        """Monitor the lines of a file from an asyncio event loop.
+
+        It offers the same interface as `FileMonitor`, but `start` is a coroutine, so several files can be monitored
+        at the same time with `asyncio.gather` without any helper thread.
+
+        Args:
+            file_path (str): Path of the file to monitor.
+            time_step (float, optional): Polling interval, only used when inotify is not available. Default `0.5`
+            use_inotify (bool, optional): Wait for inotify events instead of polling whenever it is possible.
+                Default `True`
+        """
+        self.tailer = AsyncFileTailer(file_path, time_step=time_step, use_inotify=use_inotify)
+        self._result = None
+
+    async def start(self, timeout=-1, callback=_callback_default, accum_results=1, update_position=True,
+                    timeout_extra=0, error_message='', encoding=None):
+        """Monitor the file until `accum_results` lines match the callback."""
+        tailer = self.tailer if update_position else self.tailer.__copy__()
+        if encoding is not None:
+            tailer.encoding = encoding
+        try:
+            self._result = await wait_for_callback(tailer.get, callback=callback, accum_results=accum_results,
+                                                   timeout=timeout, timeout_extra=timeout_extra,
+                                                   error_message=error_message)
+        finally:
+            tailer.close()
+
+        return self
+
+    def result(self):
+        return self._result
+
+
+class AsyncSocketController:
+
+    def __init__(self, address, family='AF_UNIX', connection_protocol='TCP', timeout=30):
+        """Stream socket client working on an asyncio event loop.
+
+        Args:
+            address (str or Tuple(str, int)): Address of the socket, the format of the address depends on the type.
+                A regular file path for AF_UNIX or a Tuple(HOST, PORT) for AF_INET
+            family (str): Family type of socket to connect to, AF_UNIX for unix sockets or AF_INET for port sockets.
+            connection_protocol (str): Only TCP is supported. UDP sockets can be used through `SocketController`.
+            timeout (int): Optional - Connection timeout.
+
+        Raises:
+            TypeError: If the family or the protocol are not supported.
+        """
+        if family not in ('AF_UNIX', 'AF_INET', 'AF_INET6'):
+            raise TypeError(f'Invalid family type detected: {family}. Valid ones are AF_UNIX, AF_INET or AF_INET6')
+        if family == 'AF_UNIX' and sys.platform == 'win32':
+            raise TypeError('AF_UNIX sockets are not available in this platform')
+        if connection_protocol.lower() != 'tcp':
+            raise TypeError(f'Invalid connection protocol detected: {connection_protocol.lower()}. '
+                            f'AsyncSocketController only supports TCP')
+
+        self.address = address
+        self.family = family
+        self.connection_protocol = connection_protocol
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        # Size of a message whose header has been read but whose payload has not been received yet
+        self._pending_size = None
+
+    async def open(self):
+        """Connect to the socket."""
+        try:
+            if self.family == 'AF_UNIX':
+                connection = asyncio.open_unix_connection(self.address)
+            else:
+                family = socket.AF_INET if self.family == 'AF_INET' else socket.AF_INET6
+                connection = asyncio.open_connection(*self.address, family=family)
+            self.reader, self.writer = await asyncio.wait_for(connection, self.timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f'Could not connect to socket {self.address} of family {self.family}')
+
+    async def close(self):
+        """Close the socket gracefully."""
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+            self.writer = None
+
+    async def send(self, message, size=False):
+        """Send a message to the socket.
+
+        Args:
+            message (str or bytes): Message to be sent.
+            size (bool, optional) : Flag that indicates if the header of the message includes the size of the message
+                (For example, Analysis doesn't need the size, wazuh-db does). Default `False`
+        Returns:
+            (int) : Size of the sent message
+        """
+        msg_bytes = message.encode() if isinstance(message, str) else message
+        msg_bytes = wazuh_pack(len(msg_bytes)) + msg_bytes if size else msg_bytes
+        self.writer.write(msg_bytes)
+        await self.writer.drain()
+
+        return len(msg_bytes)
+
+    async def receive(self, size=False, timeout=None):
+        """Receive a message from the socket.
+
+        The wait can be cancelled at any moment, even by `asyncio.wait_for`, without breaking the framing of the next
+        messages.
+
+        Args:
+            size (bool): Flag that indicates if the header of the message includes the size of the message
+                (For example, Analysis doesn't need the size, wazuh-db does). Default `False`
+            timeout (float): Optional - Maximum time to wait for the message. `None` waits forever.
+
+        Raises:
+            asyncio.TimeoutError: If no message is received before the timeout expires.
+            ConnectionResetError: If the peer has closed the connection.
+
+        Returns:
+            bytes: Socket message.
+        """
+        return await asyncio.wait_for(self._receive(size), timeout)
+
+    async def _receive(self, size):
+        if not size:
+            output = await self.reader.read(65536)
+            if not output:
+                raise ConnectionResetError(f'Connection closed by the peer of socket {self.address}')
+            return output
+
+        if self._pending_size is None:
+            try:
+                header = await self.reader.readexactly(4)
+            except asyncio.IncompleteReadError:
+                raise ConnectionResetError(f'Connection closed by the peer of socket {self.address}')
+            self._pending_size = wazuh_unpack(header)
+        try:
+            output = await self.reader.readexactly(self._pending_size)
+        except asyncio.IncompleteReadError:
+            self._pending_size = None
+            raise ConnectionResetError(f'Connection closed by the peer of socket {self.address} in the middle of '
+                                       f'a message')
+        self._pending_size = None
+
+        return output
+
+    async def request(self, message, size=True, timeout=None):
+        """Send a message and wait for its reply.
+
+        Args:
+            message (str or bytes): Message to be sent.
+            size (bool, optional): Flag that indicates if the messages include the size header. Default `True`
+            timeout (float): Optional - Maximum time to wait for the reply. `None` waits forever.
+
+        Returns:
+            bytes: Reply of the message.
+        """
+        await self.send(message, size=size)
+        return await self.receive(size=size, timeout=timeout)
+
+    async def monitor(self, callback=_callback_default, accum_results=1, timeout=-1, timeout_extra=0, size=False,
+                      error_message=''):
+        """Wait until `accum_results` received messages match the callback.
+
+        Args:
+            callback (callable, optional): Callback function to filter the received messages.
+            accum_results (int, optional): Number of results to get. Default `1`
+            timeout (int, optional): Maximum timeout. Default `-1`
+            timeout_extra (int, optional): Grace period to fetch more messages than specified in `accum_results`.
+                Default: 0.
+            size (bool, optional): Flag that indicates if the messages include the size header. Default `False`
+            error_message (str, optional): Message to log if the timeout expires. Default `''`
+
+        Raises:
+            TimeoutError: If less than `accum_results` messages match before the timeout expires.
+            ConnectionResetError: If the peer closes the connection before enough messages match.
+
+        Returns:
+            (list of any): Results of the callback, or a single result if `accum_results` is 1.
+        """
+        return await wait_for_callback(lambda remaining: self.receive(size=size, timeout=remaining),
+                                       callback=callback, accum_results=accum_results, timeout=timeout,
+                                       timeout_extra=timeout_extra, error_message=error_message)
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
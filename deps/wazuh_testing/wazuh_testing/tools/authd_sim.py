@@ -1,24 +1,137 @@
+import os
+import secrets
+import socket
+import socketserver
 import ssl
+import stat
+import tempfile
+import threading
 import time
 
-from wazuh_testing.tools.monitoring import ManInTheMiddle
+from OpenSSL import crypto
+
+from wazuh_testing.tools.monitoring import ManInTheMiddle, Queue, SSLStreamServerPort
 from wazuh_testing.tools.security import CertificateController
 
+CERTIFICATES_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'wazuh_authd_simulator')
+CACHED_KEY_NAME = 'manager.key'
+CACHED_CERT_NAME = 'manager.cert'
+
+_cached_controllers = {}
+_cached_controllers_lock = threading.Lock()
+
+
+def _check_private_directory(path):
+    """Create a directory only accessible by the current user, or check that an existing one is.
+
+    Raises:
+        PermissionError: If the directory is not owned by the current user or other users can access it.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if not hasattr(os, 'getuid'):
+        return
+
+    dir_stat = os.lstat(path)
+    if not stat.S_ISDIR(dir_stat.st_mode) or dir_stat.st_uid != os.getuid() or dir_stat.st_mode & 0o077:
+        raise PermissionError(f'{path} must be a directory owned by the current user and not accessible by others')
+
+
+def _write_file_atomically(path, data):
+    """Write a private file through a unique temporary one, so other processes never read it half written."""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def get_cached_certificate_controller(cache_dir=CERTIFICATES_CACHE_DIR):
+    """Get a certificate controller with the signed CA key and certificate stored in a cache directory.
+
+    They are generated and stored the first time, and loaded from the directory afterwards, so the slow generation of
+    the RSA key is done only once across runs. The directory must be private to the current user, since it holds the
+    CA private key and its content is trusted.
+
+    Args:
+        cache_dir (str): Directory of the cached key and certificate.
+
+    Returns:
+        CertificateController: Controller with the cached CA key and certificate.
+
+    Raises:
+        PermissionError: If the directory is not owned by the current user or other users can access it.
+    """
+    key_path = os.path.join(cache_dir, CACHED_KEY_NAME)
+    cert_path = os.path.join(cache_dir, CACHED_CERT_NAME)
+
+    with _cached_controllers_lock:
+        controller = _cached_controllers.get(cache_dir)
+        if controller is not None:
+            return controller
+
+        _check_private_directory(cache_dir)
+        try:
+            with open(key_path, 'rb') as key_file, open(cert_path, 'rb') as cert_file:
+                controller = CertificateController(ca_key=crypto.load_privatekey(crypto.FILETYPE_PEM, key_file.read()),
+                                                   ca_cert=crypto.load_certificate(crypto.FILETYPE_PEM,
+                                                                                   cert_file.read()))
+        except (OSError, crypto.Error):
+            controller = CertificateController()
+            controller.get_root_ca_cert().sign(controller.get_root_key(), controller.digest)
+            _write_file_atomically(key_path, crypto.dump_privatekey(crypto.FILETYPE_PEM, controller.get_root_key()))
+            _write_file_atomically(cert_path, crypto.dump_certificate(crypto.FILETYPE_PEM,
+                                                                      controller.get_root_ca_cert()))
+        _cached_controllers[cache_dir] = controller
+
+    return controller
+
+
+def parse_enrollment_request(received):
+    """Parse the agent name and IP of an enrollment request.
+
+    Expected message:
+        OSSEC A:'{name}' G:'{groups}' IP:'{ip}'\n
+
+    Args:
+        received (bytes): Enrollment request.
+
+    Returns:
+        str: Agent name. None if the request has no name.
+        str: Agent IP, 'any' if the request has no IP.
+    """
+    name = None
+    ip = 'any'
+    for part in received.decode().split(' '):
+        if part.startswith('A:'):
+            name = part.split("'")[1]
+        if part.startswith('IP:'):
+            ip = part.split("'")[1]
+
+    return name, ip
+
 
 class AuthdSimulator:
     """
     Create an SSL server socket for simulating authd connection
+
+    If `cert_cache_dir` is set, the CA key and certificate are taken from that directory, where they are generated
+    only the first time (see `get_cached_certificate_controller`). By default new ones are generated on every start.
     """
+    reject_delay = 2
 
     def __init__(self, server_address='127.0.0.1', enrollment_port=1515, key_path='/etc/manager.key',
-                 cert_path='/etc/manager.cert', initial_mode='ACCEPT'):
+                 cert_path='/etc/manager.cert', initial_mode='ACCEPT', cert_cache_dir=None):
         self.mitm_enrollment = ManInTheMiddle(address=(server_address, enrollment_port), family='AF_INET',
                                               connection_protocol='SSL', func=self._process_enrollment_message)
         self.key_path = key_path
         self.cert_path = cert_path
+        self.cert_cache_dir = cert_cache_dir
         self.id_count = 1
         self.secret = 'TopSecret'
-        self.controller = CertificateController()
+        self._controller = None
         self.mode = initial_mode
 
     def start(self):
@@ -49,6 +162,12 @@ class AuthdSimulator:
     def queue(self):
         return self.mitm_enrollment.queue
 
+    @property
+    def controller(self):
+        if self._controller is None:
+            self._controller = CertificateController()
+        return self._controller
+
     @property
     def cert_controller(self):
         return self.controller
@@ -81,7 +200,7 @@ class AuthdSimulator:
             OSSEC K: {id} {name} {ip} {key:64}
         """
         if self.mode == 'REJECT':
-            time.sleep(2)
+            time.sleep(self.reject_delay)
             self.mitm_enrollment.event.set()
             return b'ERROR'
 
@@ -93,14 +212,7 @@ class AuthdSimulator:
         if len(received) == 0:
             # Empty message
             raise
-        parts = received.decode().split(' ')
-        for part in parts:
-            if part.startswith('A:'):
-                agent_info['name'] = part.split("'")[1]
-            if part.startswith('IP:'):
-                agent_info['ip'] = part.split("'")[1]
-        if agent_info['ip'] is None:
-            agent_info['ip'] = 'any'
+        agent_info['name'], agent_info['ip'] = parse_enrollment_request(received)
         if agent_info['ip'] == 'src':
             agent_info['ip'] = self.mitm_enrollment.listener.last_address[0]
         self.id_count += 1
@@ -108,7 +220,241 @@ class AuthdSimulator:
         return f'OSSEC K:\'{agent_info.get("id"):03d} {agent_info.get("name")} {agent_info["ip"]} {self.secret}\'\n'.encode()
 
     def _generate_certificates(self):
-        # Generate root key and certificate
-        self.controller.get_root_ca_cert().sign(self.controller.get_root_key(), self.controller.digest)
+        if self.cert_cache_dir and self._controller is None:
+            # Take the signed root key and certificate from the cache
+            self._controller = get_cached_certificate_controller(self.cert_cache_dir)
+        else:
+            # Generate root key and certificate
+            self.controller.get_root_ca_cert().sign(self.controller.get_root_key(), self.controller.digest)
         self.controller.store_private_key(self.controller.get_root_key(), self.key_path)
         self.controller.store_ca_certificate(self.controller.get_root_ca_cert(), self.cert_path)
+
+
+class EnrollmentServer(socketserver.ThreadingTCPServer):
+    """Threaded enrollment server of `MultiAgentAuthdSimulator`.
+
+    Unlike `SSLStreamServerPort`, the connections share one SSL context, so TLS sessions can be resumed, and the TLS
+    handshakes are done in the connection threads instead of the accepting one, so many of them run in parallel.
+
+    Args:
+        server_address (tuple): Address and port to listen to.
+        simulator (MultiAgentAuthdSimulator): Simulator handling the enrollment requests.
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+    block_on_close = False
+    request_queue_size = socket.SOMAXCONN
+
+    def __init__(self, server_address, simulator):
+        self.simulator = simulator
+        super().__init__(server_address, EnrollmentHandler)
+
+
+class EnrollmentHandler(socketserver.BaseRequestHandler):
+    """Handler of the connections of `EnrollmentServer`."""
+
+    def handle(self):
+        self.server.simulator.handle_connection(self.request, self.client_address)
+
+
+class MultiAgentAuthdSimulator(AuthdSimulator):
+    """Authd simulator enrolling many agents at the same time.
+
+    Each connection is served in its own thread, where its TLS handshake is done, and the agent ID and key of each
+    enrollment are allocated atomically, so enrollment storms can be reproduced without a manager. Every agent gets a
+    random key unless `secret` is set, and enrolling an existing agent name replaces the old agent, like authd does
+    with the force option. The enrolled agents can be written as a client.keys file to be used by the remoted
+    simulators.
+
+    Args:
+        server_address (str): Address to listen to.
+        enrollment_port (int): Enrollment port.
+        key_path (str): Path where the key of the SSL server is stored.
+        cert_path (str): Path where the certificate of the SSL server is stored.
+        initial_mode (str): Simulator mode (ACCEPT or REJECT).
+        cert_cache_dir (str): Private directory of the cached CA key and certificate, i.e. `CERTIFICATES_CACHE_DIR`.
+            Default None to generate new ones on every start.
+        secret (str): Key of all the agents. Default None to generate a random key for each agent.
+
+    Attributes:
+        agents (dict): Name, IP and key of each enrolled agent, by agent ID.
+        counters (dict): Number of enrollments, rejected and invalid requests and failed TLS handshakes.
+
+    Examples:
+        >>> authd = MultiAgentAuthdSimulator(key_path='/tmp/manager.key', cert_path='/tmp/manager.cert',
+        ...                                  cert_cache_dir=CERTIFICATES_CACHE_DIR)
+        >>> authd.start()
+        >>> agents = register_agents([f'agent{i}' for i in range(5000)], '127.0.0.1', workers=256)
+        >>> authd.get_stats()['enrollments_per_second']
+        1250.3
+        >>> authd.write_client_keys('/tmp/client.keys')
+        >>> authd.shutdown()
+    """
+    reject_delay = 0
+    connection_timeout = 10
+
+    def __init__(self, server_address='127.0.0.1', enrollment_port=1515, key_path='/etc/manager.key',
+                 cert_path='/etc/manager.cert', initial_mode='ACCEPT', cert_cache_dir=None,
+                 secret=None):
+        super().__init__(server_address=server_address, enrollment_port=enrollment_port, key_path=key_path,
+                         cert_path=cert_path, initial_mode=initial_mode, cert_cache_dir=cert_cache_dir)
+        self.server_address = (server_address, enrollment_port)
+        self.secret = secret
+        self.server = None
+        self.thread = None
+        self.ssl_context = None
+        self.agents = {}
+        self.agent_names = {}
+        self.counters = {'enrollments': 0, 'rejected': 0, 'invalid_requests': 0, 'handshake_failures': 0}
+        self.first_enrollment_time = None
+        self.last_enrollment_time = None
+        self._lock = threading.Lock()
+        self._queue = Queue()
+
+    def start(self):
+        """
+        Generates certificate for the SSL server and starts the enrollment server
+        """
+        self._generate_certificates()
+        self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.ssl_context.minimum_version = ssl.TLSVersion.TLSv1_2
+        self.ssl_context.set_ciphers(SSLStreamServerPort.ciphers)
+        self.ssl_context.load_cert_chain(self.cert_path, self.key_path)
+
+        self.server = EnrollmentServer(self.server_address, self)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def shutdown(self):
+        """
+        Shutdown the enrollment server
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def clear(self):
+        """
+        Clear the received enrollment requests
+        """
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+    @property
+    def queue(self):
+        return self._queue
+
+    def handle_connection(self, sock, address):
+        """Do the TLS handshake of an agent connection and answer its enrollment request.
+
+        Args:
+            sock (socket): Accepted connection.
+            address (tuple): Address of the agent.
+        """
+        sock.settimeout(self.connection_timeout)
+        try:
+            connection = self.ssl_context.wrap_socket(sock, server_side=True)
+        except (OSError, ValueError):
+            with self._lock:
+                self.counters['handshake_failures'] += 1
+            return
+
+        with connection:
+            try:
+                received = connection.recv(4096)
+                response = self.process_enrollment_request(received, address)
+                self._queue.put((received, response))
+                connection.sendall(response)
+            except OSError:
+                pass
+
+    def process_enrollment_request(self, received, address):
+        """Answer an enrollment request according to the simulator mode.
+
+        Key response:
+            OSSEC K:'{id} {name} {ip} {key}'
+
+        Args:
+            received (bytes): Enrollment request.
+            address (tuple): Address of the agent.
+
+        Returns:
+            bytes: Response to the agent.
+        """
+        if self.mode == 'REJECT':
+            time.sleep(self.reject_delay)
+            with self._lock:
+                self.counters['rejected'] += 1
+            return b'ERROR'
+
+        try:
+            name, ip = parse_enrollment_request(received)
+        except (UnicodeDecodeError, IndexError):
+            name = None
+        if not name:
+            with self._lock:
+                self.counters['invalid_requests'] += 1
+            return b'ERROR: Invalid request'
+
+        if ip == 'src':
+            ip = address[0]
+        agent_id, key = self.register_agent(name, ip)
+
+        return f"OSSEC K:'{agent_id} {name} {ip} {key}'\n".encode()
+
+    def register_agent(self, name, ip='any'):
+        """Allocate the ID and key of a new agent atomically, replacing the agent with the same name if any.
+
+        Args:
+            name (str): Agent name.
+            ip (str): Agent IP.
+
+        Returns:
+            str: Agent ID.
+            str: Agent key.
+        """
+        key = self.secret or secrets.token_hex(32)
+        with self._lock:
+            old_agent_id = self.agent_names.pop(name, None)
+            if old_agent_id is not None:
+                del self.agents[old_agent_id]
+            agent_id = f'{self.id_count:03d}'
+            self.id_count += 1
+            self.agents[agent_id] = (name, ip, key)
+            self.agent_names[name] = agent_id
+
+            self.counters['enrollments'] += 1
+            self.last_enrollment_time = time.time()
+            if self.first_enrollment_time is None:
+                self.first_enrollment_time = self.last_enrollment_time
+
+        return agent_id, key
+
+    def get_stats(self):
+        """Get the enrollment counters and rate.
+
+        The rate is calculated between the first and the last enrollment, so it measures the enrollment storms
+        without the idle time before and after them.
+
+        Returns:
+            dict: Counters, number of registered agents and enrollments per second.
+        """
+        with self._lock:
+            stats = dict(self.counters)
+            stats['agents'] = len(self.agents)
+            elapsed = (self.last_enrollment_time or 0) - (self.first_enrollment_time or 0)
+        stats['enrollments_per_second'] = round(stats['enrollments'] / elapsed, 1) if elapsed > 0 else 0
+
+        return stats
+
+    def write_client_keys(self, client_keys_path):
+        """Write the enrolled agents as a client.keys file.
+
+        Args:
+            client_keys_path (str): Client keys file path.
+        """
+        with self._lock:
+            lines = [f'{agent_id} {name} {ip} {key}\n' for agent_id, (name, ip, key) in self.agents.items()]
+        with open(client_keys_path, 'w') as client_keys:
+            client_keys.writelines(lines)
@@ -1,6 +1,8 @@
+import os
 import random
 
 import wazuh_testing
+from wazuh_testing.tools import inotify
 
 
 def add_client_keys_entry(agent_id, agent_name, agent_ip='any', agent_key=None):
@@ -60,3 +62,139 @@ def delete_client_keys_entry(agent_id):
     with open(wazuh_testing.CLIENT_KEYS_PATH, 'w') as client_keys:
         for _, client_key_entry in registered_client_key_entries_dict.items():
             client_keys.write(f"{client_key_entry}\n")
+
+
+def add_client_keys_entries(agent_names, agent_ip='any', client_keys_path=None):
+    """Add a batch of new agents to a client keys file, with consecutive IDs after the highest one in the file.
+
+    The entries are appended with a single write, so it is much faster than enrolling the agents when many of them
+    are needed.
+
+    Args:
+        agent_names (list): Names of the new agents.
+        agent_ip (str): IP of the new agents.
+        client_keys_path (str): Client keys file path. Default `wazuh_testing.CLIENT_KEYS_PATH`.
+
+    Returns:
+        list: Tuples with the ID, name and key of each new agent.
+    """
+    client_keys_path = wazuh_testing.CLIENT_KEYS_PATH if client_keys_path is None else client_keys_path
+    last_id = 0
+
+    # Get the highest agent ID, removed agents included
+    if os.path.exists(client_keys_path):
+        with open(client_keys_path, 'r') as client_keys:
+            for client_key_entry in client_keys:
+                fields = client_key_entry.split()
+                if fields and fields[0].isdigit():
+                    last_id = max(last_id, int(fields[0]))
+
+    new_entries = [(str(last_id + index).zfill(3), agent_name, '%064x' % random.getrandbits(256))
+                   for index, agent_name in enumerate(agent_names, start=1)]
+
+    with open(client_keys_path, 'a') as client_keys:
+        client_keys.write(''.join(f"{agent_id} {agent_name} {agent_ip} {agent_key}\n"
+                                  for agent_id, agent_name, agent_key in new_entries))
+
+    return new_entries
+
+
+class ClientKeysStore:
+    """Cache of a client keys file, indexed by agent ID and by agent IP.
+
+    The file is only read again when it changes. Changes are detected with inotify when it is available, and comparing
+    the modification time, size and inode of the file otherwise.
+
+    Args:
+        client_keys_path (str): Client keys file path. Default `wazuh_testing.CLIENT_KEYS_PATH`.
+        use_inotify (bool): Detect the changes with inotify whenever it is possible.
+
+    Attributes:
+        client_keys_path (str): Client keys file path.
+        by_id (dict): Entries by agent ID, as (id, name, ip, key) tuples.
+        by_ip (dict): Entries by agent IP, as (id, name, ip, key) tuples.
+        loads (int): Number of times the file has been read.
+
+    Examples:
+        >>> keystore = ClientKeysStore('/var/ossec/etc/client.keys')
+        >>> keystore.refresh()
+        True
+        >>> keystore.by_id['001']
+        ('001', 'agent1', 'any', 'c0ffee...')
+    """
+
+    def __init__(self, client_keys_path=None, use_inotify=True):
+        self.client_keys_path = wazuh_testing.CLIENT_KEYS_PATH if client_keys_path is None else client_keys_path
+        self.by_id = {}
+        self.by_ip = {}
+        self.loads = 0
+        self._signature = None
+        self._watcher = None
+
+        if use_inotify and inotify.is_available():
+            try:
+                self._watcher = inotify.InotifyWatcher(self.client_keys_path)
+            except OSError:
+                pass
+
+    def _get_signature(self):
+        """Get the modification time, size and inode of the file, or None if it does not exist."""
+        try:
+            stat = os.stat(self.client_keys_path)
+        except FileNotFoundError:
+            return None
+
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def refresh(self):
+        """Read the file again if it has changed since the last time it was read.
+
+        Returns:
+            bool: True if the file has been read, False if it has not changed.
+        """
+        if self._watcher is not None:
+            if self.loads and not self._watcher.wait(0):
+                return False
+            # The file may have been replaced, so the new one is watched
+            self._watcher.watch_file()
+        else:
+            signature = self._get_signature()
+            if self.loads and signature == self._signature:
+                return False
+            self._signature = signature
+
+        self.load()
+
+        return True
+
+    def load(self):
+        """Read and index the file. Lines that are not client keys entries are ignored."""
+        by_id = {}
+        by_ip = {}
+
+        if os.path.exists(self.client_keys_path):
+            with open(self.client_keys_path) as client_keys:
+                for client_key_entry in client_keys:
+                    fields = client_key_entry.split()
+                    if len(fields) == 4:
+                        entry = tuple(fields)
+                        by_id[entry[0]] = entry
+                        by_ip[entry[2]] = entry
+
+        self.by_id = by_id
+        self.by_ip = by_ip
+        self.loads += 1
+
+    def get_first(self):
+        """Get the first entry of the file.
+
+        Returns:
+            tuple: Agent ID, name, IP and key. None if the file is empty.
+        """
+        return next(iter(self.by_id.values()), None)
+
+    def close(self):
+        """Stop watching the file."""
+        if self._watcher is not None:
+            self._watcher.close()
+            self._watcher = None
@@ -3,6 +3,7 @@
 # This program is free software; you can redistribute it and/or modify it under the terms of GPLv2
 import bz2
 import gzip
+import hashlib
 import json
 import yaml
 import os
@@ -12,6 +13,7 @@ import socket
 import stat
 import sys
 import string
+import tempfile
 import xml.etree.ElementTree as ET
 import zipfile
 
@@ -227,6 +229,41 @@ def download_file(source_url, dest_path):
         dest_file.write(request.content)
 
 
+def stream_download_file(source_url, dest_path, chunk_size=1024 * 1024):
+    """Download a file writing it in chunks as it is received, and calculate its SHA1 hash on the fly.
+
+    The file is downloaded to a temporary file in the same directory that replaces the destination once complete,
+    so readers that have the previous file open or mapped in memory keep seeing its old content.
+
+    Args:
+        source_url (str): URL of the file.
+        dest_path (str): Destination file path.
+        chunk_size (int): Size of the chunks read from the response.
+
+    Returns:
+        str: SHA1 hash of the downloaded file.
+
+    Raises:
+        requests.exceptions.HTTPError: If the server response is an error.
+    """
+    sha1 = hashlib.sha1()
+    with requests.get(source_url, allow_redirects=True, stream=True) as response:
+        response.raise_for_status()
+        temp_fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(dest_path)))
+        try:
+            with os.fdopen(temp_fd, 'wb') as dest_file:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    sha1.update(chunk)
+                    dest_file.write(chunk)
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, dest_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    return sha1.hexdigest()
+
+
 def remove_file(file_path):
     """Remove a file or a directory path.
 
@@ -0,0 +1,180 @@
+# Copyright (C) 2015-2021, Wazuh Inc.
+# Created by Wazuh, Inc. <info@wazuh.com>.
+# This program is free software; you can redistribute it and/or modify it under the terms of GPLv2
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+
+# Event masks from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+FILE_EVENTS_MASK = IN_MODIFY | IN_ATTRIB | IN_MOVE_SELF | IN_DELETE_SELF
+DIRECTORY_EVENTS_MASK = IN_CREATE | IN_MOVED_TO
+
+EVENT_HEADER = struct.Struct('iIII')
+READ_BUFFER_SIZE = 64 * 1024
+
+
+def _load_libc():
+    """Load the C library exposing the inotify syscalls, if any.
+
+    Returns:
+        ctypes.CDLL: Loaded library or `None` if inotify is not supported in the current platform.
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        for function_name in ('inotify_init1', 'inotify_add_watch', 'inotify_rm_watch'):
+            getattr(libc, function_name)
+    except (OSError, AttributeError):
+        return None
+
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+    return libc
+
+
+_libc = _load_libc()
+
+
+def is_available():
+    """Check if inotify can be used in the current platform.
+
+    Returns:
+        bool: True if the inotify syscalls are available, False otherwise.
+    """
+    return _libc is not None
+
+
+class InotifyWatcher:
+    """Wait for changes in a single file using inotify.
+
+    The file itself is watched for writes, truncations, moves and deletions. Its parent directory is watched too, so
+    the watcher also wakes up when the file is created again after a rotation.
+
+    Args:
+        file_path (str): Path of the file to watch.
+
+    Raises:
+        OSError: If the inotify instance could not be created.
+    """
+
+    def __init__(self, file_path):
+        if not is_available():
+            raise OSError(errno.ENOSYS, 'inotify is not available in this platform')
+
+        self.file_path = os.path.abspath(file_path)
+        self._directory, self._file_name = os.path.split(self.file_path)
+        self._file_name = os.fsencode(self._file_name)
+        self._fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+        self._file_wd = None
+        try:
+            self._directory_wd = self._add_watch(self._directory, DIRECTORY_EVENTS_MASK)
+            self.watch_file()
+        except OSError:
+            self.close()
+            raise
+
+    def _add_watch(self, path, mask):
+        """Add a new watch to the inotify instance.
+
+        Args:
+            path (str): Path to watch.
+            mask (int): Events to watch.
+
+        Returns:
+            int: Watch descriptor.
+        """
+        wd = _libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+
+        return wd
+
+    def watch_file(self):
+        """Attach the file watch to the file currently found at `file_path`.
+
+        It must be called after the file has been rotated, so the new file is watched instead of the old one.
+        """
+        if self._file_wd is not None:
+            # The watch may have been already removed by the kernel if the file was deleted
+            _libc.inotify_rm_watch(self._fd, self._file_wd)
+            self._file_wd = None
+        try:
+            self._file_wd = self._add_watch(self.file_path, FILE_EVENTS_MASK)
+        except FileNotFoundError:
+            pass
+
+    def fileno(self):
+        """Return the file descriptor of the inotify instance, so it can be registered in selectors and event loops.
+
+        Returns:
+            int: File descriptor of the inotify instance.
+        """
+        return self._fd
+
+    def wait(self, timeout=None):
+        """Wait until the watched file changes.
+
+        Args:
+            timeout (float): Maximum time to wait in seconds. `None` waits forever.
+
+        Returns:
+            bool: True if the file has changed, False if the timeout expired.
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return False
+
+        try:
+            data = os.read(self._fd, READ_BUFFER_SIZE)
+        except BlockingIOError:
+            return False
+
+        changed = False
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + name_length].rstrip(b'\x00')
+            offset += name_length
+
+            if wd == self._file_wd:
+                if mask & IN_IGNORED:
+                    self._file_wd = None
+                changed = True
+            elif wd == self._directory_wd and name == self._file_name:
+                changed = True
+
+        return changed
+
+    def close(self):
+        """Release the inotify instance."""
+        if self._fd is not None and self._fd >= 0:
+            os.close(self._fd)
+        self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
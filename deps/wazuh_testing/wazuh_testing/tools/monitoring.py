@@ -20,16 +20,25 @@ import ssl
 import sys
 import threading
 import time
+import warnings
 import yaml
 
-from collections import defaultdict
+from collections import defaultdict, deque
 from copy import copy
 from datetime import datetime
-from multiprocessing import Process, Manager
+from functools import lru_cache
+from multiprocessing import Event, Process, Manager
 from struct import pack, unpack
-from lockfile import FileLock
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
 from wazuh_testing import logger
+from wazuh_testing.tools import inotify
 from wazuh_testing.tools.file import truncate_file
+from wazuh_testing.tools.sockets import recv_available, recv_exact, recv_frame
 from wazuh_testing.tools.system import HostManager
 
 REMOTED_DETECTOR_PREFIX = r'.*wazuh-remoted.*'
@@ -42,6 +51,7 @@ WAZUH_DB_PREFIX = r'.*wazuh-db.*'
 
 DEFAULT_POLL_FILE_TIME = 1
 DEFAULT_WAIT_FILE_TIMEOUT = 30
+DEFAULT_SHARED_BUFFER_SIZE = 100000
 
 
 def wazuh_unpack(data, format_: str = "<I"):
@@ -100,11 +110,24 @@ def _callback_default(line):
 
 
 class FileTailer:
+    """Read the lines appended to a file in a background thread and put them in a queue.
+
+    When inotify is available the tailer sleeps until the file is modified, otherwise it polls the file every
+    `time_step` seconds. In both modes the file is reopened if it is rotated and read from the beginning if it is
+    truncated.
+
+    Args:
+        file_path (str): Path of the file to tail.
+        encoding (str): Optional - Encoding of the file.
+        time_step (float): Optional - Polling interval. It also bounds the time it takes to shutdown the tailer.
+        use_inotify (bool): Optional - Wait for inotify events instead of polling whenever it is possible.
+    """
 
-    def __init__(self, file_path, encoding=None, time_step=0.5):
+    def __init__(self, file_path, encoding=None, time_step=0.5, use_inotify=True):
         self.file_path = file_path
         self._position = 0
         self.time_step = time_step
+        self.use_inotify = use_inotify and inotify.is_available()
         self._queue = Queue()
         self.event = threading.Event()
         self.thread = None
@@ -145,18 +168,289 @@ class FileTailer:
         self.event.set()
         self.thread.join()
 
+    def _open(self):
+        return open(self.file_path, encoding=self.encoding, errors='backslashreplace')
+
+    def _check_file(self, file):
+        """Detect if the tailed file has been rotated or truncated since the last read.
+
+        Args:
+            file (TextIOWrapper): File currently being read, already consumed until its end.
+
+        Returns:
+            TextIOWrapper: File to keep reading from. It is a new file object if the file was rotated.
+        """
+        try:
+            path_stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            # The file was moved or removed and has not been created yet
+            return file
+
+        file_stat = os.fstat(file.fileno())
+        if (path_stat.st_dev, path_stat.st_ino) != (file_stat.st_dev, file_stat.st_ino):
+            try:
+                new_file = self._open()
+            except FileNotFoundError:
+                return file
+            file.close()
+            self._position = 0
+            return new_file
+
+        if file_stat.st_size < self._position:
+            self._position = 0
+            file.seek(0)
+
+        return file
+
     def _tail_forever(self):
         """Wait for new lines to be appended to the file."""
-        with open(self.file_path, encoding=self.encoding, errors='backslashreplace') as f:
+        watcher = None
+        if self.use_inotify:
+            try:
+                watcher = inotify.InotifyWatcher(self.file_path)
+            except OSError as e:
+                logger.debug(f'Could not watch {self.file_path} using inotify, falling back to polling: {e}')
+
+        f = self._open()
+        try:
             f.seek(self._position)
             while not self.event.is_set():
                 line = f.readline()
-                if not line:
-                    f.seek(self._position)
-                    time.sleep(self.time_step)
-                else:
+                if line:
                     self.add_item(line)
-                self._position = f.tell()
+                    self._position = f.tell()
+                    continue
+
+                f.seek(self._position)
+                current_file = self._check_file(f)
+                if current_file is not f:
+                    f = current_file
+                    if watcher:
+                        watcher.watch_file()
+                    continue
+
+                if watcher:
+                    watcher.wait(self.time_step)
+                else:
+                    time.sleep(self.time_step)
+        finally:
+            f.close()
+            if watcher:
+                watcher.close()
+
+
+def _required_literals(parsed_pattern, ignore_case=False):
+    """Get the literal strings that any string matched by a parsed regular expression must contain.
+
+    Only the top level sequence of the pattern and its groups are inspected, so alternatives, repetitions and
+    optional parts are ignored.
+
+    Args:
+        parsed_pattern (list): Parsed pattern or subpattern, as generated by `sre_parse.parse`.
+        ignore_case (bool): Whether the pattern is case-insensitive. Case-insensitive literals are ignored.
+
+    Returns:
+        list(list(int)): Code points of every literal found.
+    """
+    literals = []
+    current = []
+    for op, value in parsed_pattern:
+        if op == sre_constants.LITERAL and not ignore_case:
+            current.append(value)
+            continue
+        if current:
+            literals.append(current)
+            current = []
+        if op == sre_constants.SUBPATTERN:
+            add_flags, subpattern = value[1], value[-1]
+            literals.extend(_required_literals(subpattern, ignore_case or bool(add_flags & re.IGNORECASE)))
+    if current:
+        literals.append(current)
+
+    return literals
+
+
+class PrefilteredPattern:
+    """Compiled regular expression that discards the non-matching lines without running the whole regex.
+
+    The `match` method returns exactly what `re.match` would return, but lines that do not contain the longest literal
+    required by the pattern are rejected with a substring check. Besides, patterns starting with `.*` are first
+    searched without that prefix, which avoids backtracking through the whole line when it does not match.
+
+    Args:
+        pattern (str or bytes): Regular expression.
+        flags (int): Optional - Flags used to compile the expression.
+
+    Attributes:
+        regex (re.Pattern): Compiled regular expression.
+        literal (str or bytes): Substring that every matching line contains. `None` if there is no such substring.
+    """
+
+    def __init__(self, pattern, flags=0):
+        self.regex = re.compile(pattern, flags)
+        self.literal = None
+        self._search_regex = None
+
+        try:
+            parsed = list(sre_parse.parse(pattern, flags))
+        except Exception:
+            # The pattern is valid, so it can only fail if the private parser API has changed
+            return
+
+        literals = _required_literals(parsed, ignore_case=bool(self.regex.flags & re.IGNORECASE))
+        if literals:
+            longest = max(literals, key=len)
+            self.literal = bytes(longest) if isinstance(pattern, bytes) else ''.join(map(chr, longest))
+
+        # '.*' at the beginning is parsed as a greedy repetition of any character
+        if (len(parsed) > 1 and parsed[0][0] == sre_constants.MAX_REPEAT and parsed[0][1][0] == 0 and
+                list(parsed[0][1][2]) == [(sre_constants.ANY, None)] and pattern[:2] in ('.*', b'.*')):
+            try:
+                self._search_regex = re.compile(pattern[2:], flags)
+            except re.error:
+                pass
+
+    @property
+    def pattern(self):
+        return self.regex.pattern
+
+    def match(self, line):
+        """Match the pattern at the beginning of the line.
+
+        Args:
+            line (str or bytes): Line to check.
+
+        Returns:
+            re.Match: Same result as `re.match(pattern, line)`.
+        """
+        if self.literal is not None and self.literal not in line:
+            return None
+        if self._search_regex is not None and self._search_regex.search(line) is None:
+            return None
+
+        return self.regex.match(line)
+
+
+@lru_cache(maxsize=1024)
+def _get_prefiltered_pattern(pattern, flags):
+    return PrefilteredPattern(pattern, flags)
+
+
+def match_pattern(pattern, line, flags=0):
+    """Drop-in replacement of `re.match` for callbacks, using a cached `PrefilteredPattern`.
+
+    Args:
+        pattern (str or bytes): Regular expression.
+        line (str or bytes): Line to check.
+        flags (int): Optional - Flags used to compile the expression.
+
+    Returns:
+        re.Match: Same result as `re.match(pattern, line, flags)`.
+    """
+    return _get_prefiltered_pattern(pattern, flags).match(line)
+
+
+class PatternMatcher:
+    """Match every line against several patterns at once and route each hit to the callback of its pattern.
+
+    All the required literals of the registered patterns are merged into a single alternation, so a line that does
+    not contain any of them is discarded with one scan, whatever the number of patterns.
+
+    Args:
+        prefix (str): Optional - Prefix prepended to every registered pattern.
+    """
+
+    def __init__(self, prefix=None):
+        self.prefix = prefix
+        self._patterns = {}
+        self._literal_filter = None
+        self._unfiltered = []
+
+    def __len__(self):
+        return len(self._patterns)
+
+    @property
+    def names(self):
+        """list(str): Names of the registered patterns."""
+        return list(self._patterns)
+
+    def add(self, pattern, callback=None, name=None):
+        """Register a new pattern.
+
+        Args:
+            pattern (str): Regular expression to match.
+            callback (callable): Optional - Function called with the line and its `re.Match` when the pattern matches.
+                Its result is reported as the result of the hit unless it is `None`. By default, the first group of
+                the match is reported if it exists, or `True` otherwise.
+            name (str): Optional - Name of the pattern. The pattern itself is used by default.
+
+        Returns:
+            str: Name of the registered pattern.
+        """
+        full_pattern = pattern if self.prefix is None else fr'{self.prefix}{pattern}'
+        name = pattern if name is None else name
+        self._patterns[name] = (PrefilteredPattern(full_pattern), callback)
+        self._build_filter()
+
+        return name
+
+    def remove(self, name):
+        """Unregister a pattern.
+
+        Args:
+            name (str): Name of the pattern.
+        """
+        del self._patterns[name]
+        self._build_filter()
+
+    def _build_filter(self):
+        literals = {compiled.literal for compiled, _ in self._patterns.values() if compiled.literal is not None}
+        self._unfiltered = [name for name, (compiled, _) in self._patterns.items() if compiled.literal is None]
+        self._literal_filter = re.compile('|'.join(map(re.escape, sorted(literals, key=len, reverse=True)))) \
+            if literals else None
+
+    @staticmethod
+    def _default_callback(line, match):
+        return match.group(1) if match.re.groups and match.group(1) is not None else True
+
+    def match(self, line, names=None):
+        """Check a line against the registered patterns.
+
+        Args:
+            line (str or bytes): Line to check.
+            names (set): Optional - Names of the patterns to check. All of them by default.
+
+        Returns:
+            list(tuple(str, any)): Name and result of every pattern matching the line.
+        """
+        line = line.decode() if isinstance(line, bytes) else line
+        if self._literal_filter is not None and self._literal_filter.search(line) is not None:
+            candidates = self._patterns.keys()
+        else:
+            candidates = self._unfiltered
+
+        hits = []
+        for name in candidates:
+            if names is not None and name not in names:
+                continue
+            compiled, callback = self._patterns[name]
+            match = compiled.match(line)
+            if match is None:
+                continue
+            result = (callback or self._default_callback)(line, match)
+            if result is not None:
+                hits.append((name, result))
+
+        return hits
+
+    def __call__(self, line):
+        """Use the matcher as a monitoring callback.
+
+        Returns:
+            dict: Results of the matching patterns by name, or `None` if no pattern matches.
+        """
+        hits = self.match(line)
+        return dict(hits) if hits else None
 
 
 def make_callback(pattern, prefix="wazuh", escape=False):
@@ -176,20 +470,154 @@ def make_callback(pattern, prefix="wazuh", escape=False):
         pattern = r'\s+'.join(pattern.split())
 
     full_pattern = pattern if prefix is None else fr'{prefix}{pattern}'
-    regex = re.compile(full_pattern)
+    regex = PrefilteredPattern(full_pattern)
 
     return lambda line: regex.match(line.decode() if isinstance(line, bytes) else line) is not None
 
 
+class SharedFileTailer(FileTailer):
+    """FileTailer whose lines are read once and broadcast to any number of subscribers.
+
+    There is a single instance per file and encoding, obtained through `get`. The read lines are kept in a ring buffer
+    of `buffer_size` lines and every subscriber reads them through its own cursor, so subscribers do not consume
+    lines from each other. A warning is logged if a subscriber falls so far behind that unread lines are dropped.
+    A new subscriber starts reading from the next line appended to the file, unless it asks for the whole current
+    file. The tailers run until `shutdown_all` is called.
+
+    Args:
+        file_path (str): Path of the file to tail.
+        encoding (str): Optional - Encoding of the file.
+        time_step (float): Optional - Polling interval. It also bounds the time it takes to shutdown the tailer.
+        use_inotify (bool): Optional - Wait for inotify events instead of polling whenever it is possible.
+        buffer_size (int): Optional - Maximum number of lines kept for the subscribers.
+    """
+    _tailers = {}
+    _tailers_lock = threading.Lock()
+
+    def __init__(self, file_path, encoding=None, time_step=0.5, use_inotify=True,
+                 buffer_size=DEFAULT_SHARED_BUFFER_SIZE):
+        super().__init__(file_path, encoding=encoding, time_step=time_step, use_inotify=use_inotify)
+        self._queue = RingQueue(buffer_size)
+        self._lock = threading.Lock()
+        self._file_id = None
+        self._generation_index = 0
+
+    def __copy__(self):
+        raise TypeError('SharedFileTailer instances cannot be copied, use subscribe instead')
+
+    @classmethod
+    def get(cls, file_path, encoding=None, time_step=0.5, use_inotify=True):
+        """Get the running shared tailer of a file, starting it if needed.
+
+        Args:
+            file_path (str): Path of the file to tail.
+            encoding (str): Optional - Encoding of the file.
+            time_step (float): Optional - Polling interval, only used if the tailer is created.
+            use_inotify (bool): Optional - Use inotify if possible, only used if the tailer is created.
+
+        Returns:
+            SharedFileTailer: Running tailer of the file.
+        """
+        key = (os.path.abspath(file_path), encoding)
+        with cls._tailers_lock:
+            tailer = cls._tailers.get(key)
+            if tailer is None or not tailer.thread.is_alive():
+                tailer = cls(file_path, time_step=time_step, use_inotify=use_inotify)
+                if encoding is not None:
+                    tailer.encoding = encoding
+                tailer.start()
+                cls._tailers[key] = tailer
+        return tailer
+
+    @classmethod
+    def shutdown_all(cls):
+        """Stop every running shared tailer."""
+        with cls._tailers_lock:
+            tailers = list(cls._tailers.values())
+            cls._tailers.clear()
+        for tailer in tailers:
+            tailer.shutdown()
+
+    def run(self):
+        self.event = threading.Event()
+        # Shared tailers outlive the monitors using them, so they must not keep the interpreter alive
+        self.thread = threading.Thread(target=self._tail_forever, daemon=True)
+        self.thread.start()
+
+    def subscribe(self, from_start=False):
+        """Create a cursor to read the lines of the file.
+
+        Args:
+            from_start (bool): Optional - Read the lines of the current file already read by the tailer too, that is,
+                since its last truncation or rotation. If the file has been truncated, rotated or removed and the
+                tailer has not noticed it yet, the cursor starts at the next line read.
+
+        Returns:
+            QueueCursor: Cursor pointing to the first line to read.
+        """
+        if not from_start:
+            return QueueCursor(self._queue, self._queue.end_index())
+
+        with self._lock:
+            index = self._generation_index
+            try:
+                path_stat = os.stat(self.file_path)
+            except FileNotFoundError:
+                # The lines read belong to a file that no longer exists
+                index = self._queue.end_index()
+            else:
+                # The file has been truncated or rotated but the tailer has not noticed it yet
+                if self._file_id is not None and ((path_stat.st_dev, path_stat.st_ino) != self._file_id or
+                                                  path_stat.st_size < self._position):
+                    index = self._queue.end_index()
+
+        return QueueCursor(self._queue, index)
+
+    def _open(self):
+        file = super()._open()
+        file_stat = os.fstat(file.fileno())
+        self._file_id = (file_stat.st_dev, file_stat.st_ino)
+        return file
+
+    def _check_file(self, file):
+        position = self._position
+        current_file = super()._check_file(file)
+        if current_file is not file or self._position < position:
+            with self._lock:
+                self._generation_index = self._queue.end_index()
+
+        return current_file
+
+
 class FileMonitor:
-    def __init__(self, file_path, time_step=0.5):
-        self.tailer = FileTailer(file_path, time_step=time_step)
+    def __init__(self, file_path, time_step=0.5, use_inotify=True, shared=False):
+        """Monitor the lines of a file.
+
+        Args:
+            file_path (str): Path of the file to monitor.
+            time_step (float, optional): Polling interval of the tailer. Default `0.5`
+            use_inotify (bool, optional): Wait for inotify events instead of polling whenever it is possible.
+                Default `True`
+            shared (bool, optional): Read the file through the `SharedFileTailer` of the file instead of a tailer
+                owned by this monitor. As with an own tailer, the file is read from its beginning, that is, since the
+                last truncation or rotation noticed by the shared tailer. Default `False`
+        """
+        self.file_path = file_path
+        self.shared = shared
+        self.tailer = None if shared else FileTailer(file_path, time_step=time_step, use_inotify=use_inotify)
         self._result = None
         self._time_step = time_step
+        self._use_inotify = use_inotify
+        self._shared_tailer = None
+        self._cursor = None
 
     def start(self, timeout=-1, callback=_callback_default, accum_results=1, update_position=True, timeout_extra=0,
               error_message='', encoding=None):
         """Start the file monitoring until the stop method is called."""
+        if self.shared:
+            return self._start_shared(timeout=timeout, callback=callback, accum_results=accum_results,
+                                      update_position=update_position, timeout_extra=timeout_extra,
+                                      error_message=error_message, encoding=encoding)
         try:
             tailer = self.tailer if update_position else copy(self.tailer)
 
@@ -197,7 +625,7 @@ class FileMonitor:
                 tailer.encoding = encoding
             tailer.start()
 
-            monitor = QueueMonitor(tailer.queue, time_step=self._time_step)
+            monitor = QueueMonitor(tailer.queue)
             self._result = monitor.start(timeout=timeout, callback=callback, accum_results=accum_results,
                                          update_position=True, timeout_extra=timeout_extra,
                                          error_message=error_message).result()
@@ -206,6 +634,23 @@ class FileMonitor:
 
         return self
 
+    def _start_shared(self, timeout, callback, accum_results, update_position, timeout_extra, error_message,
+                      encoding):
+        """Monitor the file reading the lines of its shared tailer."""
+        tailer = SharedFileTailer.get(self.file_path, encoding=encoding, time_step=self._time_step,
+                                      use_inotify=self._use_inotify)
+        if tailer is not self._shared_tailer:
+            self._shared_tailer = tailer
+            self._cursor = tailer.subscribe(from_start=True)
+
+        cursor = self._cursor if update_position else self._cursor.cursor()
+        monitor = QueueMonitor(cursor)
+        self._result = monitor.start(timeout=timeout, callback=callback, accum_results=accum_results,
+                                     update_position=True, timeout_extra=timeout_extra,
+                                     error_message=error_message).result()
+
+        return self
+
     def result(self):
         return self._result
 
@@ -315,6 +760,59 @@ class SocketController:
 
         return output
 
+    def send_many(self, messages, size=False):
+        """Send several messages to the socket at once.
+
+        In TCP sockets all the messages are joined in a single buffer and written with one `sendall` call. In UDP
+        sockets each message is sent in its own datagram.
+
+        Args:
+            messages (list(str or bytes)): Messages to be sent.
+            size (bool, optional) : Flag that indicates if the header of the messages includes their size. Default
+                `False`
+        Returns:
+            (int) : Number of messages sent
+        """
+        msgs_bytes = [message.encode() if isinstance(message, str) else message for message in messages]
+        if self.protocol == socket.SOCK_STREAM:  # TCP
+            if size:
+                msgs_bytes = [part for msg_bytes in msgs_bytes for part in (wazuh_pack(len(msg_bytes)), msg_bytes)]
+            self.sock.sendall(b''.join(msgs_bytes))
+        else:  # UDP
+            for msg_bytes in msgs_bytes:
+                self.sock.sendto(wazuh_pack(len(msg_bytes)) + msg_bytes if size else msg_bytes, self.address)
+
+        return len(messages)
+
+    def request_many(self, messages, size=True, window=128):
+        """Send several messages and receive their replies, pipelining the requests.
+
+        Messages are written in batches of `window` messages, and the replies of each batch are read in order before
+        sending the next one, so the peer never blocks on a full socket buffer.
+
+        Args:
+            messages (list(str or bytes)): Messages to be sent.
+            size (bool, optional): Flag that indicates if the header of the messages and replies includes their size.
+                It is required to split the replies of a TCP stream. Default `True`
+            window (int, optional): Maximum number of messages sent before reading their replies. Default `128`
+
+        Returns:
+            list(bytes): Replies of the messages, in the same order.
+
+        Raises:
+            ValueError: If the socket is TCP and the messages are not framed with their size.
+        """
+        if self.protocol == socket.SOCK_STREAM and not size:
+            raise ValueError('The replies of a TCP stream cannot be split without size framing, use size=True')
+
+        replies = []
+        for start in range(0, len(messages), window):
+            batch = messages[start:start + window]
+            self.send_many(batch, size=size)
+            replies.extend(self.receive(size=size) for _ in batch)
+
+        return replies
+
     def receive(self, size=False):
         """Receive a message from the socket.
 
@@ -325,20 +823,9 @@ class SocketController:
             bytes: Socket message.
         """
         if size:
-            data = self.sock.recv(4, socket.MSG_WAITALL)
-            if not data:
-                output = bytes('', 'utf8')
-                return output
-            size = wazuh_unpack(data)
-            output = self.sock.recv(size, socket.MSG_WAITALL)
+            output = bytes(recv_frame(self.sock, socket.MSG_WAITALL))
         else:
-            output = self.sock.recv(4096)
-            if len(output) == 4096:
-                while 1:
-                    try:  # error means no more data
-                        output += self.sock.recv(4096, socket.MSG_DONTWAIT)
-                    except Exception:
-                        break
+            output = bytes(recv_available(self.sock, 4096))
 
         return output
 
@@ -381,18 +868,27 @@ def close_sockets(receiver_sockets):
 
 
 class QueueMonitor:
-    def __init__(self, queue_item, time_step=0.5):
+    # Maximum time each read waits for a new item before checking the deadlines again
+    wait_slice = 0.5
+
+    def __init__(self, queue_item, time_step=None):
         """Create a new instance to monitor any given queue.
 
+        Items are processed as soon as they are available. Each read waits at most `wait_slice` seconds, so the
+        deadlines are checked regularly even if no item arrives.
+
         Args:
             queue_item (queue): Queue to monitor
-            time_step (float,optional) : Fraction of time to wait in every get. Default `0.5`
+            time_step (float,optional) : Deprecated, it overrides `wait_slice` for this instance. Default `None`
         """
         self._queue = queue_item
         self._continue = False
         self._abort = False
         self._result = None
-        self._time_step = time_step
+        if time_step is not None:
+            warnings.warn("QueueMonitor 'time_step' is deprecated, set the 'wait_slice' class attribute instead",
+                          DeprecationWarning, stacklevel=2)
+            self.wait_slice = time_step
 
     def get_results(self, callback=_callback_default, accum_results=1, timeout=-1, update_position=True,
                     timeout_extra=0):
@@ -412,38 +908,32 @@ class QueueMonitor:
                 If `accum_results > 1`, it will be a list.
         """
         result_list = []
-        timer = 0.0
-        time_wait = 0.1
-        position = 0
-        extra_timer_is_running = False
-        extra_timer = 0.0
-        while len(result_list) != accum_results or extra_timer_is_running:
-            if timer >= timeout and not extra_timer_is_running:
-                self.abort()
-                break
-            if extra_timer >= timeout_extra > 0:
-                self.stop()
-                break
-            tic = time.time()
+        source = self._queue if update_position else self._queue.cursor()
+        deadline = time.monotonic() + timeout
+        extra_deadline = None
+        while len(result_list) != accum_results or extra_deadline is not None:
+            # Items are awaited on the queue condition, so the loop wakes up as soon as one is available, but never
+            # longer than a wait slice
+            if extra_deadline is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.abort()
+                    break
+            else:
+                remaining = extra_deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stop()
+                    break
             try:
-                if update_position:
-                    msg = self._queue.get(block=True, timeout=self._time_step)
-                else:
-                    msg = self._queue.peek(position=position, block=True, timeout=self._time_step)
-                    position += 1
-                item = callback(msg)
-                logging.debug(msg)
-                if item is not None and item:
-                    result_list.append(item)
-                    if len(result_list) == accum_results and timeout_extra > 0 and not extra_timer_is_running:
-                        extra_timer_is_running = True
+                msg = source.get(block=True, timeout=min(remaining, self.wait_slice))
             except queue.Empty:
-                pass
-            finally:
-                time_count = time.time() - tic
-                timer += time_count
-                if extra_timer_is_running:
-                    extra_timer += time_count
+                continue
+            item = callback(msg)
+            logging.debug(msg)
+            if item is not None and item:
+                result_list.append(item)
+                if len(result_list) == accum_results and timeout_extra > 0 and extra_deadline is None:
+                    extra_deadline = time.monotonic() + timeout_extra
 
         if len(result_list) == 1:
             return result_list[0]
@@ -476,6 +966,45 @@ class QueueMonitor:
 
         return self
 
+    def start_matcher(self, matcher, timeout=-1, update_position=True, error_message=''):
+        """Monitor the queue until every pattern of a `PatternMatcher` has matched at least once.
+
+        Every item is checked only against the patterns that have not matched yet, in a single pass.
+
+        Args:
+            matcher (PatternMatcher): Patterns to wait for.
+            timeout (int, optional): Maximum timeout. Default `-1`
+            update_position (bool, optional) : True if we pop items from the queue once they are read. False otherwise.
+                Default `True`
+            error_message (str, optional): Message to log if the timeout expires. Default `''`
+
+        Raises:
+            TimeoutError: If any pattern has not matched before the timeout expires.
+
+        Returns:
+            dict: First result of every pattern, by pattern name.
+        """
+        pending = set(matcher.names)
+        results = {}
+        source = self._queue if update_position else self._queue.cursor()
+        deadline = time.monotonic() + timeout
+        while pending:
+            if time.monotonic() >= deadline:
+                if error_message:
+                    logger.error(error_message)
+                    logger.error(f"Patterns not found: {sorted(pending)}")
+                raise TimeoutError(error_message)
+            try:
+                msg = source.get(block=True, timeout=min(max(deadline - time.monotonic(), 0), self.wait_slice))
+            except queue.Empty:
+                continue
+            for name, result in matcher.match(msg, names=pending):
+                results[name] = result
+                pending.discard(name)
+
+        self._result = results
+        return results
+
     def stop(self):
         """Stop the queue monitoring. It can be restart calling the start method."""
         self._continue = False
@@ -496,6 +1025,84 @@ class QueueMonitor:
 
 
 class Queue(queue.Queue):
+    """Queue that allows reading its items without consuming them.
+
+    Items are stored in a list with a moving head instead of a deque, so any position can be read in constant time.
+    Consumed items are dropped from the list once they are more than half of it. Every put wakes up all the waiting
+    readers, since each cursor waits for its own item.
+    """
+    compaction_threshold = 1024
+
+    def _init(self, maxsize):
+        self._items = []
+        self._head = 0
+        # Absolute index of the first element of `_items`, used to keep cursors valid after a compaction
+        self._base = 0
+
+    def _qsize(self):
+        return len(self._items) - self._head
+
+    def _put(self, item):
+        self._items.append(item)
+        # queue.Queue.put only notifies one waiter, but every cursor may be waiting for this item
+        self.not_empty.notify_all()
+
+    def _get(self):
+        item = self._items[self._head]
+        self._items[self._head] = None
+        self._head += 1
+        if self._head >= self.compaction_threshold and self._head * 2 >= len(self._items):
+            del self._items[:self._head]
+            self._base += self._head
+            self._head = 0
+        return item
+
+    @property
+    def queue(self):
+        """deque: Copy of the pending items of the queue."""
+        return deque(self._items[self._head:])
+
+    @queue.setter
+    def queue(self, items):
+        with self.mutex:
+            self._base += self._head
+            self._items = list(items)
+            self._head = 0
+
+    def _wait_for_index(self, index, block=True, timeout=None):
+        """Wait until the item with the given absolute index is in the queue and return it.
+
+        If the item has been already consumed, the first pending item is returned instead.
+
+        Args:
+            index (int): Absolute index of the item, counting every item ever put in the queue.
+            block (bool, optional): Wait for the item if it is not available yet. Default `True`
+            timeout (float, optional): Maximum time to wait for the item. Default `None`
+
+        Raises:
+            queue.Empty: If the item is not available when the timeout expires or `block` is False.
+
+        Returns:
+            tuple(int, any): Absolute index and value of the returned item.
+        """
+        with self.not_empty:
+            index = max(index, self._base + self._head)
+            if block and timeout is not None:
+                if timeout < 0:
+                    raise ValueError("'timeout' must be a non-negative number")
+                deadline = time.monotonic() + timeout
+            while index - self._base >= len(self._items):
+                if not block:
+                    raise queue.Empty
+                if timeout is None:
+                    self.not_empty.wait()
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0.0:
+                        raise queue.Empty
+                    self.not_empty.wait(remaining)
+            return index, self._items[index - self._base]
+
     def peek(self, *args, position=0, **kwargs):
         """Peek any given position without modifying the queue status.
 
@@ -507,11 +1114,39 @@ class Queue(queue.Queue):
         Returns:
             (any): Any item in the given position.
         """
-        aux_queue = queue.Queue()
-        aux_queue.queue = copy(self.queue)
-        for _ in range(position):
-            aux_queue.get(*args, **kwargs)
-        return aux_queue.get(*args, **kwargs)
+        with self.mutex:
+            index = self._base + self._head + position
+        return self._wait_for_index(index, *args, **kwargs)[1]
+
+    def _skipped(self, count):
+        """Hook called when a cursor skips items that are no longer in the queue, because they were consumed.
+
+        Args:
+            count (int): Number of skipped items.
+        """
+        pass
+
+    def end_index(self):
+        """Return the absolute index that the next item put in the queue will have.
+
+        Returns:
+            int: Absolute index of the next item.
+        """
+        with self.mutex:
+            return self._base + len(self._items)
+
+    def cursor(self, position=0):
+        """Create a cursor to read the queue items sequentially without consuming them.
+
+        Args:
+            position (int, optional): Position of the first item to read, relative to the head of the queue.
+                Default `0`
+
+        Returns:
+            QueueCursor: New cursor over this queue.
+        """
+        with self.mutex:
+            return QueueCursor(self, self._base + self._head + position)
 
     def __repr__(self):
         """Returns the object representation in string format.
@@ -523,6 +1158,85 @@ class Queue(queue.Queue):
         return str(self.queue)
 
 
+class RingQueue(Queue):
+    """Queue that keeps only its last `capacity` items, dropping the oldest ones when it is full.
+
+    Args:
+        capacity (int): Maximum number of items kept in the queue.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        super().__init__()
+
+    def _put(self, item):
+        super()._put(item)
+        if self._qsize() > self.capacity:
+            self._get()
+
+    def _skipped(self, count):
+        logger.warning(f"{count} items were dropped from a ring queue of {self.capacity} items before a cursor read "
+                       f"them")
+
+
+class QueueCursor:
+    """Non-destructive reader of a `Queue`.
+
+    Each cursor keeps its own position, so several readers can go through the same items independently and in
+    constant time per item. Items consumed from the queue with `get` while the cursor has not reached them are skipped.
+
+    Args:
+        queue_item (Queue): Queue to read.
+        index (int): Absolute index of the first item to read.
+    """
+
+    def __init__(self, queue_item, index):
+        self._queue = queue_item
+        self._index = index
+
+    @property
+    def position(self):
+        """int: Position of the next item to read, relative to the head of the queue."""
+        with self._queue.mutex:
+            return self._index - self._queue._base - self._queue._head
+
+    def cursor(self):
+        """Create a new cursor starting at the current position of this one.
+
+        Returns:
+            QueueCursor: Independent copy of the cursor.
+        """
+        return QueueCursor(self._queue, self._index)
+
+    def get(self, block=True, timeout=None):
+        """Return the next item and move the cursor forward.
+
+        Args:
+            block (bool, optional): Wait for the item if it is not available yet. Default `True`
+            timeout (float, optional): Maximum time to wait for the item. Default `None`
+
+        Raises:
+            queue.Empty: If there is no new item when the timeout expires or `block` is False.
+
+        Returns:
+            (any): Next item of the queue.
+        """
+        index, item = self._queue._wait_for_index(self._index, block=block, timeout=timeout)
+        if index > self._index:
+            self._queue._skipped(index - self._index)
+        self._index = index + 1
+        return item
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return self.get(block=False)
+        except queue.Empty:
+            raise StopIteration
+
+
 class StreamServerPort(socketserver.ThreadingTCPServer):
     pass
 
@@ -647,35 +1361,17 @@ class StreamHandler(socketserver.BaseRequestHandler):
             forwarded_sock.sendall(wazuh_pack(len(data)) + data)
 
             # Receive data from the server and shut down
-            size = wazuh_unpack(self.recvall_size(forwarded_sock, 4, socket.MSG_WAITALL))
-            response = self.recvall_size(forwarded_sock, size, socket.MSG_WAITALL)
+            response = bytes(recv_frame(forwarded_sock, socket.MSG_WAITALL, stop_event=self.server.mitm.event))
 
             return response
 
     def recvall_size(self, sock: socket.socket, size: int, mask: int):
         """Recvall with known size of the message."""
-        buffer = bytearray()
-        while len(buffer) < size:
-            try:
-                data = sock.recv(size - len(buffer), mask)
-                if not data:
-                    break
-                buffer.extend(data)
-            except socket.timeout:
-                if self.server.mitm.event.is_set():
-                    break
-        return bytes(buffer)
+        return bytes(recv_exact(sock, size, mask, stop_event=self.server.mitm.event))
 
     def recvall(self, chunk_size: int = 4096):
         """Recvall without known size of the message."""
-        received = self.request.recv(chunk_size)
-        if len(received) == chunk_size:
-            while 1:
-                try:  # error means no more data
-                    received += self.request.recv(chunk_size, socket.MSG_DONTWAIT)
-                except Exception:
-                    break
-        return received
+        return bytes(recv_available(self.request, chunk_size))
 
     def default_wazuh_handler(self):
         """Default wazuh daemons TCP handler method for MITM server."""
@@ -863,8 +1559,10 @@ def generate_monitoring_callback(regex):
     Args:
         regex (str): regex to use to look for a match.
     """
+    pattern = PrefilteredPattern(regex)
+
     def new_callback(line):
-        match = re.match(regex, line)
+        match = pattern.match(line)
         if match:
             if match.group(1) is not None:
                 return match.group(1)
@@ -883,8 +1581,10 @@ class HostMonitor:
     In contrast, if one or more of the goals is not covered, a timeout exception will be raised with a generic or a
     custom error message.
     """
+    # Consecutive failed incremental reads of a file before downloading the whole file in every poll instead
+    max_incremental_failures = 10
 
-    def __init__(self, inventory_path, messages_path, tmp_path, time_step=0.5):
+    def __init__(self, inventory_path, messages_path, tmp_path, time_step=0.5, mode='thread'):
         """Create a new instance to monitor any given file in any specified host.
 
         Args:
@@ -892,9 +1592,16 @@ class HostMonitor:
             messages_path (str):  Path to the file where the callbacks, paths and hosts to be monitored are specified.
             tmp_path (str): Path to the temporal files.
             time_step (float, optional): Fraction of time to wait in every get. Defaults to `0.5`
+            mode (str, optional): Either 'thread' or 'process'. In 'thread' mode, file composers and monitors run as
+                threads sharing the inventory, the Ansible connections and a plain queue for the results. In 'process'
+                mode, each of them runs in a new process and the results are sent through a `Manager` queue.
+                Defaults to `'thread'`
         """
+        if mode not in ('thread', 'process'):
+            raise TypeError(f'Invalid mode detected: {mode}. Valid ones are thread or process')
         self.host_manager = HostManager(inventory_path=inventory_path)
-        self._queue = Manager().Queue()
+        self._mode = mode
+        self._queue = queue.Queue() if mode == 'thread' else Manager().Queue()
         self._result = defaultdict(list)
         self._time_step = time_step
         self._file_monitors = list()
@@ -907,44 +1614,63 @@ class HostMonitor:
         with open(messages_path, 'r') as f:
             self.test_cases = yaml.safe_load(f)
 
+    def _launch(self, target, **kwargs):
+        """Run a function in a new thread or process, depending on the mode of the monitor.
+
+        Args:
+            target (callable): Function to run.
+            kwargs (dict): Keyword arguments of the function.
+
+        Returns:
+            threading.Thread or multiprocessing.Process: Started handler.
+        """
+        if self._mode == 'process':
+            handler = Process(target=target, kwargs=kwargs)
+        else:
+            handler = threading.Thread(target=target, kwargs=kwargs, daemon=True)
+        handler.start()
+
+        return handler
+
     def run(self, update_position=False):
-        """This method creates and destroy the needed processes for the messages founded in messages_path.
-        It creates one file composer (process) for every file to be monitored in every host."""
+        """This method creates and destroy the needed threads or processes for the messages founded in messages_path.
+        It creates one file composer for every file to be monitored in every host."""
+        stop_event = Event() if self._mode == 'process' else threading.Event()
         for host, payload in self.test_cases.items():
             monitored_files = {case['path'] for case in payload}
             if len(monitored_files) == 0:
                 raise AttributeError('There is no path to monitor. Exiting...')
             for path in monitored_files:
                 output_path = f'{host}_{path.split("/")[-1]}.tmp'
-                self._file_content_collectors.append(self.file_composer(host=host, path=path, output_path=output_path))
-                logger.debug(f'Add new file composer process for {host} and path: {path}')
-                self._file_monitors.append(self._start(host=host,
-                                                       payload=[block for block in payload if block["path"] == path],
-                                                       path=output_path))
-                logger.debug(f'Add new file monitor process for {host} and path: {path}')
-
-        while True:
-            if not any([handler.is_alive() for handler in self._file_monitors]):
-                for handler in self._file_monitors:
-                    handler.join()
-                for file_collector in self._file_content_collectors:
-                    file_collector.terminate()
-                    file_collector.join()
-                self.clean_tmp_files()
-                break
-            time.sleep(self._time_step)
+                self._file_content_collectors.append(self._launch(self.file_composer, host=host, path=path,
+                                                                  output_path=output_path, stop_event=stop_event))
+                logger.debug(f'Add new file composer {self._mode} for {host} and path: {path}')
+                self._file_monitors.append(self._launch(self._start, host=host,
+                                                        payload=[block for block in payload if block["path"] == path],
+                                                        path=output_path))
+                logger.debug(f'Add new file monitor {self._mode} for {host} and path: {path}')
+
+        for handler in self._file_monitors:
+            handler.join()
+        stop_event.set()
+        for file_collector in self._file_content_collectors:
+            if self._mode == 'process':
+                file_collector.terminate()
+            file_collector.join()
+        self.clean_tmp_files()
         self.check_result()
         return self.result()
 
-    @new_process
-    def file_composer(self, host, path, output_path):
+    def file_composer(self, host, path, output_path, stop_event=None):
         """Collects the file content of the specified path in the desired host and append it to the output_path file.
-        Simulates the behavior of tail -f and redirect the output to output_path.
+        Simulates the behavior of tail -f and redirect the output to output_path. Only the bytes appended since the
+        previous poll are fetched from the host.
 
         Args:
             host (str): Hostname.
             path (str): Host file path to be collect.
             output_path (str): Output path of the content collected from the remote host path.
+            stop_event (Event, optional): Event that stops the composer when it is set. Default `None`
         """
         try:
             truncate_file(os.path.join(self._tmp_path, output_path))
@@ -953,22 +1679,57 @@ class HostMonitor:
         logger.debug(f'Starting file composer for {host} and path: {path}. '
                      f'Composite file in {os.path.join(self._tmp_path, output_path)}')
         tmp_file = os.path.join(self._tmp_path, output_path)
-        while True:
-            with FileLock(tmp_file):
-                with open(tmp_file, "r+") as file:
-                    content = self.host_manager.get_file_content(host, path).split('\n')
-                    file_content = file.read().split('\n')
-                    for new_line in content:
-                        if new_line == '':
-                            continue
-                        if new_line not in file_content:
-                            file.write(f'{new_line}\n')
+        offset = 0
+        inode = None
+        checksum = None
+        incomplete_line = b''
+        incremental = None
+        failures = 0
+        seen_lines = set()
+        while stop_event is None or not stop_event.is_set():
+            new_lines = []
+            try:
+                if incremental is None:
+                    incremental = self.host_manager.supports_incremental_read(host)
+                    if not incremental:
+                        logger.debug(f'{host} cannot read {path} incrementally, downloading the whole file instead')
+                if incremental:
+                    content, start, inode, checksum = self.host_manager.get_file_content_from_offset(host, path,
+                                                                                                     offset, inode,
+                                                                                                     checksum)
+                    if start != offset:
+                        # The file has been truncated or rotated, the partial line is lost
+                        incomplete_line = b''
+                    offset = start + len(content)
+                    *new_lines, incomplete_line = (incomplete_line + content).split(b'\n')
+                    new_lines = [line.decode(errors='backslashreplace') for line in new_lines]
+                else:
+                    for line in self.host_manager.get_file_content(host, path).split('\n'):
+                        if line not in seen_lines:
+                            seen_lines.add(line)
+                            new_lines.append(line)
+                failures = 0
+            except Exception as e:
+                # The file may be missing or being rotated, or the host unreachable. Try again in the next poll
+                failures += 1
+                logger.debug(f'Could not read {path} from {host}, retrying: {e}')
+                if incremental and failures >= self.max_incremental_failures:
+                    logger.debug(f'{path} could not be read incrementally from {host} {failures} times in a row, '
+                                 f'downloading the whole file instead')
+                    incremental = False
+
+            with open(tmp_file, 'a') as file:
+                file.writelines(f'{line}\n' for line in new_lines if line != '')
+            if stop_event is None:
                 time.sleep(self._time_step)
+            else:
+                stop_event.wait(self._time_step)
 
-    @new_process
     def _start(self, host, payload, path, encoding=None, error_messages_per_host=None, update_position=False):
         """Start the file monitoring until the QueueMonitor returns an string or TimeoutError.
 
+        The composed file is read through its `SharedFileTailer`, from its beginning.
+
         Args:
             host (str): Hostname
             payload (list,dict): Contains the message to be found and the timeout for it.
@@ -978,28 +1739,23 @@ class HostMonitor:
         Returns:
             Instance of HostMonitor
         """
-        tailer = FileTailer(os.path.join(self._tmp_path, path), time_step=self._time_step)
-        try:
-            if encoding is not None:
-                tailer.encoding = encoding
-            tailer.start()
-            for case in payload:
-                logger.debug(f'Starting QueueMonitor for {host} and message: {case["regex"]}')
-                monitor = QueueMonitor(tailer.queue, time_step=self._time_step)
+        tailer = SharedFileTailer.get(os.path.join(self._tmp_path, path), encoding=encoding, time_step=self._time_step)
+        cursor = tailer.subscribe(from_start=True)
+        for case in payload:
+            logger.debug(f'Starting QueueMonitor for {host} and message: {case["regex"]}')
+            monitor = QueueMonitor(cursor)
+            try:
+                self._queue.put({host: monitor.start(timeout=case['timeout'],
+                                                     callback=make_callback(pattern=case['regex'], prefix='.*'),
+                                                     update_position=False
+                                                     ).result()})
+            except TimeoutError:
                 try:
-                    self._queue.put({host: monitor.start(timeout=case['timeout'],
-                                                         callback=make_callback(pattern=case['regex'], prefix='.*'),
-                                                         update_position=False
-                                                         ).result()})
-                except TimeoutError:
-                    try:
-                        self._queue.put({host: error_messages_per_host[host]})
-                    except (KeyError, TypeError):
-                        self._queue.put({
-                            host: TimeoutError(f'Did not found the expected callback in {host}: {case["regex"]}')})
-                logger.debug(f'Finishing QueueMonitor for {host} and message: {case["regex"]}')
-        finally:
-            tailer.shutdown()
+                    self._queue.put({host: error_messages_per_host[host]})
+                except (KeyError, TypeError):
+                    self._queue.put({
+                        host: TimeoutError(f'Did not found the expected callback in {host}: {case["regex"]}')})
+            logger.debug(f'Finishing QueueMonitor for {host} and message: {case["regex"]}')
 
         return self
 
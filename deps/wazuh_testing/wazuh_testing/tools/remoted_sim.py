@@ -5,19 +5,24 @@
 import base64
 import hashlib
 import json
+import mmap
 import os
+import selectors
 import socket
 import struct
+import tempfile
 import threading
 import time
 import zlib
+from collections import deque
 from struct import pack
 from wazuh_testing import logger
 
 from Crypto.Cipher import AES, Blowfish
 from Crypto.Util.Padding import pad
 from wazuh_testing.tools import WAZUH_PATH
-from wazuh_testing.tools.monitoring import Queue
+from wazuh_testing.tools.client_keys import ClientKeysStore
+from wazuh_testing.tools.monitoring import Queue, RingQueue
 
 
 class Cipher:
@@ -52,9 +57,308 @@ class Cipher:
         return cipher.decrypt(self.data)
 
 
+class CipherContext:
+    """Reusable and pre-keyed version of `Cipher`, to encrypt/decrypt many messages with the same key.
+
+    The AES/Blowfish key schedule is computed only once. The CBC objects keep chaining between calls, so the first
+    block of every message is corrected with the last block of the previous one. That way, each message is
+    encrypted/decrypted as if it were the first one, using the fixed IV of the secure message format.
+
+    Args:
+        key (bytes): Encryption key.
+        method (str): Encryption method. It can be [aes, blowfish].
+
+    Attributes:
+        key (bytes): Encryption key.
+        method (str): Encryption method.
+        block_size (int): Block size of the cipher.
+
+    Raises:
+        ValueError: If the encryption method is not supported.
+    """
+    aes_iv = b'FEDCBA0987654321'
+    blowfish_iv = b'\xfe\xdc\xba\x98\x76\x54\x32\x10'
+
+    def __init__(self, key, method='aes'):
+        self.key = key
+        self.method = method
+        if method == 'aes':
+            self.block_size = AES.block_size
+            iv = self.aes_iv
+            self._encryptor = AES.new(key[:32], AES.MODE_CBC, iv)
+            self._decryptor = AES.new(key[:32], AES.MODE_CBC, iv)
+        elif method == 'blowfish':
+            self.block_size = Blowfish.block_size
+            iv = self.blowfish_iv
+            self._encryptor = Blowfish.new(key, Blowfish.MODE_CBC, iv)
+            self._decryptor = Blowfish.new(key, Blowfish.MODE_CBC, iv)
+        else:
+            raise ValueError(f"Unknown encryption method '{method}'")
+        self._iv = int.from_bytes(iv, 'big')
+        # XOR between the current chaining value of each CBC object and the IV
+        self._encrypt_chain = 0
+        self._decrypt_chain = 0
+        self._lock = threading.Lock()
+
+    def _correct_first_block(self, buffer, chain):
+        if chain and len(buffer) >= self.block_size:
+            first_block = int.from_bytes(buffer[:self.block_size], 'big') ^ chain
+            buffer[:self.block_size] = first_block.to_bytes(self.block_size, 'big')
+
+    def _chain_after(self, ciphertext, chain):
+        if len(ciphertext) < self.block_size:
+            return chain
+        return int.from_bytes(ciphertext[-self.block_size:], 'big') ^ self._iv
+
+    def encrypt(self, data, header=b''):
+        """Encrypt data, writing the result right after a header.
+
+        The header and the encrypted data are written in the same buffer, so no intermediate copies are made.
+        AES data is padded like in `Cipher.encrypt_aes`. Blowfish data must already be padded.
+
+        Args:
+            data (bytes): Data to encrypt.
+            header (bytes): Data to prepend unencrypted to the result.
+
+        Returns:
+            bytearray: Header followed by the encrypted data.
+        """
+        size = len(data)
+        pad_size = self.block_size - size % self.block_size if self.method == 'aes' else 0
+        frame = bytearray(len(header) + size + pad_size)
+        frame[:len(header)] = header
+        body = memoryview(frame)[len(header):]
+        body[:size] = data
+        if pad_size:
+            body[size:] = bytes((pad_size,)) * pad_size
+
+        with self._lock:
+            self._correct_first_block(body, self._encrypt_chain)
+            self._encryptor.encrypt(body, output=body)
+            self._encrypt_chain = self._chain_after(body, self._encrypt_chain)
+
+        return frame
+
+    def decrypt(self, data):
+        """Decrypt data. The result is the same as `Cipher.decrypt_aes` or `Cipher.decrypt_blowfish`.
+
+        Args:
+            data (bytes): Data to decrypt. Any bytes-like object, e.g. a memoryview.
+
+        Returns:
+            bytearray: Decrypted data.
+        """
+        buffer = bytearray(data)
+        if self.method == 'aes':
+            pad_size = self.block_size - len(buffer) % self.block_size
+            buffer += bytes((pad_size,)) * pad_size
+
+        with self._lock:
+            next_chain = self._chain_after(buffer, self._decrypt_chain)
+            self._decryptor.decrypt(buffer, output=buffer)
+            self._correct_first_block(buffer, self._decrypt_chain)
+            self._decrypt_chain = next_chain
+
+        return buffer
+
+
+class ReceivedMessagesStats:
+    """Live counters of the messages received by a remoted simulator.
+
+    They can be read from any thread at any moment, without consuming the received messages.
+
+    Args:
+        window (int): Seconds used to calculate the message and byte rates.
+
+    Attributes:
+        window (int): Seconds used to calculate the message and byte rates.
+        received_messages (int): Number of decrypted messages.
+        received_bytes (int): Size of the decrypted messages, as received.
+        decrypt_failures (int): Number of messages that could not be decrypted.
+        agents (dict): Received messages, received bytes and decrypt failures of each agent, by agent ID.
+    """
+
+    def __init__(self, window=10):
+        self.window = window
+        self.received_messages = 0
+        self.received_bytes = 0
+        self.decrypt_failures = 0
+        self.agents = {}
+        self._lock = threading.Lock()
+        self._second = int(time.monotonic())
+        self._second_messages = 0
+        self._second_bytes = 0
+        self._seconds = deque(maxlen=window)
+
+    def _get_agent(self, agent_id):
+        agent = self.agents.get(agent_id)
+        if agent is None:
+            agent = self.agents[agent_id] = {'received_messages': 0, 'received_bytes': 0, 'decrypt_failures': 0}
+        return agent
+
+    def _roll(self, second):
+        """Close the counters of the current second if it has already finished."""
+        if second != self._second:
+            self._seconds.append((self._second, self._second_messages, self._second_bytes))
+            self._second = second
+            self._second_messages = 0
+            self._second_bytes = 0
+
+    def add_message(self, agent_id, size):
+        """Count a decrypted message.
+
+        Args:
+            agent_id (str): ID of the agent that sent it.
+            size (int): Size of the message, as received.
+        """
+        with self._lock:
+            self._roll(int(time.monotonic()))
+            self.received_messages += 1
+            self.received_bytes += size
+            self._second_messages += 1
+            self._second_bytes += size
+            agent = self._get_agent(agent_id)
+            agent['received_messages'] += 1
+            agent['received_bytes'] += size
+
+    def add_decrypt_failure(self, agent_id):
+        """Count a message that could not be decrypted.
+
+        Args:
+            agent_id (str): ID of the agent that sent it.
+        """
+        with self._lock:
+            self.decrypt_failures += 1
+            self._get_agent(agent_id)['decrypt_failures'] += 1
+
+    def get_stats(self):
+        """Get a snapshot of the counters.
+
+        Returns:
+            dict: Totals, message and byte rates over the last `window` seconds and counters of each agent.
+        """
+        with self._lock:
+            now = int(time.monotonic())
+            self._roll(now)
+            seconds = [second for second in self._seconds if second[0] >= now - self.window]
+            elapsed = max(now - min((second[0] for second in seconds), default=now), 1)
+            return {
+                'received_messages': self.received_messages,
+                'received_bytes': self.received_bytes,
+                'decrypt_failures': self.decrypt_failures,
+                'messages_per_second': sum(second[1] for second in seconds) / elapsed,
+                'bytes_per_second': sum(second[2] for second in seconds) / elapsed,
+                'agents': {agent_id: dict(agent) for agent_id, agent in self.agents.items()}
+            }
+
+
+class WPKPackage:
+    """WPK file mapped in memory and served in chunks, so it can be sent to many agents without reading it again.
+
+    Args:
+        filepath (str): WPK file path.
+
+    Attributes:
+        filepath (str): WPK file path.
+        size (int): File size.
+        sha1 (str): SHA1 hash of the file.
+        signature (tuple): Modification time, size and inode of the file when it was mapped.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        with open(filepath, 'rb') as wpk_file:
+            stat = os.fstat(wpk_file.fileno())
+            self.size = stat.st_size
+            self.signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            data = mmap.mmap(wpk_file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+        self._data = memoryview(data)
+        self.sha1 = hashlib.sha1(self._data).hexdigest()
+
+    def get_chunk_count(self, chunk_size):
+        """Get the number of chunks of the file, including the last one, which is empty if `chunk_size` divides the
+        file size.
+
+        Args:
+            chunk_size (int): Chunk size.
+
+        Returns:
+            int: Number of chunks.
+        """
+        return self.size // chunk_size + 1
+
+    def get_chunk(self, index, chunk_size):
+        """Get a chunk of the file without copying it.
+
+        Args:
+            index (int): Chunk index.
+            chunk_size (int): Chunk size.
+
+        Returns:
+            memoryview: Chunk data.
+        """
+        return self._data[index * chunk_size:(index + 1) * chunk_size]
+
+    def iter_chunks(self, chunk_size):
+        """Iterate over the chunks of the file, like reading it `chunk_size` bytes at a time until a short read.
+
+        Args:
+            chunk_size (int): Chunk size.
+
+        Yields:
+            memoryview: Chunk data.
+        """
+        for index in range(self.get_chunk_count(chunk_size)):
+            yield self.get_chunk(index, chunk_size)
+
+
+_wpk_packages = {}
+_wpk_packages_lock = threading.Lock()
+
+
+def get_wpk_package(filepath):
+    """Get the WPK package of a file, mapping it again only if the file has changed.
+
+    Args:
+        filepath (str): WPK file path.
+
+    Returns:
+        WPKPackage: Package of the file.
+    """
+    stat = os.stat(filepath)
+    path = os.path.realpath(filepath)
+    with _wpk_packages_lock:
+        package = _wpk_packages.get(path)
+        if package is None or package.signature != (stat.st_mtime_ns, stat.st_size, stat.st_ino):
+            package = WPKPackage(path)
+            _wpk_packages[path] = package
+
+    return package
+
+
+def evict_wpk_packages(filepath=None):
+    """Remove WPK packages from the cache, so their files are unmapped once the upgrades sending them finish.
+
+    Args:
+        filepath (str): WPK file path. Default None to evict all the packages.
+    """
+    with _wpk_packages_lock:
+        if filepath is None:
+            _wpk_packages.clear()
+        else:
+            _wpk_packages.pop(os.path.realpath(filepath), None)
+
+
 class RemotedSimulator:
     """Create an AF_INET server socket for simulating remoted connection.
 
+    The received messages are kept according to `rcv_msg_retention`:
+        queue: In `rcv_msg_queue`. Receiving blocks when it has `rcv_msg_limit` messages (if greater than 0).
+        ring: In `rcv_msg_queue`, keeping only the last `rcv_msg_limit` messages.
+        count: Only in `stats`.
+        spill: Appended to `rcv_msg_spill_path` as JSON lines. Use `read_spilled_messages` to read them.
+    All of them are counted in `stats`.
+
     Args:
         server_address (str): Manager ip address.
         remoted_port (str): Remoted connection port.
@@ -63,10 +367,17 @@ class RemotedSimulator:
         client_keys (str): Client keys file path.
         start_on_init (boolean): Indicate if remoted simulator should start after initialization.
         rcv_msg_limit (int): max elements for the received message queue.
+        rcv_msg_retention (str): Retention policy of the received messages (queue, ring, count or spill).
+        rcv_msg_spill_path (str): File where the received messages are spilled. Default a new temporary file.
+
+    Raises:
+        ValueError: If the retention policy is not valid.
     """
+    retention_policies = ('queue', 'ring', 'count', 'spill')
 
     def __init__(self, server_address='127.0.0.1', remoted_port=1514, protocol='udp', mode='REJECT',
-                 client_keys=WAZUH_PATH + '/etc/client.keys', start_on_init=True, rcv_msg_limit=0):
+                 client_keys=WAZUH_PATH + '/etc/client.keys', start_on_init=True, rcv_msg_limit=0,
+                 rcv_msg_retention='queue', rcv_msg_spill_path=None):
         self.protocol = protocol
         self.global_count = 1234567891
         self.local_count = 5555
@@ -74,6 +385,7 @@ class RemotedSimulator:
         self.request_confirmed = False
         self.request_answer = None
         self.keys = ({}, {})
+        self.keystore = None
         self.encryption_key = ""
         self.mode = mode
         self.server_address = server_address
@@ -81,14 +393,32 @@ class RemotedSimulator:
         self.client_keys_path = client_keys
         self.last_message_ctx = ""
         self.running = False
-        self.upgrade_errors = False
-        self.upgrade_success = False
-        self.upgrade_notification = None
+        self._upgrade_condition = threading.Condition()
+        self._upgrade_errors = False
+        self._upgrade_success = False
+        self._upgrade_notification = None
         self.wcom_message_version = None
         self.active_response_message = None
         self.listener_thread = None
         self.last_client = None
-        self.rcv_msg_queue = Queue(rcv_msg_limit)
+        self.rcv_msg_retention = rcv_msg_retention
+        self.rcv_msg_spill_path = rcv_msg_spill_path
+        self.stats = ReceivedMessagesStats()
+        self._spill_file = None
+        if rcv_msg_retention not in self.retention_policies:
+            raise ValueError(f"Unknown retention policy '{rcv_msg_retention}'. "
+                             f"Valid ones: {', '.join(self.retention_policies)}")
+        if rcv_msg_retention == 'ring':
+            if rcv_msg_limit <= 0:
+                raise ValueError('The ring retention policy requires a positive rcv_msg_limit')
+            self.rcv_msg_queue = RingQueue(rcv_msg_limit)
+        else:
+            self.rcv_msg_queue = Queue(rcv_msg_limit)
+        if rcv_msg_retention == 'spill':
+            if self.rcv_msg_spill_path is None:
+                spill_fd, self.rcv_msg_spill_path = tempfile.mkstemp(prefix='remoted_sim_', suffix='.jsonl')
+                os.close(spill_fd)
+            self._spill_file = open(self.rcv_msg_spill_path, 'a')
 
         self.change_default_listener = False
         if start_on_init:
@@ -109,6 +439,39 @@ class RemotedSimulator:
             self.running = True
             self.listener_thread.start()
 
+    def _set_upgrade_state(self, name, value):
+        """Set an upgrade state attribute and wake up the threads waiting for it."""
+        with self._upgrade_condition:
+            setattr(self, name, value)
+            self._upgrade_condition.notify_all()
+
+    @property
+    def upgrade_errors(self):
+        """boolean: True if the upgrade process has failed."""
+        return self._upgrade_errors
+
+    @upgrade_errors.setter
+    def upgrade_errors(self, value):
+        self._set_upgrade_state('_upgrade_errors', value)
+
+    @property
+    def upgrade_success(self):
+        """boolean: True if the upgrade process has finished successfully."""
+        return self._upgrade_success
+
+    @upgrade_success.setter
+    def upgrade_success(self, value):
+        self._set_upgrade_state('_upgrade_success', value)
+
+    @property
+    def upgrade_notification(self):
+        """dict: Parameters of the upgrade notification of the agent. None until it is received."""
+        return self._upgrade_notification
+
+    @upgrade_notification.setter
+    def upgrade_notification(self, value):
+        self._set_upgrade_state('_upgrade_notification', value)
+
     def _start_socket(self):
         """Init remoted simulator socket."""
         if self.protocol == "tcp":
@@ -145,6 +508,12 @@ class RemotedSimulator:
             self.running = False
             self.listener_thread.join()
             self.sock.close()
+            if self._spill_file is not None:
+                self._spill_file.flush()
+            if self.keystore is not None:
+                self.keystore.close()
+                self.keystore = None
+            evict_wpk_packages()
 
     def create_encryption_key(self, agent_id, name, key):
         """Generate encryption key (using agent metadata and key).
@@ -258,6 +627,42 @@ class RemotedSimulator:
             pass
         return message
 
+    def build_com_request(self, request_id, command, payload=None):
+        """Build the request of a COM command, in the format of the configured WCOM message version.
+
+        Args:
+            request_id (int): Request counter.
+            command (str): Command.
+            payload (bytes): Optional binary data of the command.
+
+        Returns:
+            tuple: Request and binary data to append to it.
+        """
+        if command == 'lock_restart -1' or self.wcom_message_version is None:
+            return f"#!-req {request_id} com {command}", payload
+
+        return f"#!-req {request_id} upgrade {self.build_new_com_message(command, payload=payload)}", None
+
+    def is_com_answer_ok(self, command, answer, sha1hash=None):
+        """Check if the answer of a COM command reports success.
+
+        Args:
+            command (str): Command.
+            answer (str): Answer of the agent.
+            sha1hash (str): Expected SHA1 hash, checked if the command is sha1.
+
+        Returns:
+            boolean: True if the answer is successful.
+        """
+        if command == 'lock_restart -1' or self.wcom_message_version is None:
+            if not answer.startswith('ok '):
+                return False
+            return not command.startswith('sha1') or sha1hash is None or answer.split(' ')[1] == sha1hash
+
+        if '"error":0' not in answer:
+            return False
+        return not command.startswith('sha1') or sha1hash is None or f'"message":"{sha1hash}"' in answer
+
     def send_com_message(self, client_address, connection, command, payload=None, interruption_time=None):
         """
         Create a COM message
@@ -270,12 +675,8 @@ class RemotedSimulator:
             - interruption_time (int): Time that will be added in between connections.
         """
         self.request_counter += 1
-        if command == 'lock_restart -1' or self.wcom_message_version is None:
-            message = self.create_sec_message(f"#!-req {self.request_counter} com {command}", 'aes',
-                                              binary_data=payload)
-        else:
-            msg = self.build_new_com_message(command, payload=payload)
-            message = self.create_sec_message(f"#!-req {self.request_counter} upgrade {msg}", 'aes', None)
+        request, binary_data = self.build_com_request(self.request_counter, command, payload)
+        message = self.create_sec_message(request, 'aes', binary_data=binary_data)
         self.send(connection, message)
 
         if interruption_time:
@@ -308,14 +709,9 @@ class RemotedSimulator:
             elif ret:
                 self.send(connection, ret)
 
-        if command == 'lock_restart -1' or self.wcom_message_version is None:
-            if not self.request_answer.startswith('ok '):
-                self.upgrade_errors = True
-                raise
-        else:
-            if f'"error":0' not in self.request_answer:
-                self.upgrade_errors = True
-                raise
+        if not self.is_com_answer_ok(command, self.request_answer):
+            self.upgrade_errors = True
+            raise
 
         return self.request_answer
 
@@ -497,23 +893,14 @@ class RemotedSimulator:
                 self.send_com_message(client_address, connection, 'lock_restart -1')
                 self.send_com_message(client_address, connection, f'open wb {filename}',
                                       interruption_time=5 if simulate_interruption else None)
-                with open(filepath, 'rb') as f:
-                    bytes_stream = f.read(chunk_size)
-                    while len(bytes_stream) == chunk_size:
-                        self.send_com_message(client_address, connection, f'write {len(bytes_stream)} {filename} ',
-                                              payload=bytes_stream)
-                        bytes_stream = f.read(chunk_size)
-                    self.send_com_message(client_address, connection, f'write {len(bytes_stream)} {filename} ',
-                                          payload=bytes_stream)
+                for chunk in get_wpk_package(filepath).iter_chunks(chunk_size):
+                    self.send_com_message(client_address, connection, f'write {len(chunk)} {filename} ',
+                                          payload=chunk)
 
                 self.send_com_message(client_address, connection, f'close {filename}')
                 response = self.send_com_message(client_address, connection, f'sha1 {filename}')
 
-                if self.wcom_message_version is None:
-                    if response.split(' ')[1] != sha1hash:
-                        self.upgrade_errors = True
-                        raise
-                elif f'"message":"{sha1hash}"' not in response:
+                if not self.is_com_answer_ok(f'sha1 {filename}', response, sha1hash):
                     self.upgrade_errors = True
                     raise
 
@@ -585,8 +972,10 @@ class RemotedSimulator:
 
         # Update keys to encrypt/decrypt
         self.update_keys()
-        # TODO: Ask for specific keys depending on Agent Identifier
-        keys = self.get_key()
+        keys = self.get_key(agent_identifier, agent_identifier_type)
+        if keys is None:
+            # Like previous versions, unknown agents use the first key
+            keys = self.get_key()
         if keys is None:
             # No valid keys
             logger.error("Not valid keys used.")
@@ -595,24 +984,13 @@ class RemotedSimulator:
         self.create_encryption_key(id, name, key)
 
         # Decrypt message
-        rcv_msg = self.decrypt_message(received, crypto_method)
-
-        ## Store message
-        self.rcv_msg_queue.put(rcv_msg)
-
-        # Hash message means a response is required
-        if rcv_msg.find('#!-') != -1:
-            req_index = rcv_msg.find('#!-req')
-            if req_index != -1:
-                if int(rcv_msg[req_index:].split(' ')[1]) == self.request_counter:
-                    self.request_answer = ' '.join(rcv_msg[req_index:].split(' ')[2:])
-                    self.request_confirmed = True
-            hash_message = True
-        else:
-            hash_message = False
+        try:
+            rcv_msg = self.decrypt_message(received, crypto_method)
+        except (ValueError, zlib.error):
+            self.stats.add_decrypt_failure(id)
+            raise
 
-        if rcv_msg.find('upgrade_update_status') != -1:
-            self.upgrade_notification = json.loads(rcv_msg[rcv_msg.find('\"parameters\":') + 13:-1])
+        hash_message = self.store_message(rcv_msg, agent_id=id, size=len(received))
 
         # Save context of received message for future asserts
         self.last_message_ctx = '{} {} {}'.format(agent_identifier_type, agent_identifier, crypto_method)
@@ -635,20 +1013,67 @@ class RemotedSimulator:
 
         return msg
 
+    def store_message(self, rcv_msg, agent_id=None, size=0):
+        """Store a decrypted message, updating the request and upgrade status if it answers them.
+
+        Args:
+            rcv_msg (str): Decrypted message.
+            agent_id (str): ID of the agent that sent it.
+            size (int): Size of the message, as received.
+
+        Returns:
+            boolean: True if the message is a control message (#!-), which requires a response.
+        """
+        self.stats.add_message(agent_id, size)
+        if self.rcv_msg_retention == 'spill':
+            self._spill_file.write(json.dumps(rcv_msg) + '\n')
+        elif self.rcv_msg_retention != 'count':
+            self.rcv_msg_queue.put(rcv_msg)
+
+        # Hash message means a response is required
+        if rcv_msg.find('#!-') != -1:
+            req_index = rcv_msg.find('#!-req')
+            if req_index != -1:
+                if int(rcv_msg[req_index:].split(' ')[1]) == self.request_counter:
+                    self.request_answer = ' '.join(rcv_msg[req_index:].split(' ')[2:])
+                    self.request_confirmed = True
+            hash_message = True
+        else:
+            hash_message = False
+
+        if rcv_msg.find('upgrade_update_status') != -1:
+            self.upgrade_notification = json.loads(rcv_msg[rcv_msg.find('\"parameters\":') + 13:-1])
+
+        return hash_message
+
+    def read_spilled_messages(self):
+        """Read the messages spilled to `rcv_msg_spill_path`, without keeping them in memory.
+
+        Yields:
+            str: Received message.
+        """
+        if self._spill_file is not None:
+            self._spill_file.flush()
+        with open(self.rcv_msg_spill_path) as spill_file:
+            for line in spill_file:
+                yield json.loads(line)
+
     def update_keys(self):
-        """Update keys table with keys read from client.keys."""
-        if not os.path.exists(self.client_keys_path):
+        """Update keys table with keys read from client.keys.
+
+        The file is only read again if it has changed, so it can be called for every received message.
+        """
+        if self.keystore is None or self.keystore.client_keys_path != self.client_keys_path:
+            if self.keystore is not None:
+                self.keystore.close()
+            self.keystore = ClientKeysStore(self.client_keys_path)
+
+        if not self.keystore.by_id and not os.path.exists(self.client_keys_path):
             with open(self.client_keys_path, 'w+') as f:
                 f.write("100 ubuntu-agent any TopSecret")
 
-        with open(self.client_keys_path) as client_file:
-            client_lines = client_file.read().splitlines()
-
-            self.keys = ({}, {})
-            for line in client_lines:
-                (id, name, ip, key) = line.split(" ")
-                self.keys[0][id] = (id, name, ip, key)
-                self.keys[1][ip] = (id, name, ip, key)
+        self.keystore.refresh()
+        self.keys = (self.keystore.by_id, self.keystore.by_ip)
 
     def get_key(self, key=None, dictionary="by_id"):
         """Get an specific key.
@@ -664,9 +1089,9 @@ class RemotedSimulator:
                 return next(iter(self.keys[0].values()))
 
             if dictionary == "by_ip":
-                return self.keys[0][key]
-            else:
                 return self.keys[1][key]
+            else:
+                return self.keys[0][key]
         except:
             return None
 
@@ -697,10 +1122,8 @@ class RemotedSimulator:
             Boolean: Upgrade success message.
             String: Request answer.
         """
-        while not self.upgrade_success and not self.upgrade_errors and (timeout is None or timeout > 0):
-            time.sleep(1)
-            if timeout is not None:
-                timeout -= 1
+        with self._upgrade_condition:
+            self._upgrade_condition.wait_for(lambda: self._upgrade_success or self._upgrade_errors, timeout)
         return self.upgrade_success, self.request_answer
 
     def wait_upgrade_notification(self, timeout=None):
@@ -712,10 +1135,8 @@ class RemotedSimulator:
         Returns:
             string: Upgrade notification.
         """
-        while (self.upgrade_notification is None) and (timeout is None or timeout > 0):
-            time.sleep(1)
-            if timeout is not None:
-                timeout -= 1
+        with self._upgrade_condition:
+            self._upgrade_condition.wait_for(lambda: self._upgrade_notification is not None, timeout)
         return self.upgrade_notification
 
     def request(self, message):
@@ -727,3 +1148,647 @@ class RemotedSimulator:
         if self.last_client:
             request = self.create_sec_message(f'#!-req {self.request_counter} {message}', 'aes')
             self.send(self.last_client, request)
+
+
+class AgentConnection:
+    """State of an agent connection of `MultiAgentRemotedSimulator`.
+
+    Args:
+        protocol (str): Connection protocol (tcp or udp).
+        address (tuple): Agent address.
+        sock (socket): Connection socket. None for UDP agents, which share the server socket.
+
+    Attributes:
+        protocol (str): Connection protocol (tcp or udp).
+        address (tuple): Agent address.
+        sock (socket): Connection socket. None for UDP agents, which share the server socket.
+        agent_id (str): ID of the agent. None until its first message is received.
+        crypto_method (str): Encryption method of the last message of the agent (aes or blowfish).
+        received_messages (int): Number of messages received through the connection.
+        received_bytes (int): Number of bytes of the messages received through the connection.
+        sent_messages (int): Number of messages sent through the connection.
+        input_buffer (bytearray): Received data that does not complete a message yet.
+        output_buffer (bytearray): Data pending to be written to the socket.
+        events (int): Selector events the connection is registered for.
+        closed (boolean): True once the connection has been closed.
+    """
+
+    def __init__(self, protocol, address, sock=None):
+        self.protocol = protocol
+        self.address = address
+        self.sock = sock
+        self.agent_id = None
+        self.crypto_method = 'aes'
+        self.received_messages = 0
+        self.received_bytes = 0
+        self.sent_messages = 0
+        self.input_buffer = bytearray()
+        self.output_buffer = bytearray()
+        self.events = selectors.EVENT_READ
+        self.closed = False
+
+
+class UpgradeSession:
+    """Upgrade of an agent driven by `MultiAgentRemotedSimulator.upgrade_agents`.
+
+    The WPK is sent with the same sequence of commands as `RemotedSimulator.upgrade_listener`: lock_restart, open,
+    write of each chunk, close, sha1 and upgrade. Each command is sent once the answer of the previous one is received.
+
+    Args:
+        agent_id (str): ID of the agent.
+        filename (str): WPK file name in the agent.
+        package (WPKPackage): WPK package.
+        chunk_size (int): Size of the written chunks.
+        installer (str): Installer of the package.
+
+    Attributes:
+        agent_id (str): ID of the agent.
+        command (str): Last command sent to the agent.
+        success (boolean): True if the agent has been upgraded. None while the upgrade is running.
+        answer (str): Last answer of the agent, or the cause of the error.
+        sent_bytes (int): Number of WPK bytes sent to the agent.
+        start_time (float): Start time of the upgrade.
+        end_time (float): End time of the upgrade. None while the upgrade is running.
+    """
+
+    def __init__(self, agent_id, filename, package, chunk_size, installer):
+        self.agent_id = agent_id
+        self.filename = filename
+        self.package = package
+        self.chunk_size = chunk_size
+        self.installer = installer
+        self.command = None
+        self.success = None
+        self.answer = None
+        self.sent_bytes = 0
+        self.start_time = time.time()
+        self.end_time = None
+        self._commands = self._iter_commands()
+
+    def _iter_commands(self):
+        """Iterate over the commands of the upgrade and their payloads."""
+        yield 'lock_restart -1', None
+        yield f'open wb {self.filename}', None
+        for chunk in self.package.iter_chunks(self.chunk_size):
+            yield f'write {len(chunk)} {self.filename} ', chunk
+        yield f'close {self.filename}', None
+        yield f'sha1 {self.filename}', None
+        yield f'upgrade {self.filename} {self.installer}', None
+
+    def next_command(self):
+        """Get the next command of the upgrade.
+
+        Returns:
+            tuple: Command and payload. None if there are no more commands.
+        """
+        self.command, payload = next(self._commands, (None, None))
+        if payload is not None:
+            self.sent_bytes += len(payload)
+
+        return None if self.command is None else (self.command, payload)
+
+    def finish(self, success, answer):
+        """Set the result of the upgrade.
+
+        Args:
+            success (boolean): True if the agent has been upgraded.
+            answer (str): Last answer of the agent, or the cause of the error.
+        """
+        self.success = success
+        self.answer = answer
+        self.end_time = time.time()
+
+    @property
+    def finished(self):
+        """boolean: True once the upgrade has finished, successfully or not."""
+        return self.success is not None
+
+    @property
+    def elapsed(self):
+        """float: Duration of the upgrade in seconds."""
+        return (self.end_time or time.time()) - self.start_time
+
+
+class MultiAgentRemotedSimulator(RemotedSimulator):
+    """Remoted simulator serving many agents at the same time.
+
+    All the TCP connections and UDP datagrams are multiplexed with a selector in the listener thread, so thousands of
+    agents can be served concurrently. Each message is decrypted with the key of the agent sending it, looked up by the
+    agent ID of the message (or by its source IP if it has no ID), and the response is built with that key too.
+    The simulator mode can be set for specific agents with `set_mode`, and many agents can be upgraded concurrently
+    with `upgrade_agents`.
+
+    Args:
+        server_address (str): Manager ip address.
+        remoted_port (str): Remoted connection port.
+        protocol (str): Remoted protocol: tcp, udp or both of them (tcp,udp).
+        mode (str): Remoted mode (REJECT, DUMMY_ACK, CONTROLLED_ACK, WRONG_KEY, INVALID_MSG)
+        client_keys (str): Client keys file path.
+        start_on_init (boolean): Indicate if remoted simulator should start after initialization.
+        rcv_msg_limit (int): max elements for the received message queue.
+        rcv_msg_retention (str): Retention policy of the received messages (queue, ring, count or spill).
+        rcv_msg_spill_path (str): File where the received messages are spilled. Default a new temporary file.
+
+    Attributes:
+        sockets (dict): Server socket of each protocol.
+        connections (set): Open TCP connections.
+        agent_connections (dict): Last connection of each agent, by agent ID.
+        agent_modes (dict): Mode of specific agents, by agent ID. The rest of agents use `mode`.
+        counters (dict): Number of accepted connections and sent messages. The received ones are counted in `stats`.
+
+    Examples:
+        >>> remoted = MultiAgentRemotedSimulator(protocol='tcp,udp', mode='CONTROLLED_ACK', client_keys='client.keys')
+        >>> remoted.set_mode('REJECT', agent_id='002')
+        >>> remoted.get_counters()['received_messages']
+        1500
+        >>> sessions = remoted.upgrade_agents(['001', '002'], 'test.wpk', '/tmp/test.wpk', timeout=60)
+        >>> all(session.success for session in sessions.values())
+        True
+        >>> remoted.stop()
+    """
+    max_datagrams_per_wakeup = 256
+
+    def __init__(self, server_address='127.0.0.1', remoted_port=1514, protocol='udp', mode='REJECT',
+                 client_keys=WAZUH_PATH + '/etc/client.keys', start_on_init=True, rcv_msg_limit=0,
+                 rcv_msg_retention='queue', rcv_msg_spill_path=None):
+        self.sockets = {}
+        self.connections = set()
+        self.udp_connections = {}
+        self.agent_connections = {}
+        self.agent_modes = {}
+        self.counters = {'connections': 0, 'sent_messages': 0}
+        self._agents_sent_messages = {}
+        self._counters_lock = threading.Lock()
+        self._ciphers = {}
+        self._pending_requests = deque()
+        self._pending_upgrades = deque()
+        self._upgrade_requests = {}
+        self._selector = None
+        self._wakeup_receiver = None
+        self._wakeup_sender = None
+        super().__init__(server_address=server_address, remoted_port=remoted_port, protocol=protocol, mode=mode,
+                         client_keys=client_keys, start_on_init=start_on_init, rcv_msg_limit=rcv_msg_limit,
+                         rcv_msg_retention=rcv_msg_retention, rcv_msg_spill_path=rcv_msg_spill_path)
+
+    def _start_socket(self):
+        """Init a non-blocking server socket for each protocol.
+
+        Raises:
+            ValueError: If a protocol is not supported.
+        """
+        self.sockets = {}
+        for protocol in self.protocol.lower().replace(' ', '').split(','):
+            if protocol == 'tcp':
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                sock.bind((self.server_address, self.remoted_port))
+                sock.listen(socket.SOMAXCONN)
+            elif protocol == 'udp':
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                sock.bind((self.server_address, self.remoted_port))
+            else:
+                raise ValueError(f"Unknown protocol '{protocol}'")
+            sock.setblocking(False)
+            self.sockets[protocol] = sock
+        self.sock = next(iter(self.sockets.values()))
+        self._wakeup_receiver, self._wakeup_sender = socket.socketpair()
+        self._wakeup_receiver.setblocking(False)
+        self.update_keys()
+
+    def stop(self):
+        """Stop the listener thread and close all the sockets."""
+        if self.running:
+            super().stop()
+            for sock in self.sockets.values():
+                sock.close()
+            self._wakeup_receiver.close()
+            self._wakeup_sender.close()
+
+    def set_mode(self, mode, agent_id=None):
+        """Set Remoted simulator work mode, for all the agents or for a specific one.
+
+        Args:
+            mode (str): Remoted simulator mode (REJECT, DUMMY_ACK, CONTROLLED_ACK, WRONG_KEY, INVALID_MSG).
+            agent_id (str): ID of the agent. Default None to set the mode of the agents without a specific one.
+        """
+        if agent_id is None:
+            self.mode = mode
+        else:
+            self.agent_modes[agent_id] = mode
+
+    def get_counters(self):
+        """Get the number of connections and messages of the simulator and each agent.
+
+        Returns:
+            dict: `stats` snapshot, with the accepted, active connections and sent messages too.
+        """
+        counters = self.stats.get_stats()
+        with self._counters_lock:
+            counters.update(self.counters)
+            for agent_id, agent_counters in counters['agents'].items():
+                agent_counters['sent_messages'] = self._agents_sent_messages.get(agent_id, 0)
+        counters['active_connections'] = len(self.connections)
+
+        return counters
+
+    def get_agent_keys(self, agent_identifier_type, agent_identifier):
+        """Get the client keys entry of an agent, reloading client.keys if it has changed.
+
+        Args:
+            agent_identifier_type (str): Type of identifier (by_id or by_ip).
+            agent_identifier (str): Agent ID or IP address.
+
+        Returns:
+            tuple: Agent ID, name, IP and key. None if the agent is not found.
+        """
+        self.update_keys()
+        keys = self.keys[0] if agent_identifier_type == 'by_id' else self.keys[1]
+        agent_keys = keys.get(agent_identifier)
+        if agent_keys is None and agent_identifier_type == 'by_ip':
+            # Like RemotedSimulator, messages without ID use the first key
+            agent_keys = self.get_key()
+
+        return agent_keys
+
+    def get_cipher(self, agent_id, name, key, crypto_method):
+        """Get the cipher of an agent, creating it the first time.
+
+        Args:
+            agent_id (str): Agent id.
+            name (str): Agent name.
+            key (str): Agent key.
+            crypto_method (str): Encryption method (aes or blowfish).
+
+        Returns:
+            CipherContext: Pre-keyed cipher of the agent.
+        """
+        cipher = self._ciphers.get((agent_id, name, key, crypto_method))
+        if cipher is None:
+            self.create_encryption_key(agent_id, name, key)
+            cipher = CipherContext(self.encryption_key, crypto_method)
+            self._ciphers[(agent_id, name, key, crypto_method)] = cipher
+
+        return cipher
+
+    def create_agent_sec_message(self, message, cipher, binary_data=None):
+        """Create a sec_message to an agent, encrypted with its cipher.
+
+        Args:
+            message (str): Raw message.
+            cipher (CipherContext): Cipher of the agent.
+            binary_data (bytes): Binary data.
+
+        Returns:
+            bytes: Message with headers.
+        """
+        padded_sec_message = self.wazuh_padding(zlib.compress(self.compose_sec_message(message, binary_data)))
+
+        return bytes(cipher.encrypt(padded_sec_message, header=b'#AES:' if cipher.method == 'aes' else b':'))
+
+    def decode_agent_message(self, received, cipher):
+        """Decrypt and decompress a message received from an agent.
+
+        Args:
+            received (bytes): Message without the agent ID.
+            cipher (CipherContext): Cipher of the agent.
+
+        Returns:
+            str: Decoded message.
+        """
+        data = memoryview(received)[5:] if cipher.method == 'aes' else memoryview(received)[1:]
+
+        return zlib.decompress(cipher.decrypt(data).lstrip(b'!')).decode('ISO-8859-1')
+
+    def process_agent_message(self, connection, received):
+        """Process a message received from an agent and answer according to the mode of the agent.
+
+        Args:
+            connection (AgentConnection): Connection the message has been received from.
+            received (bytes): Received message.
+
+        Returns:
+            bytes: Response. None if there is no response, -1 if the connection has to be closed.
+        """
+        if received == b'#ping':
+            return b'#pong'
+
+        if received[:1] == b'!':
+            agent_identifier_type = 'by_id'
+            index = received.find(b'!', 1)
+            agent_identifier = received[1:index].decode()
+            received = received[index + 1:]
+        else:
+            agent_identifier_type = 'by_ip'
+            agent_identifier = connection.address[0]
+        crypto_method = 'aes' if received.startswith(b'#AES') else 'blowfish'
+
+        agent_keys = self.get_agent_keys(agent_identifier_type, agent_identifier)
+        if agent_keys is None:
+            logger.error(f"Not valid keys for agent {agent_identifier}.")
+            return -1
+        agent_id, name, _, key = agent_keys
+        cipher = self.get_cipher(agent_id, name, key, crypto_method)
+
+        try:
+            rcv_msg = self.decode_agent_message(received, cipher)
+        except (ValueError, zlib.error):
+            self.stats.add_decrypt_failure(agent_id)
+            raise
+        hash_message = self.store_message(rcv_msg, agent_id=agent_id, size=len(received))
+        if self._upgrade_requests and hash_message:
+            self._answer_upgrade_request(rcv_msg)
+        connection.agent_id = agent_id
+        connection.crypto_method = crypto_method
+        connection.received_messages += 1
+        connection.received_bytes += len(received)
+        self.agent_connections[agent_id] = connection
+        self.last_client = connection
+
+        # Save context of received message for future asserts
+        self.last_message_ctx = f"{agent_identifier_type} {agent_identifier} {crypto_method}"
+
+        # Create response
+        mode = self.agent_modes.get(agent_id, self.mode)
+        if mode == "REJECT":
+            return -1
+        elif mode == "CONTROLLED_ACK" and not hash_message:
+            return None
+        elif mode == "WRONG_KEY":
+            cipher = self.get_cipher(agent_id + 'inv', name + 'inv', key + 'inv', crypto_method)
+        elif mode == "INVALID_MSG":
+            return self.create_invalid()
+
+        return self.create_agent_sec_message("#!-agent ack ", cipher)
+
+    def request(self, message, agent_id=None):
+        """Send request to an agent using current request counter. It can be called from any thread.
+
+        Args:
+            message (str): Request content.
+            agent_id (str): ID of the agent. Default None to send it to the last agent that sent a message.
+        """
+        self._pending_requests.append((agent_id, message))
+        self._wakeup_sender.send(b'\0')
+
+    def upgrade_agents(self, agent_ids, filename, filepath, chunk_size=512, installer='upgrade.sh', timeout=None):
+        """Upgrade many agents concurrently, sending them the same WPK from memory.
+
+        The agents must be connected and the answers must be in the format of the WCOM message version set with
+        `set_wcom_message_version`, as in `upgrade_listener`. The WPK is mapped in memory once and its chunks are sent
+        without copying them, so the upgrade throughput is not limited by the simulator.
+
+        Args:
+            agent_ids (list): IDs of the agents to upgrade.
+            filename (str): WPK file name in the agents.
+            filepath (str): WPK file path.
+            chunk_size (int): Size of the written chunks.
+            installer (str): Installer of the package.
+            timeout (float): Max time to wait for all the upgrades, in seconds. Default None to wait forever.
+
+        Returns:
+            dict: Upgrade session of each agent, by agent ID. The unfinished ones have `success` set to None.
+        """
+        package = get_wpk_package(filepath)
+        sessions = {agent_id: UpgradeSession(agent_id, filename, package, chunk_size, installer)
+                    for agent_id in agent_ids}
+        self._pending_upgrades.extend(sessions.values())
+        self._wakeup_sender.send(b'\0')
+
+        with self._upgrade_condition:
+            self._upgrade_condition.wait_for(lambda: all(session.finished for session in sessions.values()), timeout)
+
+        return sessions
+
+    def listener(self):
+        """Listener thread to serve all the agent connections until the simulator is stopped."""
+        selector = selectors.DefaultSelector()
+        self._selector = selector
+        for protocol, sock in self.sockets.items():
+            selector.register(sock, selectors.EVENT_READ, protocol)
+        selector.register(self._wakeup_receiver, selectors.EVENT_READ, 'wakeup')
+
+        try:
+            while self.running:
+                for key, events in selector.select(timeout=0.5):
+                    if key.data == 'tcp':
+                        self._accept(selector, key.fileobj)
+                    elif key.data == 'udp':
+                        self._receive_datagrams(selector, key.fileobj)
+                    elif key.data == 'wakeup':
+                        self._send_requests(selector)
+                    else:
+                        if events & selectors.EVENT_READ:
+                            self._receive(selector, key.data)
+                        if events & selectors.EVENT_WRITE and not key.data.closed:
+                            self._flush(selector, key.data)
+        finally:
+            for connection in list(self.connections):
+                self._close(selector, connection)
+            selector.close()
+
+    def _accept(self, selector, server_socket):
+        """Accept all the pending TCP connections."""
+        while True:
+            try:
+                sock, address = server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as error:
+                logger.error(f"Error accepting an agent connection: {error}")
+                return
+            sock.setblocking(False)
+            connection = AgentConnection('tcp', address, sock)
+            selector.register(sock, connection.events, connection)
+            self.connections.add(connection)
+            with self._counters_lock:
+                self.counters['connections'] += 1
+
+    def _receive(self, selector, connection):
+        """Read the available data of a TCP connection and process its complete messages."""
+        try:
+            data = connection.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._close(selector, connection)
+            return
+
+        buffer = connection.input_buffer
+        buffer += data
+        offset = 0
+        while len(buffer) - offset >= 4:
+            size = struct.unpack_from('<I', buffer, offset)[0]
+            if len(buffer) - offset - 4 < size:
+                break
+            message = bytes(buffer[offset + 4:offset + 4 + size])
+            offset += 4 + size
+            self._process(selector, connection, message)
+            if connection.closed:
+                return
+        del buffer[:offset]
+
+    def _receive_datagrams(self, selector, server_socket):
+        """Read and process the pending UDP messages."""
+        for _ in range(self.max_datagrams_per_wakeup):
+            try:
+                message, address = server_socket.recvfrom(65536)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                continue
+            connection = self.udp_connections.get(address)
+            if connection is None:
+                connection = self.udp_connections[address] = AgentConnection('udp', address)
+            self._process(selector, connection, message)
+
+    def _process(self, selector, connection, message):
+        """Process a message and send its response."""
+        try:
+            response = self.process_agent_message(connection, message)
+        except Exception as error:
+            logger.error(f"Error processing a message from {connection.address}: {error}")
+            response = -1
+
+        # Response -1 means connection have to be closed
+        if response == -1:
+            if connection.protocol == 'tcp':
+                self._close(selector, connection)
+            return
+        # If there is a response, answer it
+        if response:
+            self._send_message(selector, connection, response)
+
+        # Active response message
+        if self.active_response_message:
+            message = self.create_agent_sec_message(f"#!-execd {self.active_response_message}",
+                                                    self._get_connection_cipher(connection))
+            self.active_response_message = None
+            self._send_message(selector, connection, message)
+
+    def _get_connection_cipher(self, connection):
+        """Get the cipher of the agent of a connection, used for the messages that are not responses."""
+        _, name, _, key = self.keys[0][connection.agent_id]
+
+        return self.get_cipher(connection.agent_id, name, key, connection.crypto_method)
+
+    def _send_requests(self, selector):
+        """Send the requests queued by `request`."""
+        try:
+            while self._wakeup_receiver.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+        while self._pending_requests:
+            agent_id, message = self._pending_requests.popleft()
+            connection = self.last_client if agent_id is None else self.agent_connections.get(agent_id)
+            if connection is None or connection.closed:
+                logger.error(f"There is no connection with agent {agent_id} to send the request to.")
+                continue
+            request = self.create_agent_sec_message(f'#!-req {self.request_counter} {message}',
+                                                    self._get_connection_cipher(connection))
+            self._send_message(selector, connection, request)
+
+        while self._pending_upgrades:
+            self._send_upgrade_command(selector, self._pending_upgrades.popleft())
+
+    def _send_upgrade_command(self, selector, session):
+        """Send the next command of an upgrade session, finishing it if there are no more commands."""
+        command = session.next_command()
+        if command is None:
+            self._finish_upgrade(session, True, session.answer)
+            return
+
+        connection = self.agent_connections.get(session.agent_id)
+        if connection is None or connection.closed:
+            self._finish_upgrade(session, False, f"There is no connection with agent {session.agent_id}")
+            return
+
+        self.request_counter += 1
+        self._upgrade_requests[self.request_counter] = session
+        request, binary_data = self.build_com_request(self.request_counter, *command)
+        self._send_message(selector, connection,
+                           self.create_agent_sec_message(request, self._get_connection_cipher(connection), binary_data))
+
+    def _answer_upgrade_request(self, rcv_msg):
+        """Check the answer of an upgrade command and continue with the next command of its session."""
+        req_index = rcv_msg.find('#!-req')
+        if req_index == -1:
+            return
+        fields = rcv_msg[req_index:].split(' ')
+        try:
+            session = self._upgrade_requests.pop(int(fields[1]), None)
+        except ValueError:
+            return
+        if session is None:
+            return
+
+        session.answer = ' '.join(fields[2:])
+        if self.is_com_answer_ok(session.command, session.answer, session.package.sha1):
+            self._send_upgrade_command(self._selector, session)
+        else:
+            self._finish_upgrade(session, False, session.answer)
+
+    def _finish_upgrade(self, session, success, answer):
+        """Set the result of an upgrade session and wake up the threads waiting for it."""
+        with self._upgrade_condition:
+            session.finish(success, answer)
+            self._upgrade_condition.notify_all()
+
+    def _send_message(self, selector, connection, data):
+        """Send a message to an agent. TCP data that cannot be written at once is written when the socket is ready."""
+        self.update_counters()
+        connection.sent_messages += 1
+        with self._counters_lock:
+            self.counters['sent_messages'] += 1
+            self._agents_sent_messages[connection.agent_id] = \
+                self._agents_sent_messages.get(connection.agent_id, 0) + 1
+
+        if connection.protocol == 'udp':
+            try:
+                self.sockets['udp'].sendto(data, connection.address)
+            except OSError:
+                pass
+            return
+
+        pending = bool(connection.output_buffer)
+        connection.output_buffer += pack('<I', len(data))
+        connection.output_buffer += data
+        if not pending:
+            self._flush(selector, connection)
+
+    def _flush(self, selector, connection):
+        """Write the pending data of a TCP connection, waiting for the socket to be writable if it is not all sent."""
+        try:
+            sent = connection.sock.send(connection.output_buffer)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            self._close(selector, connection)
+            return
+        del connection.output_buffer[:sent]
+
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if connection.output_buffer else 0)
+        if events != connection.events:
+            selector.modify(connection.sock, events, connection)
+            connection.events = events
+
+    def _close(self, selector, connection):
+        """Close a TCP connection."""
+        if connection.closed:
+            return
+        connection.closed = True
+        selector.unregister(connection.sock)
+        connection.sock.close()
+        self.connections.discard(connection)
+        if self.agent_connections.get(connection.agent_id) is connection:
+            del self.agent_connections[connection.agent_id]
+            for request_id, session in list(self._upgrade_requests.items()):
+                if session.agent_id == connection.agent_id:
+                    del self._upgrade_requests[request_id]
+                    self._finish_upgrade(session, False, f"Connection with agent {session.agent_id} closed")
+        if self.last_client is connection:
+            self.last_client = None
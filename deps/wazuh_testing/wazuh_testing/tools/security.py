@@ -11,11 +11,18 @@ if platform.system() == 'Windows':  # Windows
 
 class CertificateController(object):
 
-    def __init__(self):
+    def __init__(self, ca_key=None, ca_cert=None):
+        """
+        Args:
+            ca_key (PKey): Existing CA key. If None, a new key pair is generated.
+            ca_cert (X509): Existing CA certificate of `ca_key`. If None, a new one is created.
+        """
         # Generates key pair .
-        self.ca_key = crypto.PKey()
-        self.ca_key.generate_key(crypto.TYPE_RSA, 4096)
-        self.ca_cert = self._create_ca_cert(self.ca_key)
+        if ca_key is None:
+            ca_key = crypto.PKey()
+            ca_key.generate_key(crypto.TYPE_RSA, 4096)
+        self.ca_key = ca_key
+        self.ca_cert = self._create_ca_cert(self.ca_key) if ca_cert is None else ca_cert
         self.digest = 'sha256WithRSAEncryption'
 
     def get_root_ca_cert(self):
@@ -13,6 +13,100 @@ from wazuh_testing.tools.utils import retry
 request_socket = path.join(WAZUH_PATH, 'queue', 'sockets', 'request')
 request_protocol = "tcp"
 
+WAZUH_HEADER = struct.Struct('<I')
+
+
+def recv_exact(sock, size, flags=0, buffer=None, stop_event=None):
+    """Receive exactly `size` bytes, writing them directly into a single buffer with `recv_into`.
+
+    Args:
+        sock (socket.socket): Socket to read from.
+        size (int): Number of bytes to receive.
+        flags (int): Optional - Flags passed to `recv_into`.
+        buffer (bytearray or memoryview): Optional - Preallocated buffer to fill. A new one is allocated by default.
+        stop_event (threading.Event): Optional - If the socket has a timeout, keep waiting after each timeout until
+            this event is set. Without it, timeouts are raised.
+
+    Returns:
+        bytearray or memoryview: Received data. It is shorter than `size` if the connection was closed or
+            `stop_event` was set. If `buffer` is given, a memoryview over it is returned.
+    """
+    data = bytearray(size) if buffer is None else buffer
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        try:
+            chunk_size = sock.recv_into(view[received:size], size - received, flags)
+        except socket.timeout:
+            if stop_event is None:
+                raise
+            if stop_event.is_set():
+                break
+            continue
+        if chunk_size == 0:
+            break
+        received += chunk_size
+
+    if buffer is not None:
+        return view[:received]
+    view.release()
+    if received < size:
+        del data[received:]
+
+    return data
+
+
+def recv_frame(sock, flags=0, stop_event=None, header=WAZUH_HEADER):
+    """Receive a message prefixed with its size, as the Wazuh sockets do.
+
+    Args:
+        sock (socket.socket): Socket to read from.
+        flags (int): Optional - Flags passed to `recv_into`.
+        stop_event (threading.Event): Optional - Event that stops waiting after a socket timeout.
+        header (struct.Struct): Optional - Format of the size header. Wazuh header (`<I`) by default.
+
+    Returns:
+        bytearray: Payload of the message, without the header. Empty if the connection was closed.
+    """
+    size = recv_exact(sock, header.size, flags, stop_event=stop_event)
+    if len(size) < header.size:
+        return bytearray()
+
+    return recv_exact(sock, header.unpack(size)[0], flags, stop_event=stop_event)
+
+
+def recv_available(sock, chunk_size=4096):
+    """Receive a message of unknown size, reading until no more data is available.
+
+    The first read blocks. If it fills a whole chunk, the socket is drained without blocking. Data is written in
+    place into a buffer that grows geometrically, instead of concatenating every chunk.
+
+    Args:
+        sock (socket.socket): Socket to read from.
+        chunk_size (int): Optional - Size of the first read and minimum free space for each following read.
+
+    Returns:
+        bytearray: Received data.
+    """
+    data = bytearray(chunk_size)
+    with memoryview(data) as view:
+        received = sock.recv_into(view, chunk_size)
+    if received == chunk_size:
+        while True:
+            if len(data) - received < chunk_size:
+                data.extend(bytes(len(data)))
+            try:  # error means no more data
+                with memoryview(data) as view:
+                    chunk = sock.recv_into(view[received:], 0, socket.MSG_DONTWAIT)
+            except Exception:
+                break
+            if chunk == 0:
+                break
+            received += chunk
+    del data[received:]
+
+    return data
+
 
 class WazuhSocket:
     def __init__(self, socket_file=request_socket):
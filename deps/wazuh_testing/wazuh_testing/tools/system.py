@@ -2,7 +2,9 @@
 # Created by Wazuh, Inc. <info@wazuh.com>.
 # This program is free software; you can redistribute it and/or modify it under the terms of GPLv2
 
+import base64
 import json
+import shlex
 import tempfile
 import xml.dom.minidom as minidom
 from typing import Union
@@ -125,6 +127,78 @@ class HostManager:
         """
         return self.get_host(host).file(file_path).content_string
 
+    def supports_incremental_read(self, host: str):
+        """Check if the specified host can run the command used by `get_file_content_from_offset`.
+
+        The command is run on `/dev/null`, so hosts without the GNU versions of `stat` and `base64` are detected.
+
+        Args:
+            host (str): Hostname
+
+        Returns:
+            bool: True if the host can read files incrementally, False otherwise.
+        """
+        cmd = f"{{ {self._read_from_offset_command('/dev/null', 0, None, None)}; }} 2>/dev/null | tail -n 1 | " \
+              f"grep -qx end && echo yes || echo no"
+
+        return self.run_shell(host, cmd) == 'yes'
+
+    @staticmethod
+    def _read_from_offset_command(file_path, offset, inode, checksum, window=4096):
+        # Positional parameters: $1 is the current inode of the file and $2 its current size. The file is read from
+        # the start if it is another one, it is shorter than `offset` or the `window` bytes before `offset` do not
+        # match `checksum`. The output is the inode, the start position and the size of the file, the base64 encoded
+        # content, the checksum of the last `window` bytes read and an end marker
+        path = shlex.quote(file_path)
+        offset = int(offset)
+        checks = [f'[ "$2" -ge {offset} ]']
+        if inode is not None:
+            checks.append(f'[ "$1" = "{int(inode)}" ]')
+        if checksum is not None:
+            window_start = max(0, offset - window)
+            checks.append(f'[ "$(tail -c +{window_start + 1} {path} | head -c {offset - window_start} | cksum)" = '
+                          f'{shlex.quote(checksum)} ]')
+        return f"file_stat=$(stat -c '%i %s' {path}) && set -- $file_stat && start={offset} && " \
+               f"{{ {' && '.join(checks)} || start=0; }} && echo \"$1 $start $2\" && " \
+               f"tail -c +$((start + 1)) {path} | head -c $(($2 - start)) | base64 -w0 && echo && " \
+               f"window_start=$(($2 > {window} ? $2 - {window} : 0)) && " \
+               f"tail -c +$((window_start + 1)) {path} | head -c $(($2 - window_start)) | cksum && echo end"
+
+    def get_file_content_from_offset(self, host: str, file_path: str, offset: int = 0, inode: int = None,
+                                     checksum: str = None):
+        """Get the content appended to the specified file since a given offset.
+
+        Only the new bytes are transferred from the host. If the file has been truncated or replaced by another one
+        (a different inode), the whole file is returned. A truncation is detected even if the file has grown past
+        `offset` again, by comparing the checksum of the bytes before `offset` with the one of the previous call.
+
+        Args:
+            host (str): Hostname
+            file_path (str): Path of the file
+            offset (int): Size of the file in bytes the last time it was read. Default `0`
+            inode (int): Inode of the file the last time it was read. Default `None`
+            checksum (str): Checksum returned by the previous call. Default `None`
+
+        Returns:
+            tuple(bytes, int, int, str): New content of the file, position of the content in the file, inode of the
+                file and checksum to use in the next call. The position is `offset`, or 0 if the file has been
+                truncated or replaced.
+
+        Raises:
+            FileNotFoundError: If the file cannot be read, i.e. it does not exist or it is being rotated.
+            OSError: If the content could not be read completely.
+        """
+        cmd = self._read_from_offset_command(file_path, offset, inode, checksum)
+        lines = self.run_shell(host, cmd).rstrip('\n').split('\n')
+        try:
+            new_inode, start, _ = map(int, lines[0].split())
+        except ValueError:
+            raise FileNotFoundError(f'{file_path} could not be read in {host}')
+        if len(lines) != 4 or lines[3] != 'end':
+            raise OSError(f'The content of {file_path} could not be read in {host}')
+
+        return base64.b64decode(lines[1]), start, new_inode, lines[2]
+
     def apply_config(self, config_yml_path: str, dest_path: str = WAZUH_CONF, clear_files: list = None,
                      restart_services: list = None):
         """Apply the configuration described in the config_yml_path to the environment.
@@ -11,6 +11,7 @@ import time
 from wazuh_testing.tools import GLOBAL_DB_PATH, WAZUH_DB_SOCKET_PATH
 from wazuh_testing.tools.monitoring import wazuh_pack, wazuh_unpack
 from wazuh_testing.tools.services import control_service
+from wazuh_testing.tools.sockets import recv_exact
 
 
 def callback_wazuhdb_response(item):
@@ -146,7 +147,7 @@ def query_wdb(command):
         if len(rcv) == 4:
             data_len = wazuh_unpack(rcv)
 
-            data = sock.recv(data_len).decode()
+            data = recv_exact(sock, data_len).decode()
 
             # Remove response header and cast str to list of dictionaries
             # From --> 'ok [ {data1}, {data2}...]' To--> [ {data1}, data2}...]
@@ -158,6 +159,30 @@ def query_wdb(command):
     return data
 
 
+def get_agents_connection_status(agent_ids, chunk_size=500):
+    """Get the connection status of many agents, with a single wazuh-db query for each `chunk_size` agents.
+
+    Args:
+        agent_ids (list): Agents IDs, as int or str (e.g. `'001'`).
+        chunk_size (int): Maximum number of agents of each query, to keep the responses below the wazuh-db limit.
+
+    Returns:
+        dict: Connection status of each agent found in global.db, indexed by its ID as given in `agent_ids`.
+    """
+    ids = {int(agent_id): agent_id for agent_id in agent_ids}
+    sorted_ids = sorted(ids)
+    statuses = {}
+
+    for start in range(0, len(sorted_ids), chunk_size):
+        ids_list = ','.join(str(agent_id) for agent_id in sorted_ids[start:start + chunk_size])
+        response = query_wdb(f"global sql SELECT id, connection_status FROM agent WHERE id IN ({ids_list})")
+        if isinstance(response, list):
+            for row in response:
+                statuses[ids[row['id']]] = row['connection_status']
+
+    return statuses
+
+
 def clean_agents_from_db():
     """
     Clean agents from DB
@@ -20,7 +20,7 @@ from wazuh_testing.logcollector import create_file_structure, delete_file_struct
 from wazuh_testing.tools import LOG_FILE_PATH, WAZUH_CONF, get_service, ALERT_FILE_PATH, WAZUH_LOCAL_INTERNAL_OPTIONS
 from wazuh_testing.tools.configuration import get_wazuh_conf, set_section_wazuh_conf, write_wazuh_conf
 from wazuh_testing.tools.file import truncate_file, recursive_directory_creation, remove_file, copy, write_file
-from wazuh_testing.tools.monitoring import QueueMonitor, FileMonitor, SocketController, close_sockets
+from wazuh_testing.tools.monitoring import QueueMonitor, FileMonitor, SocketController, SharedFileTailer, close_sockets
 from wazuh_testing.tools.services import control_service, check_daemon_status, delete_dbs
 from wazuh_testing.tools.time import TimeMachine
 from wazuh_testing import mocking
@@ -902,7 +902,7 @@ def file_monitoring(request):
 
     logger.debug(f"Initializing file to monitor to {file_to_monitor}")
 
-    file_monitor = FileMonitor(file_to_monitor)
+    file_monitor = FileMonitor(file_to_monitor, shared=True)
     setattr(request.module, 'log_monitor', file_monitor)
 
     yield
@@ -911,6 +911,14 @@ def file_monitoring(request):
     logger.debug(f"Trucanted {file_to_monitor}")
 
 
+@pytest.fixture(scope='session', autouse=True)
+def shutdown_shared_file_tailers():
+    """Stop the shared file tailers started by the shared file monitors at the end of the session."""
+    yield
+
+    SharedFileTailer.shutdown_all()
+
+
 @pytest.fixture(scope='module')
 def configure_local_internal_options_module(request):
     """Fixture to configure the local internal options file.
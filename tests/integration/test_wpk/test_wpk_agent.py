@@ -50,7 +50,6 @@ pytest_args:
 tags:
     - wpk
 '''
-import hashlib
 import os
 import platform
 import pytest
@@ -66,7 +65,7 @@ from datetime import datetime
 from wazuh_testing.tools import WAZUH_PATH, get_version, get_service
 from wazuh_testing.tools.authd_sim import AuthdSimulator
 from wazuh_testing.tools.configuration import load_wazuh_configurations
-from wazuh_testing.tools.file import truncate_file, count_file_lines
+from wazuh_testing.tools.file import truncate_file, count_file_lines, stream_download_file
 from wazuh_testing.tools.remoted_sim import RemotedSimulator
 from wazuh_testing.tools.services import control_service
 from wazuh_testing.agent import callback_detect_upgrade_ack_event, callback_upgrade_module_up, callback_exit_cleaning
@@ -326,21 +325,14 @@ def download_wpk(get_configuration):
         wpk_url = protocol + wpk_repo \
             + "linux/" + architecture + "/" + wpk_file
         wpk_file_path = os.path.join(WAZUH_PATH, 'var', wpk_file)
+    # Download the WPK getting its SHA1 file sum
     try:
-        result = requests.get(wpk_url)
+        sha1hash = stream_download_file(wpk_url, wpk_file_path)
+    except requests.exceptions.HTTPError:
+        raise Exception("Can't access to the WPK file in {}".format(wpk_url))
     except requests.exceptions.RequestException:
         raise Exception("The WPK package could not be obtained")
 
-    if result.ok:
-        with open(wpk_file_path, 'wb') as fd:
-            for chunk in result.iter_content(chunk_size=128):
-                fd.write(chunk)
-    else:
-        raise Exception("Can't access to the WPK file in {}".format(wpk_url))
-
-    # Get SHA1 file sum
-    sha1hash = hashlib.sha1(open(wpk_file_path, 'rb').read()).hexdigest()
-
     metadata = get_configuration.get('metadata')
     metadata['filename'] = wpk_file
     metadata['filepath'] = wpk_file_path
@@ -62,7 +62,7 @@ from wazuh_testing.tools import WAZUH_PATH, LOG_FILE_PATH, UPGRADE_PATH, get_ver
 from wazuh_testing.tools.configuration import load_wazuh_configurations
 from wazuh_testing.tools.agent_simulator import Sender, Injector
 from wazuh_testing.tools.services import control_service
-from wazuh_testing.tools.file import truncate_file
+from wazuh_testing.tools.file import truncate_file, stream_download_file
 from wazuh_testing.tools.monitoring import FileMonitor
 from wazuh_testing import global_parameters
 from wazuh_testing.tools.sockets import WazuhSocket
@@ -882,17 +882,12 @@ def get_sha_list(metadata):
 
     if not os.path.exists(wpk_file_path) and (not valid_sha1_list.get(wpk_file)):
         try:
-            result = requests.get(wpk_url)
+            valid_sha1_list[wpk_file] = stream_download_file(wpk_url, wpk_file_path)
+        except requests.exceptions.HTTPError:
+            raise Exception("Can't access to the WPK file in {}".format(wpk_url))
         except requests.exceptions.RequestException:
             raise Exception("The WPK package could not be obtained")
 
-        if result.ok:
-            with open(wpk_file_path, 'wb') as fd:
-                for chunk in result.iter_content(chunk_size=128):
-                    fd.write(chunk)
-        else:
-            raise Exception("Can't access to the WPK file in {}".format(wpk_url))
-
     # Get SHA1 file sum
     if valid_sha1_list.get(wpk_file):
         sha1hash = valid_sha1_list.get(wpk_file)